@@ -0,0 +1,53 @@
+"""
+Benchmark :meth:`SearchContext.constrain()`.
+
+Compares refining a context with the previous implementation, which
+deep-copied the context including its connection, against the current
+copy-on-write implementation.  No queries are sent.
+
+Usage::
+
+    $ python benchmarks/bench_constrain.py
+
+"""
+
+import copy
+import timeit
+
+from pyesgf.search import SearchConnection
+
+
+def deepcopy_constrain(context, **constraints):
+    # Locks cannot be copied so they are shared
+    conn = context.connection
+    locks = [conn._lock]
+    if conn._counts_cache is not None:
+        locks.append(conn._counts_cache._lock)
+    new_sc = copy.deepcopy(context, dict((id(lock), lock) for lock in locks))
+    new_sc._update_constraints(constraints)
+    return new_sc
+
+
+def main(number=2000):
+    conn = SearchConnection('https://esgf.ceda.ac.uk/esg-search',
+                            distrib=False)
+    conn.open()
+    conn._available_shards = dict(('index%d.example.org' % i,
+                                   [('8983', 'solr')]) for i in range(50))
+    context = conn.new_context(project='CMIP6', experiment_id='historical',
+                               variable_id=['tas', 'pr', 'psl'],
+                               facets='source_id,member_id')
+
+    for name, constrain in [
+            ('deepcopy', lambda: deepcopy_constrain(context,
+                                                    source_id='UKESM1-0-LL')),
+            ('copy-on-write', lambda: context.constrain(
+                source_id='UKESM1-0-LL'))]:
+        t = timeit.timeit(constrain, number=number)
+        print('%-15s %8.1f us per constrain()' % (name, t / number * 1e6))
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
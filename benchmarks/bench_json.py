@@ -0,0 +1,56 @@
+r"""
+Benchmark the JSON decoders available for search responses.
+
+Recorded Solr responses may be given as arguments, e.g. saved with::
+
+    $ curl -o files.json \
+        'https://esgf.ceda.ac.uk/esg-search/search?type=File&format=application%2Fsolr%2Bjson&limit=1000&fields=*'
+    $ python benchmarks/bench_json.py files.json
+
+Without arguments a synthetic File search response is used.
+
+"""
+
+import json
+import sys
+import timeit
+
+from pyesgf.search.decoders import JSON_DECODERS
+
+
+def synthetic_response(n_docs=1000):
+    docs = []
+    for i in range(n_docs):
+        path = 'CMIP6/CMIP/MOHC/UKESM1-0-LL/historical/r1i1p1f2/Amon/tas/gn/v20190406/tas_%d.nc' % i  # noqa
+        docs.append({
+            'id': 'CMIP6.CMIP.MOHC.UKESM1-0-LL.historical.r1i1p1f2.Amon.tas.gn.v20190406.tas_%d.nc|esgf-data3.ceda.ac.uk' % i,  # noqa
+            'version': '1', 'size': 123456789 + i, 'title': 'tas_%d.nc' % i,
+            'checksum': ['%064x' % i], 'checksum_type': ['SHA256'],
+            'tracking_id': ['hdl:21.14100/%032x' % i],
+            'project': ['CMIP6'], 'source_id': ['UKESM1-0-LL'],
+            'variable_id': ['tas'], 'replica': False, 'latest': True,
+            'index_node': 'esgf.ceda.ac.uk', 'data_node': 'esgf-data3.ceda.ac.uk',
+            '_timestamp': '2019-06-04T14:18:49.582Z',
+            'url': ['http://esgf-data3.ceda.ac.uk/thredds/fileServer/esg_cmip6/%s|application/netcdf|HTTPServer' % path,  # noqa
+                    'http://esgf-data3.ceda.ac.uk/thredds/dodsC/esg_cmip6/%s.html|application/opendap-html|OPENDAP' % path],  # noqa
+        })
+    return json.dumps({'responseHeader': {'status': 0, 'QTime': 12},
+                       'response': {'numFound': n_docs, 'start': 0,
+                                    'docs': docs}}).encode('utf-8')
+
+
+def main(paths, number=20):
+    if paths:
+        bodies = [(path, open(path, 'rb').read()) for path in paths]
+    else:
+        bodies = [('synthetic', synthetic_response())]
+
+    for label, body in bodies:
+        print('%s (%d bytes)' % (label, len(body)))
+        for name, decoder in sorted(JSON_DECODERS.items()):
+            t = timeit.timeit(lambda: decoder(body), number=number)
+            print('  %-10s %8.2f ms per response' % (name, t / number * 1e3))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+"""
+Benchmark the per-record overhead of result objects.
+
+Compares creating a result per index access and re-parsing its URL list
+for each URL property, as previous versions did, against the slotted
+results cached in the ResultSet batch with a memoized URL table.  No
+queries are sent.
+
+Usage::
+
+    $ python benchmarks/bench_results.py
+
+"""
+
+from collections import defaultdict
+import sys
+import timeit
+import tracemalloc
+
+from pyesgf.search.results import FileResult
+
+
+class LegacyFileResult(object):
+    def __init__(self, json, context):
+        self.json = json
+        self.context = context
+
+    @property
+    def urls(self):
+        url_dict = defaultdict(list)
+        for encoded in self.json['url']:
+            url, mime_type, service = encoded.split('|')
+            url_dict[service].append((url, mime_type))
+
+        return url_dict
+
+    @property
+    def download_url(self):
+        return self.urls['HTTPServer'][0][0]
+
+    @property
+    def opendap_url(self):
+        return self.urls['OPENDAP'][0][0]
+
+
+def make_docs(n_docs):
+    base = 'http://esgf-data3.ceda.ac.uk/thredds/%s/esg_cmip6/tas_%d.nc'
+    return [{'id': 'tas_%d.nc' % i, 'title': 'tas_%d.nc' % i,
+             'url': [(base % ('fileServer', i)) +
+                     '|application/netcdf|HTTPServer',
+                     (base % ('dodsC', i)) +
+                     '.html|application/opendap-html|OPENDAP',
+                     (base % ('fileServer', i)).replace('http', 'gsiftp') +
+                     '|application/gridftp|GridFTP']}
+            for i in range(n_docs)]
+
+
+def legacy_pass(docs):
+    # A new result object per index access, URLs parsed per property
+    for doc in docs:
+        LegacyFileResult(doc, None).download_url
+        LegacyFileResult(doc, None).opendap_url
+
+
+def cached_pass(results):
+    for result in results:
+        result.download_url
+        result.opendap_url
+
+
+def main(n_docs=100000, number=5):
+    docs = make_docs(n_docs)
+
+    t = timeit.timeit(lambda: legacy_pass(docs), number=number)
+    print('%-10s %6.2f us per record' % ('legacy', t / number / n_docs * 1e6))
+
+    results = [FileResult(doc, None) for doc in docs]
+    t = timeit.timeit(lambda: cached_pass(results), number=number)
+    print('%-10s %6.2f us per record' % ('cached', t / number / n_docs * 1e6))
+
+    for cls in (LegacyFileResult, FileResult):
+        tracemalloc.start()
+        objs = [cls(doc, None) for doc in docs]
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%-18s %4d bytes per object' % (cls.__name__, size / n_docs))
+        del objs
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
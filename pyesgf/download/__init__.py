@@ -0,0 +1,6 @@
+"""
+Download of files found with :mod:`pyesgf.search`
+
+"""
+
+from .downloader import Downloader, DownloadResult  # noqa: F401
@@ -0,0 +1,95 @@
+"""
+
+Module :mod:`pyesgf.download.checksum`
+======================================
+
+Checksum helpers for the download engine.  Verified checksums are recorded
+in a small JSON file next to each downloaded file together with the file's
+size and modification time, so later runs can trust a file without reading
+it again.
+
+"""
+
+import hashlib
+import json
+import os
+
+from .exceptions import EsgfDownloadException
+
+# Suffix of the files recording verified checksums
+CHECKSUM_SUFFIX = '.checksum'
+
+# Size of the blocks read when hashing existing files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def new_hash(checksum_type):
+    """
+    Return a hashlib object for an ESGF ``checksum_type`` such as
+    ``'SHA256'`` or ``'MD5'``.
+
+    """
+    try:
+        return hashlib.new(checksum_type.lower().replace('-', ''))
+    except ValueError:
+        raise EsgfDownloadException('Unsupported checksum type %s' %
+                                    checksum_type)
+
+
+def update_from_file(hasher, path, length=None):
+    """
+    Feed the first *length* bytes of *path*, or all of it, into *hasher*.
+
+    """
+    with open(path, 'rb') as fh:
+        remaining = length
+        while remaining is None or remaining > 0:
+            n = HASH_BLOCK_SIZE if remaining is None else min(HASH_BLOCK_SIZE,
+                                                              remaining)
+            block = fh.read(n)
+            if not block:
+                break
+            hasher.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+
+    return hasher
+
+
+def file_checksum(path, checksum_type):
+    """
+    :return: the hex digest of the file at *path*.
+
+    """
+    return update_from_file(new_hash(checksum_type), path).hexdigest()
+
+
+def write_record(path, checksum_type, checksum):
+    """
+    Record that the file at *path* has been verified against *checksum*.
+
+    """
+    stat = os.stat(path)
+    record = {'checksum_type': checksum_type, 'checksum': checksum.lower(),
+              'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    with open(path + CHECKSUM_SUFFIX, 'w') as fh:
+        json.dump(record, fh)
+
+
+def is_verified(path, checksum_type, checksum):
+    """
+    :return: True if the file at *path* has been recorded as verified
+        against *checksum* and has not changed since.
+
+    """
+    try:
+        with open(path + CHECKSUM_SUFFIX) as fh:
+            record = json.load(fh)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return False
+
+    return (record.get('checksum_type', '').lower() == checksum_type.lower()
+            and record.get('checksum') == checksum.lower()
+            and record.get('size') == stat.st_size
+            and record.get('mtime_ns') == stat.st_mtime_ns)
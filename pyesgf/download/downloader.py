@@ -0,0 +1,564 @@
+"""
+
+Module :mod:`pyesgf.download.downloader`
+========================================
+
+Downloads files described by :class:`pyesgf.search.results.FileResult`
+objects over HTTP, as an alternative to running the wget script returned by
+:meth:`SearchContext.get_download_script()`.  Files are downloaded
+concurrently by a pool of workers with a limit on the number of
+connections to each data node, and interrupted downloads are resumed with
+HTTP range requests.  Large files can be split into segments fetched
+over several connections at once.  Files are hashed as they are received and checked
+against their published checksum; verified files are recorded so that
+they are skipped by later runs without being read again::
+
+  >>> files = ctx.search()
+  >>> downloader = Downloader(max_workers=8, max_per_host=2)
+  >>> results = downloader.download(files, '/data/cmip6')
+
+Data nodes requiring authentication can be accessed by passing a session
+configured with the credentials obtained through
+:class:`pyesgf.logon.LogonManager`.
+
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import logging
+import requests
+
+from ..search.connection import create_single_session
+from .exceptions import EsgfDownloadException, EsgfChecksumException
+from .checksum import new_hash, update_from_file, write_record, is_verified
+
+log = logging.getLogger(__name__)
+
+# Size of the chunks read from the HTTP response and written to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Suffix of files being downloaded
+PART_SUFFIX = '.part'
+
+# Suffix added to the partial file name for the record of completed segments
+SEGMENTS_SUFFIX = '.json'
+
+# Size of the byte ranges of segmented downloads
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# DownloadResult status values
+STATUS_DONE = 'done'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+
+class DownloadProgress(object):
+    """
+    The progress of one file download, passed to the ``progress`` callback
+    of :class:`Downloader` each time a chunk is written.
+
+    :ivar filename: The name of the file.
+    :ivar url: The URL being downloaded.
+    :ivar size: The expected size of the file in bytes, or None.
+    :ivar bytes_done: The number of bytes of the file on disk.
+    :ivar bytes_transferred: The number of bytes received in this session.
+    :property elapsed: Time (in seconds) since the transfer started.
+    :property throughput: The transfer rate in bytes per second.
+
+    """
+    def __init__(self, filename, url, size, bytes_done=0):
+        self.filename = filename
+        self.url = url
+        self.size = size
+        self.bytes_done = bytes_done
+        self.bytes_transferred = 0
+        self.start_time = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes_transferred / elapsed
+
+
+class DownloadResult(object):
+    """
+    The outcome of downloading one file.
+
+    :ivar file: The file result which was downloaded.
+    :ivar path: The path of the downloaded file.
+    :ivar status: One of ``'done'``, ``'skipped'`` (the file already
+        existed) or ``'failed'``.
+    :ivar bytes_transferred: The number of bytes received.
+    :ivar elapsed: Time (in seconds) taken.
+    :ivar error: The exception raised if the download failed.
+    :ivar checksum_verified: True if the file matches its published
+        checksum, None if it wasn't checked.
+
+    """
+    def __init__(self, file, path, status=None, bytes_transferred=0,
+                 elapsed=0.0, error=None, checksum_verified=None):
+        self.file = file
+        self.path = path
+        self.status = status
+        self.bytes_transferred = bytes_transferred
+        self.elapsed = elapsed
+        self.error = error
+        self.checksum_verified = checksum_verified
+
+    def __repr__(self):
+        return '<DownloadResult %s %s>' % (self.path, self.status)
+
+
+class Downloader(object):
+    """
+    :ivar session: requests.Session object used for all transfers.
+    :ivar max_workers: The number of files downloaded concurrently.
+    :ivar max_per_host: The maximum number of concurrent connections to
+                        each data node.
+    :ivar chunk_size: The size of the chunks read and written.
+    :ivar timeout: Time (in seconds) without data before a transfer fails.
+    :ivar verify: boolean, determines if the server certificates are
+                  verified.
+    :ivar progress: A callable receiving a :class:`DownloadProgress` each
+                    time a chunk is written, or None.
+    :ivar verify_checksums: boolean, if True files with a published checksum
+                            are hashed while downloading and rejected if
+                            they don't match.
+    :ivar mirrors: A :class:`pyesgf.download.mirrors.MirrorPlanner` used to
+                   choose between the replicas of each file, or None to
+                   use the first HTTP URL only.
+    :ivar max_segments: The number of connections used for each file larger
+                        than *segment_size*.  Segments count as a single
+                        connection towards *max_per_host*.
+    :ivar segment_size: The size of the byte ranges of segmented downloads.
+    :property bytes_transferred: The total number of bytes received.
+    :property throughput: The overall transfer rate in bytes per second
+                          while downloads are running.
+
+    """
+    def __init__(self, session=None, max_workers=4, max_per_host=2,
+                 chunk_size=DOWNLOAD_CHUNK_SIZE, timeout=120, verify=True,
+                 progress=None, verify_checksums=True, mirrors=None,
+                 max_segments=1, segment_size=SEGMENT_SIZE):
+        if session is None:
+            session = create_single_session(
+                pool_maxsize=max_workers * max_segments)
+        self.session = session
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.verify = verify
+        self.progress = progress
+        self.verify_checksums = verify_checksums
+        self.mirrors = mirrors
+        self.max_segments = max_segments
+        self.segment_size = segment_size
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._bytes_transferred = 0
+        self._active_time = 0.0
+        self._start_time = None
+        self._n_active = 0
+
+    @property
+    def bytes_transferred(self):
+        return self._bytes_transferred
+
+    @property
+    def throughput(self):
+        with self._lock:
+            active_time = self._active_time
+            if self._start_time is not None:
+                active_time += time.monotonic() - self._start_time
+        if active_time <= 0:
+            return 0.0
+        return self._bytes_transferred / active_time
+
+    def download(self, files, dest_dir, overwrite=False):
+        """
+        Download files concurrently.
+
+        Errors do not stop other downloads.  They are reported in the
+        ``error`` attribute of the corresponding result.
+
+        :param files: An iterable of :class:`FileResult`.
+        :param dest_dir: The directory in which to save the files.
+        :param overwrite: If False files which already exist with the
+            expected size are skipped.
+        :return: A list of :class:`DownloadResult`, in the order of *files*.
+
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._download_quietly, file,
+                                       dest_dir, overwrite)
+                       for file in files]
+            return [future.result() for future in futures]
+
+    def download_file(self, file, dest_dir, overwrite=False):
+        """
+        Download a single file, resuming a previous partial download.
+
+        :param file: A :class:`FileResult`.
+        :param dest_dir: The directory in which to save the file.
+        :param overwrite: If False a file which already exists with the
+            expected size is skipped.
+        :return: A :class:`DownloadResult`.
+        :raises EsgfDownloadException: if the download fails.
+
+        """
+        path = os.path.join(dest_dir, file.filename)
+        result = DownloadResult(file, path)
+        size = _file_size(file)
+        checksum_type, checksum = self._expected_checksum(file)
+        start = time.monotonic()
+
+        if not overwrite and self._is_complete(path, size, checksum_type,
+                                               checksum):
+            result.status = STATUS_SKIPPED
+            result.checksum_verified = True if checksum else None
+            return result
+
+        if self.mirrors is not None:
+            urls = self.mirrors.urls(file)
+        elif file.download_url is not None:
+            urls = [file.download_url]
+        else:
+            urls = []
+        if not urls:
+            raise EsgfDownloadException('No HTTP download URL for %s' %
+                                        file.filename)
+
+        os.makedirs(dest_dir, exist_ok=True)
+        part_path = path + PART_SUFFIX
+
+        for i, url in enumerate(urls):
+            attempt_start = time.monotonic()
+            try:
+                n_bytes = self._transfer(url, part_path, size, file,
+                                         checksum_type, checksum)
+            except (requests.RequestException, EsgfDownloadException) as err:
+                if self.mirrors is None:
+                    raise
+                self.mirrors.record_error(url)
+                if i == len(urls) - 1:
+                    raise
+                log.warning('Download of %s from %s failed, trying the next '
+                            'replica: %s' % (file.filename, url, err))
+                continue
+
+            if self.mirrors is not None:
+                self.mirrors.record_success(
+                    url, n_bytes, time.monotonic() - attempt_start)
+            result.bytes_transferred += n_bytes
+            break
+
+        os.replace(part_path, path)
+        if checksum is not None:
+            write_record(path, checksum_type, checksum)
+            result.checksum_verified = True
+
+        result.status = STATUS_DONE
+        result.elapsed = time.monotonic() - start
+        return result
+
+    def _transfer(self, url, part_path, size, file, checksum_type, checksum,
+                  allow_segments=True):
+        """
+        Download *url* into *part_path* and check its size and checksum.
+
+        :return: The number of bytes received.
+
+        """
+        hasher = new_hash(checksum_type) if checksum else None
+        segmented = (allow_segments and size is not None and
+                     self.max_segments > 1 and size > self.segment_size)
+        if not segmented and os.path.exists(part_path + SEGMENTS_SUFFIX):
+            # A preallocated file cannot be resumed from its end
+            _remove_partial(part_path)
+
+        self._begin()
+        try:
+            with self._host_slot(url):
+                if segmented:
+                    n_bytes = self._fetch_segments(url, part_path, size,
+                                                   file.filename)
+                else:
+                    n_bytes = self._fetch(url, part_path, size,
+                                          file.filename, hasher)
+        except _RangesNotSupported:
+            log.debug('%s does not support range requests' % url)
+            _remove_partial(part_path)
+            return self._transfer(url, part_path, size, file, checksum_type,
+                                  checksum, allow_segments=False)
+        finally:
+            self._end()
+
+        if segmented and hasher is not None:
+            # Segments arrive out of order so the file is hashed at the end
+            update_from_file(hasher, part_path)
+
+        if size is not None and os.path.getsize(part_path) != size:
+            raise EsgfDownloadException(
+                'Size of %s is %d bytes, expected %d' %
+                (file.filename, os.path.getsize(part_path), size))
+
+        if hasher is not None and hasher.hexdigest() != checksum:
+            _remove_partial(part_path)
+            raise EsgfChecksumException(
+                '%s checksum of %s is %s, expected %s' %
+                (checksum_type, file.filename, hasher.hexdigest(), checksum))
+
+        return n_bytes
+
+    def _expected_checksum(self, file):
+        """
+        :return: ``(checksum_type, checksum)`` to verify *file* against, or
+            ``(None, None)``.
+
+        """
+        if not self.verify_checksums:
+            return None, None
+
+        checksum = getattr(file, 'checksum', None)
+        checksum_type = getattr(file, 'checksum_type', None)
+        if not checksum or not checksum_type:
+            return None, None
+
+        return checksum_type, checksum.lower()
+
+    def _is_complete(self, path, size, checksum_type, checksum):
+        """
+        Return True if *path* already holds the expected file.  A file
+        without a checksum record is hashed once and recorded if it
+        matches.
+
+        """
+        if not os.path.exists(path):
+            return False
+        if size is not None and os.path.getsize(path) != size:
+            return False
+        if checksum is None:
+            return True
+        if is_verified(path, checksum_type, checksum):
+            return True
+
+        hasher = update_from_file(new_hash(checksum_type), path)
+        if hasher.hexdigest() != checksum:
+            log.info('%s does not match its checksum, downloading again' %
+                     path)
+            return False
+
+        write_record(path, checksum_type, checksum)
+        return True
+
+    def _download_quietly(self, file, dest_dir, overwrite):
+        try:
+            return self.download_file(file, dest_dir, overwrite)
+        except Exception as err:
+            log.warning('Download of %s failed: %s' %
+                        (getattr(file, 'filename', file), err))
+            return DownloadResult(file, os.path.join(dest_dir, file.filename),
+                                  status=STATUS_FAILED, error=err)
+
+    def _fetch(self, url, part_path, size, filename, hasher=None):
+        """
+        Transfer *url* into *part_path*, continuing from its current size.
+        If *hasher* is given it is updated with the content of the file.
+
+        :return: The number of bytes received.
+
+        """
+        offset = 0
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            if size is not None and offset > size:
+                offset = 0
+
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+
+        response = self.session.get(url, headers=headers, stream=True,
+                                    timeout=self.timeout, verify=self.verify)
+        try:
+            if offset and response.status_code == 416 and offset == size:
+                # Already complete
+                if hasher is not None:
+                    update_from_file(hasher, part_path)
+                return 0
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                log.debug('%s does not support range requests' % url)
+                offset = 0
+
+            if offset and hasher is not None:
+                # Only the part already on disk has to be read back
+                update_from_file(hasher, part_path, offset)
+
+            progress = DownloadProgress(filename, url, size, offset)
+            with open(part_path, 'ab' if offset else 'wb') as fh:
+                for chunk in response.iter_content(self.chunk_size):
+                    fh.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    self._transferred(progress, len(chunk))
+        finally:
+            response.close()
+
+        return progress.bytes_transferred
+
+    def _fetch_segments(self, url, part_path, size, filename):
+        """
+        Transfer *url* into *part_path* as byte ranges fetched in parallel,
+        skipping the segments completed by an earlier attempt.
+
+        :return: The number of bytes received.
+
+        """
+        segments_path = part_path + SEGMENTS_SUFFIX
+        segment_size = self.segment_size
+        n_segments = (size + segment_size - 1) // segment_size
+        done = _load_segments(segments_path, size, segment_size)
+        if done is None:
+            done = set()
+            if os.path.exists(part_path):
+                # Keep the complete segments of a single stream download
+                offset = min(os.path.getsize(part_path), size)
+                done.update(range(offset // segment_size))
+            with open(part_path, 'ab') as fh:
+                fh.truncate(size)
+            _save_segments(segments_path, size, segment_size, done)
+
+        bytes_done = sum(min(segment_size, size - i * segment_size)
+                         for i in done)
+        progress = DownloadProgress(filename, url, size, bytes_done)
+        lock = threading.Lock()
+
+        def fetch_segment(i):
+            start = i * segment_size
+            end = min(start + segment_size, size) - 1
+            response = self.session.get(
+                url, headers={'Range': 'bytes=%d-%d' % (start, end)},
+                stream=True, timeout=self.timeout, verify=self.verify)
+            try:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise _RangesNotSupported()
+                with open(part_path, 'r+b') as fh:
+                    fh.seek(start)
+                    for chunk in response.iter_content(self.chunk_size):
+                        if fh.tell() + len(chunk) > end + 1:
+                            raise EsgfDownloadException(
+                                'Server returned too many bytes for %s' %
+                                filename)
+                        fh.write(chunk)
+                        with lock:
+                            self._transferred(progress, len(chunk))
+                    if fh.tell() != end + 1:
+                        raise EsgfDownloadException(
+                            'Segment %d of %s is incomplete' % (i, filename))
+            finally:
+                response.close()
+
+            with lock:
+                done.add(i)
+                _save_segments(segments_path, size, segment_size, done)
+
+        missing = [i for i in range(n_segments) if i not in done]
+        with ThreadPoolExecutor(max_workers=self.max_segments) as executor:
+            futures = [executor.submit(fetch_segment, i) for i in missing]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        os.remove(segments_path)
+        return progress.bytes_transferred
+
+    def _transferred(self, progress, n_bytes):
+        progress.bytes_done += n_bytes
+        progress.bytes_transferred += n_bytes
+        with self._lock:
+            self._bytes_transferred += n_bytes
+        if self.progress is not None:
+            self.progress(progress)
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(
+                    self.max_per_host)
+            return self._host_slots[host]
+
+    def _begin(self):
+        with self._lock:
+            if self._n_active == 0:
+                self._start_time = time.monotonic()
+            self._n_active += 1
+
+    def _end(self):
+        with self._lock:
+            self._n_active -= 1
+            if self._n_active == 0:
+                self._active_time += time.monotonic() - self._start_time
+                self._start_time = None
+
+
+class _RangesNotSupported(Exception):
+    pass
+
+
+def _load_segments(path, size, segment_size):
+    """
+    :return: the set of completed segments recorded in *path*, or None if
+        there is no record for this file size and segment size.
+
+    """
+    try:
+        with open(path) as fh:
+            record = json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+    if (record.get('size') != size or
+            record.get('segment_size') != segment_size):
+        return None
+    return set(record['done'])
+
+
+def _save_segments(path, size, segment_size, done):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fh:
+        json.dump({'size': size, 'segment_size': segment_size,
+                   'done': sorted(done)}, fh)
+    os.replace(tmp_path, path)
+
+
+def _remove_partial(part_path):
+    for path in (part_path, part_path + SEGMENTS_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _file_size(file):
+    try:
+        return file.size
+    except (KeyError, TypeError, ValueError):
+        return None
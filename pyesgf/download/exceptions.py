@@ -0,0 +1,20 @@
+"""
+Exceptions associated with the pyesgf.download package.
+
+"""
+
+
+class EsgfDownloadException(Exception):
+    """
+    Generic exception from the pyesgf.download package.
+
+    """
+    pass
+
+
+class EsgfChecksumException(EsgfDownloadException):
+    """
+    Raised when a downloaded file does not match its published checksum.
+
+    """
+    pass
@@ -0,0 +1,265 @@
+"""
+
+Module :mod:`pyesgf.download.mirrors`
+=====================================
+
+Selection of the data node to download each file from.  The same file is
+often published by several data nodes.  :class:`MirrorPlanner` collects the
+HTTP URLs of all replicas of a file, identified by their checksum or
+tracking id, and keeps per-node statistics of transfer rates and errors so
+that :class:`pyesgf.download.Downloader` tries the fastest healthy node
+first and moves on to the next replica when a node fails or stalls::
+
+  >>> planner = MirrorPlanner(conn)
+  >>> planner.add_replicas(files)
+  >>> downloader = Downloader(mirrors=planner)
+  >>> downloader.download(files, 'data')
+
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from ..search.consts import (DEFAULT_BATCH_SIZE, MAX_BULK_QUERY_LENGTH,
+                             TYPE_FILE)
+
+# Number of consecutive errors after which a node is considered unhealthy
+MAX_NODE_ERRORS = 3
+
+# Time (in seconds) after which an unhealthy node is tried again
+NODE_RETRY_INTERVAL = 300
+
+
+class NodeStats(object):
+    """
+    Transfer statistics of one data node.
+
+    :ivar node: The host (and port) of the node.
+    :ivar bytes_transferred: The number of bytes received from the node.
+    :ivar elapsed: The time (in seconds) spent receiving them.
+    :ivar successes: The number of completed downloads.
+    :ivar errors: The number of failed downloads.
+    :ivar consecutive_errors: The number of failures since the last success.
+    :ivar last_error: The time (from ``time.monotonic()``) of the last
+                      failure, or None.
+    :property throughput: The mean transfer rate in bytes per second, or
+                          None if nothing has been transferred.
+
+    """
+    def __init__(self, node):
+        self.node = node
+        self.bytes_transferred = 0
+        self.elapsed = 0.0
+        self.successes = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error = None
+
+    @property
+    def throughput(self):
+        if self.elapsed <= 0:
+            return None
+        return self.bytes_transferred / self.elapsed
+
+    def __repr__(self):
+        return ('<NodeStats %s: %d ok, %d errors, %s B/s>' %
+                (self.node, self.successes, self.errors, self.throughput))
+
+
+class MirrorPlanner(object):
+    """
+    Ranks the replica URLs of files by the performance of their data nodes.
+
+    A node is unhealthy once *max_errors* downloads in a row have failed.
+    Unhealthy nodes are tried last, until *retry_interval* seconds have
+    passed since their last failure.  Nodes without statistics are ranked
+    as if they had the mean throughput of the known nodes so that they get
+    a chance to be measured, and ties go to the node with fewer recent
+    errors.
+
+    :ivar connection: The SearchConnection used to find replicas, or None.
+    :ivar max_errors: Consecutive errors after which a node is unhealthy.
+    :ivar retry_interval: Time (in seconds) before an unhealthy node is
+                          tried again.
+
+    """
+    def __init__(self, connection=None, max_errors=MAX_NODE_ERRORS,
+                 retry_interval=NODE_RETRY_INTERVAL):
+        self.connection = connection
+        self.max_errors = max_errors
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._replicas = {}
+
+    def add_replicas(self, files, batch_size=DEFAULT_BATCH_SIZE,
+                     max_workers=4, max_query_length=MAX_BULK_QUERY_LENGTH):
+        """
+        Search for the replicas of *files*.
+
+        Files are matched on checksum, or on tracking id for files without
+        one.  Whether other index nodes are searched depends on the
+        ``distrib`` setting of the connection.
+
+        :param files: An iterable of :class:`FileResult`.
+        :param batch_size: The number of records to get per HTTP request.
+        :param max_workers: The number of searches run concurrently.
+        :param max_query_length: The maximum length of the encoded
+            constraints in one search.
+
+        """
+        from ..search.bulk import _chunk_ids
+
+        if self.connection is None:
+            raise ValueError('A connection is required to search for '
+                             'replicas')
+
+        # The values are searched for as published
+        keys = {'checksum': set(), 'tracking_id': set()}
+        for file in files:
+            field, value = _replica_key(file)
+            if field is not None:
+                keys[field].add(value)
+
+        chunks = [(field, chunk)
+                  for field, values in keys.items()
+                  for chunk in _chunk_ids(sorted(values), max_query_length)]
+
+        def search_chunk(chunk):
+            field, values = chunk
+            context = self.connection.new_context(
+                search_type=TYPE_FILE, fields='checksum,tracking_id,url',
+                **{field: values})
+            return list(context.search(batch_size=batch_size,
+                                       ignore_facet_check=True))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for results in executor.map(search_chunk, chunks):
+                for result in results:
+                    self._add_urls(result)
+
+    def urls(self, file):
+        """
+        :return: The HTTP download URLs of *file* and its known replicas,
+            best first.
+
+        """
+        urls = [url for url, mime in file.urls.get('HTTPServer', [])]
+        with self._lock:
+            urls.extend(self._replicas.get(_match_key(file), ()))
+
+        unique = []
+        for url in urls:
+            if url not in unique:
+                unique.append(url)
+
+        return self.rank(unique)
+
+    def rank(self, urls):
+        """
+        Sort *urls* by the health and throughput of their data nodes.
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            known = [s.throughput for s in self._stats.values()
+                     if s.throughput is not None]
+            default = sum(known) / len(known) if known else 0.0
+
+            def sort_key(url):
+                stats = self._stats.get(_node(url))
+                if stats is None:
+                    return (0, -default, 0)
+                healthy = self._is_healthy(stats, now)
+                throughput = stats.throughput
+                if throughput is None:
+                    throughput = default
+                return (0 if healthy else 1, -throughput,
+                        stats.consecutive_errors)
+
+            return sorted(urls, key=sort_key)
+
+    def record_success(self, url, n_bytes, elapsed):
+        """
+        Record a completed transfer of *n_bytes* from *url*.
+
+        """
+        with self._lock:
+            stats = self._get_stats(url)
+            stats.bytes_transferred += n_bytes
+            stats.elapsed += elapsed
+            stats.successes += 1
+            stats.consecutive_errors = 0
+
+    def record_error(self, url):
+        """
+        Record a failed transfer from *url*.
+
+        """
+        with self._lock:
+            stats = self._get_stats(url)
+            stats.errors += 1
+            stats.consecutive_errors += 1
+            stats.last_error = time.monotonic()
+
+    def is_healthy(self, url):
+        """
+        :return: False if the data node of *url* is currently unhealthy.
+
+        """
+        with self._lock:
+            stats = self._stats.get(_node(url))
+            return stats is None or self._is_healthy(stats, time.monotonic())
+
+    @property
+    def stats(self):
+        """
+        A dictionary ``{node: NodeStats}`` of the nodes used so far.
+
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    # -------------------------------------------------------------------------
+
+    def _add_urls(self, result):
+        key = _match_key(result)
+        if key[0] is None:
+            return
+        urls = [url for url, mime in result.urls.get('HTTPServer', [])]
+        with self._lock:
+            replicas = self._replicas.setdefault(key, [])
+            replicas.extend(url for url in urls if url not in replicas)
+
+    def _get_stats(self, url):
+        node = _node(url)
+        if node not in self._stats:
+            self._stats[node] = NodeStats(node)
+        return self._stats[node]
+
+    def _is_healthy(self, stats, now):
+        return (stats.consecutive_errors < self.max_errors or
+                now - stats.last_error >= self.retry_interval)
+
+
+def _node(url):
+    return urlparse(url).netloc
+
+
+def _replica_key(file):
+    if file.checksum:
+        return 'checksum', file.checksum
+    if file.tracking_id:
+        return 'tracking_id', file.tracking_id
+    return None, None
+
+
+def _match_key(file):
+    # Hex checksums may be published in either case
+    field, value = _replica_key(file)
+    if field == 'checksum':
+        value = value.lower()
+    return field, value
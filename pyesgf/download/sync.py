@@ -0,0 +1,230 @@
+"""
+
+Module :mod:`pyesgf.download.sync`
+==================================
+
+Incremental mirroring of search results.  :class:`MirrorSync` keeps a
+sqlite index of the files it has downloaded with their id, version,
+checksum, size and ``_timestamp``.  Each run only asks the index node for
+records updated since the newest timestamp seen by the previous run of the
+same search, and only downloads files which are new or whose checksum or
+size has changed::
+
+  >>> ctx = conn.new_context(search_type='File', project='CMIP6',
+  ...                        source_id='UKESM1-0-LL', variable='tas')
+  >>> with MirrorSync('mirror.sqlite') as sync:
+  ...     results = sync.sync(ctx, '/data/mirror')
+
+"""
+
+import os
+import sqlite3
+import threading
+
+from ..search.consts import DEFAULT_BATCH_SIZE, TYPE_FILE
+from ..search.exceptions import EsgfSearchException
+from ..util import _first
+from .downloader import Downloader, STATUS_DONE, STATUS_SKIPPED
+
+
+class SyncIndex(object):
+    """
+    A sqlite database of synchronised files.
+
+    :ivar path: The path of the database file.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, id TEXT, version TEXT, '
+                'checksum TEXT, checksum_type TEXT, size INTEGER, '
+                'timestamp TEXT)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS searches ('
+                'query TEXT PRIMARY KEY, timestamp TEXT)')
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def get(self, path):
+        """
+        :return: a dictionary describing the file synchronised to *path*,
+            or None.
+
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, version, checksum, checksum_type, size, '
+                'timestamp FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+
+        return dict(zip(('id', 'version', 'checksum', 'checksum_type',
+                         'size', 'timestamp'), row))
+
+    def update(self, path, file):
+        """
+        Record that *file*, a :class:`FileResult`, has been synchronised to
+        *path*.
+
+        """
+        record = _file_record(file)
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files (path, id, version, checksum, '
+                'checksum_type, size, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, record['id'], record['version'], record['checksum'],
+                 record['checksum_type'], record['size'],
+                 record['timestamp']))
+
+    def last_timestamp(self, query):
+        """
+        :return: The newest ``_timestamp`` synchronised for *query*, or None.
+
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT timestamp FROM searches WHERE query = ?',
+                (query,)).fetchone()
+        return row[0] if row else None
+
+    def set_last_timestamp(self, query, timestamp):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO searches (query, timestamp) '
+                'VALUES (?, ?)', (query, timestamp))
+
+
+class MirrorSync(object):
+    """
+    Keeps a local directory in step with the results of file searches.
+
+    :ivar index: The :class:`SyncIndex` of synchronised files.
+    :ivar downloader: The :class:`pyesgf.download.Downloader` used.
+
+    """
+    def __init__(self, index, downloader=None):
+        """
+        :param index: A :class:`SyncIndex` or the path of its database.
+        :param downloader: A :class:`pyesgf.download.Downloader`, or None
+            for a default one.
+
+        """
+        if not isinstance(index, SyncIndex):
+            index = SyncIndex(index)
+        if downloader is None:
+            downloader = Downloader()
+        self.index = index
+        self.downloader = downloader
+
+    def close(self):
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def sync(self, context, dest_dir, batch_size=DEFAULT_BATCH_SIZE,
+             full=False):
+        """
+        Download the new and changed files matching a file search.
+
+        The newest ``_timestamp`` of the results is stored once every file
+        has been synchronised, so files which failed are searched for again
+        by the next run.
+
+        :param context: A File :class:`SearchContext`.
+        :param dest_dir: The directory in which to save the files.
+        :param batch_size: The number of records to get per HTTP request.
+        :param full: If True all records are searched, not only the ones
+            updated since the last run.
+        :return: A list of :class:`pyesgf.download.DownloadResult` for the
+            files which needed downloading.
+
+        """
+        if context.search_type != TYPE_FILE:
+            raise EsgfSearchException('sync() requires a File search context')
+
+        query = _query_key(context)
+        since = None if full else self.index.last_timestamp(query)
+        if since is not None:
+            context = context.constrain(**{'from': since})
+
+        newest = since
+        changed = []
+        for file in context.search(batch_size=batch_size,
+                                   ignore_facet_check=True):
+            timestamp = file.json.get('_timestamp')
+            if timestamp is not None and (newest is None or
+                                          timestamp > newest):
+                newest = timestamp
+
+            path = os.path.join(dest_dir, file.filename)
+            if not self._is_current(path, file):
+                changed.append(file)
+
+        # Files already on disk with the right checksum are not downloaded
+        # again but still recorded
+        results = self.downloader.download(changed, dest_dir)
+        for result in results:
+            if result.status in (STATUS_DONE, STATUS_SKIPPED):
+                self.index.update(result.path, result.file)
+
+        if newest is not None and all(r.error is None for r in results):
+            self.index.set_last_timestamp(query, newest)
+
+        return results
+
+    def _is_current(self, path, file):
+        """
+        Return True if the index records *file* as synchronised to *path*
+        and the file is still there.
+
+        """
+        record = self.index.get(path)
+        if record is None or not os.path.exists(path):
+            return False
+
+        expected = _file_record(file)
+        if expected['checksum'] is not None:
+            return (record['checksum'] == expected['checksum'] and
+                    record['checksum_type'] == expected['checksum_type'])
+        return (record['size'] == expected['size'] and
+                record['version'] == expected['version'])
+
+
+def _file_record(file):
+    checksum = file.checksum
+    version = _first(file.json.get('version'))
+    return {
+        'id': file.file_id,
+        'version': None if version is None else str(version),
+        'checksum': checksum.lower() if checksum else None,
+        'checksum_type': file.checksum_type,
+        'size': file.size,
+        'timestamp': file.json.get('_timestamp'),
+    }
+
+
+def _query_key(context):
+    """
+    A string identifying the search of *context* on its index node.
+
+    """
+    connection = context.connection
+    query = connection._canonical_query(context._build_query(),
+                                        context.shards)
+    return '%s %s' % (connection.url, query)
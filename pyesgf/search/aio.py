@@ -0,0 +1,450 @@
+"""
+
+Module :mod:`pyesgf.search.aio`
+===============================
+
+An asyncio interface to the ESGF Search API.  Using this module requires
+installing the aiohttp_ library.
+
+.. _aiohttp: https://pypi.org/project/aiohttp/
+
+:class:`AsyncSearchConnection` mirrors :class:`SearchConnection` but its
+query methods are coroutines, so many searches can be driven concurrently
+from a single event loop::
+
+  >>> async with AsyncSearchConnection(url, distrib=False) as conn:
+  ...     ctx = conn.new_context(project='CMIP6', facets='source_id')
+  ...     hits = await ctx.hit_count
+  ...     results = await ctx.search()
+  ...     async for result in results:
+  ...         print(result.dataset_id)
+
+Queries are built with the same code as the blocking interface so the
+requests sent to the index node are identical.  In particular results only
+hold the default fields of their result class unless the context sets
+``fields``.  Other fields can't be fetched on access as they are by the
+blocking interface; they are retrieved with
+:meth:`AsyncProjectedDocument.fetch_async()`::
+
+  >>> await result.json.fetch_async()
+  >>> result.json['variable']
+
+"""
+
+import asyncio
+import logging
+import time
+
+try:
+    import aiohttp
+    from yarl import URL
+    _has_aiohttp = True
+except ImportError:
+    _has_aiohttp = False
+
+from .connection import SearchConnection, _invalid_parameters
+from .cache import SHARD_CACHE_TTL
+from .retry import parse_retry_after
+from .context import SearchContext, _facet_options
+from .results import ProjectedDocument, _project_fields, _result_classes
+from .consts import DEFAULT_BATCH_SIZE, TYPE_DATASET
+from .exceptions import EsgfSearchException, EsgfInvalidQueryException
+
+log = logging.getLogger(__name__)
+
+
+class AsyncSearchConnection(SearchConnection):
+    """
+    A :class:`SearchConnection` whose queries are sent with aiohttp.
+
+    The ``cache`` and ``keep_alive`` options and shard monitoring are not
+    supported: the underlying ``aiohttp.ClientSession`` stays open until
+    :meth:`close()` is awaited or the ``async with`` block exits.  The
+    request rate limit of ``throttle`` is applied, while ``max_in_flight``
+    bounds the connections per host of the session created by the
+    connection.
+
+    :ivar session: aiohttp.ClientSession object. optional.
+
+    """
+    def __init__(self, url, distrib=True, timeout=120, session=None,
+                 verify=True, context_class=None, pool_maxsize=10,
+                 counts_cache_size=128, counts_cache_ttl=300,
+                 json_decoder=None, shard_cache=None,
+                 shard_cache_ttl=SHARD_CACHE_TTL, retry=None,
+                 rate_limit=None, max_in_flight=None, throttle=None):
+        if not _has_aiohttp:
+            raise ImportError('AsyncSearchConnection requires the aiohttp '
+                              'package')
+        if context_class is None:
+            context_class = AsyncSearchContext
+
+        super(AsyncSearchConnection, self).__init__(
+            url, distrib=distrib, timeout=timeout, verify=verify,
+            context_class=context_class, keep_alive=True,
+            pool_maxsize=pool_maxsize, counts_cache_size=counts_cache_size,
+            counts_cache_ttl=counts_cache_ttl, json_decoder=json_decoder,
+            shard_cache=shard_cache, shard_cache_ttl=shard_cache_ttl,
+            retry=retry, rate_limit=rate_limit, max_in_flight=max_in_flight,
+            throttle=throttle)
+        self._passed_session = session
+        self.session = None
+
+    async def open(self):
+        if self._passed_session is not None:
+            self.session = self._passed_session
+        else:
+            limit = self.pool_maxsize
+            if self.throttle is not None and self.throttle.max_in_flight:
+                limit = min(limit, self.throttle.max_in_flight)
+            connector = aiohttp.TCPConnector(limit_per_host=limit,
+                                             ssl=None if self.verify else False)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._isopen = True
+
+    async def close(self):
+        if self._isopen and self._passed_session is None:
+            await self.session.close()
+        self._isopen = False
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    def __enter__(self):
+        raise TypeError('Use "async with" with AsyncSearchConnection')
+
+    async def send_search(self, query_dict, limit=None, offset=None,
+                          shards=None):
+        """
+        Send a query to the "search" endpoint.
+
+        :return: The json document for the search results
+
+        """
+        if shards is not None:
+            await self.get_shard_list()
+        full_query = self._build_query(query_dict, limit, offset, shards)
+        text = await self._send_query('search', full_query)
+
+        return self.json_decoder(text)
+
+    async def send_wget(self, query_dict, shards=None):
+        """
+        Send a query to the "wget" endpoint.
+
+        :return: A string containing the script.
+
+        """
+        if shards is not None:
+            await self.get_shard_list()
+        full_query = self._build_wget_query(query_dict, shards=shards)
+
+        return await self._send_query('wget', full_query)
+
+    async def _send_query(self, endpoint, full_query):
+        """
+        :return: the body of the response as a string.
+
+        """
+        if not self._isopen:
+            await self.open()
+
+        log.debug('Query dict is %s' % full_query)
+        query_url = self._query_url(endpoint, full_query)
+        log.debug('Query request is %s' % query_url)
+
+        policy = self.retry
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            timeout = (self.timeout if policy is None
+                       else policy.timeout(self.timeout, start))
+            if self.throttle is not None:
+                wait = self.throttle.host(query_url).reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+            try:
+                # The query string is already encoded by
+                # pyesgf.util.urlencode
+                async with self.session.get(
+                        URL(query_url, encoded=True),
+                        timeout=aiohttp.ClientTimeout(total=timeout)) \
+                        as response:
+                    text = await response.text()
+                    if response.status == 400:
+                        raise EsgfInvalidQueryException(
+                            "Invalid query parameter(s): %s" %
+                            _invalid_parameters(text))
+
+                    retry_after = parse_retry_after(
+                        response.headers.get('Retry-After'))
+                    if (self.throttle is not None and retry_after and
+                            response.status == 429):
+                        self.throttle.pause(query_url, retry_after)
+
+                    delay = None
+                    if (policy is not None and
+                            response.status in policy.retry_statuses):
+                        delay = policy.next_delay(attempt, start, retry_after)
+                    if delay is None:
+                        response.raise_for_status()
+                        return text
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                    asyncio.TimeoutError) as err:
+                delay = (None if policy is None
+                         else policy.next_delay(attempt, start))
+                if delay is None:
+                    raise
+                log.info('Query failed (%s), retrying in %.1fs' %
+                         (err, delay))
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def monitor_shards(self, **kwargs):
+        """
+        Not supported: the shard monitor sends blocking probe queries.
+
+        :raises TypeError: always.
+
+        """
+        raise TypeError('AsyncSearchConnection does not support shard '
+                        'monitoring')
+
+    async def _load_available_shards(self, refresh=False):
+        if not self.distrib:
+            raise EsgfSearchException('Shard list not available for '
+                                      'non-distributed queries')
+
+        if not refresh and self._load_cached_shards():
+            return
+
+        response_json = await self.send_search({'facets': [], 'fields': []})
+        self._set_available_shards(self._parse_shards(response_json))
+
+    async def get_shard_list(self, refresh=False):
+        """
+        return the list of all available shards.
+
+        """
+        if refresh or self._available_shards is None:
+            await self._load_available_shards(refresh=refresh)
+
+        return self._available_shards
+
+
+class AsyncSearchContext(SearchContext):
+    """
+    A :class:`SearchContext` for use with :class:`AsyncSearchConnection`.
+
+    Constraints are handled exactly as for :class:`SearchContext`.  The
+    properties :py:attr:`~facet_counts` and :py:attr:`~hit_count` return
+    awaitables and :meth:`search()`, :meth:`get_facet_options()` and
+    :meth:`get_download_script()` are coroutines.  :meth:`files_by_dataset()`
+    is not supported.
+
+    """
+    DEFAULT_SEARCH_TYPE = TYPE_DATASET
+
+    async def search(self, batch_size=DEFAULT_BATCH_SIZE,
+                     ignore_facet_check=False, **constraints):
+        """
+        Perform the search with current constraints.
+
+        See :meth:`SearchContext.search()`.
+
+        :return: An :class:`AsyncResultSet` for this query
+
+        """
+        if constraints:
+            sc = self.constrain(**constraints)
+        else:
+            sc = self
+
+        results = AsyncResultSet(sc, batch_size=batch_size)
+        if (not ignore_facet_check and sc._get_counts()[0] is None and
+                (sc.facets or not sc.connection.distrib)):
+            query_dict = sc._build_facet_query()
+            if not sc._load_cached_counts(query_dict):
+                # Retrieve the facet counts and the first batch in one request
+                _project_fields(query_dict, sc)
+                response = await sc.connection.send_search(
+                    query_dict, limit=batch_size, offset=0, shards=sc.shards)
+                sc._set_counts(response, query_dict)
+                results._add_batch(0, response)
+                return results
+        elif not ignore_facet_check:
+            # See SearchContext.search()
+            await sc._update_counts()
+
+        await results.get_batch(0)
+        return results
+
+    def files_by_dataset(self, **kwargs):
+        """
+        Not supported: the bulk file searches are blocking.
+
+        :raises TypeError: always.
+
+        """
+        raise TypeError('AsyncSearchContext does not support '
+                        'files_by_dataset()')
+
+    async def get_download_script(self, **constraints):
+        """
+        Download a script for downloading all files in the set of results.
+
+        See :meth:`SearchContext.get_download_script()`.
+
+        """
+        if constraints:
+            sc = self.constrain(**constraints)
+        else:
+            sc = self
+
+        await sc._update_counts()
+
+        return await sc.connection.send_wget(sc._build_query(),
+                                             shards=self.shards)
+
+    @property
+    def facet_counts(self):
+        return self._await_counts(1)
+
+    @property
+    def hit_count(self):
+        return self._await_counts(0)
+
+    async def get_facet_options(self):
+        """
+        See :meth:`SearchContext.get_facet_options()`.
+
+        """
+        await self._update_counts()
+        hit_count, facet_counts = self._get_counts()
+        return _facet_options(facet_counts, hit_count)
+
+    async def _await_counts(self, i):
+        await self._update_counts()
+        return self._get_counts()[i]
+
+    async def _update_counts(self):
+        if self._get_counts()[0] is not None:
+            return
+
+        query_dict = self._build_facet_query()
+        if self._load_cached_counts(query_dict):
+            return
+
+        response = await self.connection.send_search(query_dict, limit=0,
+                                                     shards=self.shards)
+        self._set_counts(response, query_dict)
+
+
+class AsyncResultSet(object):
+    """
+    The results of an :class:`AsyncSearchContext` search.
+
+    Results are paged in batches of *batch_size* as the set is iterated with
+    ``async for``.  The first batch is retrieved by
+    :meth:`AsyncSearchContext.search()` so ``len()`` is available
+    immediately.
+
+    :ivar context: The search context object used to generate this resultset
+
+    """
+    def __init__(self, context, batch_size=DEFAULT_BATCH_SIZE):
+        self.context = context
+        self.__batch_size = batch_size
+        self.__batch_cache = {}
+        self.__len_cache = None
+
+    @property
+    def batch_size(self):
+        return self.__batch_size
+
+    def __len__(self):
+        if self.__len_cache is None:
+            raise EsgfSearchException('Length is not known until the first '
+                                      'batch has been retrieved')
+        return self.__len_cache
+
+    async def __aiter__(self):
+        if self.__len_cache is None:
+            await self.get_batch(0)
+
+        for index in range(self.__len_cache):
+            batch = await self.get_batch(index // self.batch_size)
+            yield batch[index % self.batch_size]
+
+    async def get(self, index):
+        """
+        Return the result at *index*.
+
+        """
+        batch = await self.get_batch(index // self.batch_size)
+
+        return batch[index % self.batch_size]
+
+    async def get_batch(self, batch_i):
+        """
+        Return the result objects of batch number *batch_i*.
+
+        """
+        if batch_i in self.__batch_cache:
+            return self.__batch_cache[batch_i]
+
+        query_dict = _project_fields(self.context._build_query(),
+                                     self.context)
+        response = await self.context.connection.send_search(
+            query_dict, limit=self.batch_size,
+            offset=self.batch_size * batch_i, shards=self.context.shards)
+
+        return self._add_batch(batch_i, response)
+
+    def _add_batch(self, batch_i, response):
+        if self.__len_cache is None:
+            self.__len_cache = response['response']['numFound']
+
+        ResultClass = _result_classes[self.context.search_type]
+        projected = (self.context.fields is None and
+                     ResultClass.default_fields)
+        batch = []
+        for doc in response['response']['docs']:
+            if projected:
+                doc = AsyncProjectedDocument(doc, self.context,
+                                             ResultClass.default_fields)
+            batch.append(ResultClass(doc, self.context))
+        self.__batch_cache[batch_i] = batch
+        return batch
+
+
+class AsyncProjectedDocument(ProjectedDocument):
+    """
+    A :class:`pyesgf.search.results.ProjectedDocument` of an async search.
+    Looking up a field which was not requested with ``[]`` raises
+    :class:`EsgfSearchException` until :meth:`fetch_async()` has been
+    awaited.  ``get()`` and ``in`` behave as for any projected document.
+
+    """
+    __slots__ = ()
+
+    def fetch(self):
+        raise EsgfSearchException('Fields not requested by an async search '
+                                  'must be retrieved with fetch_async()')
+
+    async def fetch_async(self):
+        """
+        Retrieve all stored fields of this record.
+
+        """
+        context = self._context
+        response = await context.connection.send_search(
+            self._fetch_query(), limit=1, shards=context.shards)
+        self._set_fetched(response)
@@ -0,0 +1,101 @@
+"""
+
+Module :mod:`pyesgf.search.bulk`
+================================
+
+Searches for the records within many datasets at once.  Instead of one
+search per dataset through :meth:`DatasetResult.file_context()`, dataset
+ids are grouped by index node into OR'ed ``dataset_id`` constraints and the
+resulting searches are run concurrently.
+
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+
+from .consts import DEFAULT_BATCH_SIZE, MAX_BULK_QUERY_LENGTH
+
+
+def files_by_dataset(connection, datasets, batch_size=DEFAULT_BATCH_SIZE,
+                     max_workers=4, fields=None,
+                     max_query_length=MAX_BULK_QUERY_LENGTH, **constraints):
+    """
+    Retrieve the files of many datasets.
+
+    :param connection: The SearchConnection to use.
+    :param datasets: An iterable of :class:`DatasetResult`.
+    :param batch_size: The number of files to get per HTTP request.
+    :param max_workers: The number of searches run concurrently.
+    :param fields: A list of field names to return for each file.
+        ``dataset_id`` is always included.
+    :param max_query_length: The maximum length of the encoded
+        ``dataset_id`` constraints in one search.
+    :param constraints: Further constraints for the file searches.
+    :return: A dictionary ``{dataset_id: [FileResult, ...]}`` with an entry
+        for every dataset, in the order given.
+
+    """
+    from .context import FileSearchContext
+
+    files = OrderedDict()
+    chunks = []
+    for shards, dataset_ids in _group_by_shards(datasets, files).items():
+        for chunk in _chunk_ids(dataset_ids, max_query_length):
+            chunks.append((list(shards) if shards else None, chunk))
+
+    if fields is not None:
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        fields = ','.join(sorted(set(fields) | {'dataset_id'}))
+
+    def search_chunk(chunk):
+        shards, dataset_ids = chunk
+        chunk_constraints = dict(constraints, dataset_id=dataset_ids)
+        ctx = FileSearchContext(connection, chunk_constraints, fields=fields,
+                                shards=shards)
+        return list(ctx.search(batch_size=batch_size,
+                               ignore_facet_check=True))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for results in executor.map(search_chunk, chunks):
+            for result in results:
+                files.setdefault(result.json['dataset_id'], []).append(result)
+
+    return files
+
+
+def _group_by_shards(datasets, files):
+    """
+    Group dataset ids by the shards to search, adding an empty entry to
+    *files* for each dataset.
+
+    """
+    groups = OrderedDict()
+    for dataset in datasets:
+        shards = dataset._index_shards()
+        groups.setdefault(tuple(shards) if shards else None,
+                          []).append(dataset.dataset_id)
+        files[dataset.dataset_id] = []
+
+    return groups
+
+
+def _chunk_ids(ids, max_query_length, name='dataset_id'):
+    """
+    Split ids into chunks whose encoded constraints on the *name* parameter
+    fit in *max_query_length* characters.
+
+    """
+    chunk, length = [], 0
+    name_length = len('&%s=' % name)
+    for id_ in ids:
+        id_length = name_length + len(quote_plus(id_))
+        if chunk and length + id_length > max_query_length:
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(id_)
+        length += id_length
+
+    if chunk:
+        yield chunk
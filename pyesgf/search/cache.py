@@ -0,0 +1,135 @@
+"""
+
+Module :mod:`pyesgf.search.cache`
+=================================
+
+Client-side caches used by :class:`pyesgf.search.connection.SearchConnection`.
+
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Default location and lifetime (in seconds) of cached shard lists
+SHARD_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.esg', 'shards')
+SHARD_CACHE_TTL = 24 * 60 * 60
+
+
+class LRUCache(object):
+    """
+    A thread-safe least-recently-used cache with optional expiry.
+
+    :ivar maxsize: The maximum number of entries held.
+    :ivar ttl: Time (in seconds) after which an entry expires, or None for
+               entries which never expire.
+
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # Copies start empty, with their own lock
+        return {'maxsize': self.maxsize, 'ttl': self.ttl}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                return default
+
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.ttl is None:
+            expires = None
+        else:
+            expires = time.monotonic() + self.ttl
+
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ShardListCache(object):
+    """
+    An on-disk cache of the shard lists of search services, shared by all
+    processes using the same directory.  Each service has its own file,
+    which is replaced atomically.
+
+    :ivar directory: The directory holding the cache files.
+    :ivar ttl: Time (in seconds) after which a shard list expires, or None
+               for shard lists which never expire.
+
+    """
+    def __init__(self, directory=SHARD_CACHE_DIR, ttl=SHARD_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def get(self, url):
+        """
+        :return: The shard dictionary ``{host: [(port, suffix), ...]}``
+            stored for the service at *url*, or None if there is none or it
+            has expired.
+
+        """
+        try:
+            with open(self._path(url)) as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('url') != url:
+            return None
+        if self.ttl is not None and entry['time'] + self.ttl < time.time():
+            return None
+
+        return dict((host, [tuple(spec) for spec in specs])
+                    for host, specs in entry['shards'].items())
+
+    def set(self, url, shards):
+        os.makedirs(self.directory, exist_ok=True)
+        entry = {'url': url, 'time': time.time(), 'shards': shards}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(entry, fh)
+            os.replace(tmp_path, self._path(url))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def clear(self, url):
+        try:
+            os.remove(self._path(url))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
@@ -21,9 +21,12 @@ perform a search create a :class:`SearchConnection` instance then use
 
 import requests
 import requests_cache
+from requests.adapters import HTTPAdapter
 from sqlite3 import DatabaseError
 import datetime
 import os
+import time
+import threading
 
 import re
 from urllib.parse import urlparse
@@ -33,15 +36,26 @@ import logging
 
 from webob.multidict import MultiDict
 
+from .cache import LRUCache, ShardListCache, SHARD_CACHE_TTL
 from .context import DatasetSearchContext
+from .decoders import get_json_decoder
+from .retry import get_retry_policy, parse_retry_after
+from .throttle import get_throttle
 from .consts import RESPONSE_FORMAT, SHARD_REXP
-from .exceptions import EsgfSearchException
+from .exceptions import EsgfSearchException, EsgfInvalidQueryException
+from .streaming import StreamingSearchResponse, STREAM_CHUNK_SIZE
 from ..util import urlencode
 
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Transient failures of a request, including a connection reset while the
+# body is read
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError)
+
 
 class SearchConnection(object):
     """
@@ -60,13 +74,56 @@ class SearchConnection(object):
     :ivar session: requests.session object. optional.
     :ivar verify: boolean, determines if query should be sent over a verified
                   channel.
+    :ivar keep_alive: boolean, if True the HTTP session is kept open between
+                      queries so that connections to the index node are reused
+                      across batches, facet counts and shard discovery.  The
+                      session is released by :meth:`close()` or on leaving a
+                      ``with`` block.  Default: False.
+    :ivar pool_maxsize: Maximum number of connections kept open per host by
+                        the session's connection pool.  Default: 10.
+    :ivar idle_timeout: Time (in seconds) after which an unused keep-alive
+                        session is discarded and a fresh one opened on the
+                        next query.  None means never.  Default: None.
+    :ivar counts_cache_size: Number of facet count results held in memory
+                             and shared by all contexts using this
+                             connection.  0 disables the cache.  Default: 128.
+    :ivar counts_cache_ttl: Time (in seconds) after which cached facet counts
+                            expire.  Default: 300s.
+    :ivar json_decoder: Function used to decode search responses.  May be
+                        given as the name of a backend in
+                        ``pyesgf.search.decoders.JSON_DECODERS`` or a
+                        callable.  Default: the fastest installed backend.
+    :ivar shard_cache: Shard lists are cached on disk, and shared with other
+                       processes, if this is a directory path, True for the
+                       default directory ``~/.esg/shards``, or a
+                       :class:`pyesgf.search.cache.ShardListCache`.
+                       Default: None, no disk cache.
+    :ivar shard_cache_ttl: Time (in seconds) after which a cached shard list
+                           is discovered again.  Default: 1 day.
+    :ivar retry: The :class:`pyesgf.search.retry.RetryPolicy` applied to
+                 failed requests, or None for no retries.  May be given as
+                 a number of retries.  Default: None.
+    :ivar throttle: The :class:`pyesgf.search.throttle.RequestThrottle`
+                    limiting the rate and concurrency of the requests sent
+                    to each host, or None.  It is built from the
+                    ``rate_limit`` (requests per second) and
+                    ``max_in_flight`` arguments unless one is passed, e.g.
+                    to share limits between connections.  Default: None.
+    :ivar shard_monitor: A :class:`pyesgf.search.shards.ShardMonitor`
+                         restricting distributed queries to healthy shards,
+                         or None.  See :meth:`monitor_shards()`.
     """
     # Default limit for queries.  None means use service default.
     default_limit = None
 
     def __init__(self, url, distrib=True, cache=None, timeout=120,
                  expire_after=datetime.timedelta(hours=1),
-                 session=None, verify=True, context_class=None):
+                 session=None, verify=True, context_class=None,
+                 keep_alive=False, pool_maxsize=10, idle_timeout=None,
+                 counts_cache_size=128, counts_cache_ttl=300,
+                 json_decoder=None, shard_cache=None,
+                 shard_cache_ttl=SHARD_CACHE_TTL, retry=None,
+                 rate_limit=None, max_in_flight=None, throttle=None):
         """
         :param context_class: Override the default SearchContext class.
 
@@ -77,6 +134,12 @@ class SearchConnection(object):
         self.expire_after = expire_after
         self.timeout = timeout
         self.verify = verify
+        self.keep_alive = keep_alive
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        self.json_decoder = get_json_decoder(json_decoder)
+        self.retry = get_retry_policy(retry)
+        self.throttle = get_throttle(throttle, rate_limit, max_in_flight)
         self._passed_session = session
 
         # Check URL for backward compatibility
@@ -87,6 +150,23 @@ class SearchConnection(object):
         # A value of None means they haven't been retrieved yet.
         # Once set it is a dictionary {'host': [(port, suffix), ...], ...}
         self._available_shards = None
+        if shard_cache is True:
+            shard_cache = ShardListCache(ttl=shard_cache_ttl)
+        elif isinstance(shard_cache, str):
+            shard_cache = ShardListCache(shard_cache, ttl=shard_cache_ttl)
+        self.shard_cache = shard_cache
+
+        # Facet counts and hit counts keyed by canonical query
+        if counts_cache_size:
+            self._counts_cache = LRUCache(counts_cache_size, counts_cache_ttl)
+        else:
+            self._counts_cache = None
+
+        self.shard_monitor = None
+
+        # Whether the search service supports cursor based paging.
+        # None means this hasn't been tested yet.
+        self._cursor_supported = None
 
         if context_class:
             self.__context_class = context_class
@@ -94,6 +174,26 @@ class SearchConnection(object):
             self.__context_class = DatasetSearchContext
 
         self._isopen = False
+        self._in_context = False
+        self._last_used = None
+
+        # Queries may be sent from several threads (e.g. by a prefetching
+        # ResultSet) so opening and closing the session is guarded and the
+        # session is only closed once no query is in flight.
+        self._lock = threading.RLock()
+        self._in_flight = 0
+
+    def __getstate__(self):
+        # Copies, e.g. sent to other processes, open their own session
+        state = self.__dict__.copy()
+        del state['_lock']
+        state.update(session=None, _passed_session=None, _isopen=False,
+                     _in_context=False, _in_flight=0, _last_used=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
 
     def open(self):
         if (isinstance(self._passed_session, requests.Session) or isinstance(
@@ -102,26 +202,70 @@ class SearchConnection(object):
         else:
             self.session = create_single_session(
                 cache=self.cache,
-                expire_after=self.expire_after)
+                expire_after=self.expire_after,
+                pool_maxsize=self.pool_maxsize)
         self._isopen = True
+        self._last_used = time.monotonic()
         return
 
     def __enter__(self):
         self.open()
+        self._in_context = True
         return self
 
     def __exit__(self, type, value, traceback):
+        self._in_context = False
         self.close()
         return
 
     def close(self):
         # Close the session
-        if not (isinstance(self._passed_session, requests.Session) or isinstance(
-                self._passed_session, requests_cache.CachedSession)):
+        if self._isopen and not (
+                isinstance(self._passed_session, requests.Session) or
+                isinstance(self._passed_session, requests_cache.CachedSession)):
             self.session.close()
         self._isopen = False
         return
 
+    @property
+    def persistent(self):
+        """
+        True if the session is kept open between queries, either because
+        the connection was created with ``keep_alive=True`` or because it is
+        being used as a context manager.
+
+        """
+        return self.keep_alive or self._in_context
+
+    def _ensure_open(self):
+        """
+        Open the session if necessary, recycling a keep-alive session that
+        has been idle for longer than ``idle_timeout``.
+
+        """
+        with self._lock:
+            if (self._isopen and self._in_flight == 0 and
+                    self.idle_timeout is not None and
+                    time.monotonic() - self._last_used > self.idle_timeout):
+                log.debug('Session idle for more than %ss, reopening' %
+                          self.idle_timeout)
+                self.close()
+            if not self._isopen:
+                self.open()
+            self._in_flight += 1
+
+    def _release(self):
+        """
+        Close the session after a query unless it is persistent or other
+        queries are still in flight.
+
+        """
+        with self._lock:
+            self._in_flight -= 1
+            self._last_used = time.monotonic()
+            if not self.persistent and self._in_flight == 0:
+                self.close()
+
     def __check_url(self):
         """
         Previous versions of the API expected the full URL to be given
@@ -145,24 +289,52 @@ class SearchConnection(object):
 
         self.url = mo.group(1)
 
-    def send_search(self, query_dict, limit=None, offset=None, shards=None):
+    def send_search(self, query_dict, limit=None, offset=None, shards=None,
+                    stream=False):
         """
         Send a query to the "search" endpoint.
         See :meth:`send_query()` for details.
 
+        :param stream: If True the response body is decoded incrementally
+            and a :class:`pyesgf.search.streaming.StreamingSearchResponse`
+            is returned instead of the json document.  The session is held
+            until its documents have been consumed or it is closed.
         :return: The json document for the search results
 
         """
-        full_query = self._build_query(query_dict, limit, offset, shards)
-        if not self._isopen:
-            self.open()
-        response = self._send_query('search', full_query)
-        ret = response.json()
-        response.close()
-        self.close()
+        full_query = self._build_query(query_dict, limit, offset,
+                                       self._route_shards(shards))
+        if stream:
+            self._ensure_open()
+            return self._send_streaming_search(full_query)
+
+        return self._send_search(full_query)
+
+    def _send_search(self, full_query):
+        self._ensure_open()
+        try:
+            response = self._send_query('search', full_query)
+            ret = self.json_decoder(response.content)
+            response.close()
+        finally:
+            self._release()
 
         return ret
 
+    def _send_streaming_search(self, full_query):
+        try:
+            response = self._send_query('search', full_query, stream=True)
+        except Exception:
+            self._release()
+            raise
+
+        def on_close():
+            response.close()
+            self._release()
+
+        return StreamingSearchResponse(
+            response.iter_content(STREAM_CHUNK_SIZE), on_close=on_close)
+
     def send_wget(self, query_dict, shards=None):
         """
         Send a query to the "search" endpoint.
@@ -171,47 +343,131 @@ class SearchConnection(object):
         :return: A string containing the script.
 
         """
-        full_query = self._build_query(query_dict, shards=shards)
-        if 'type' in full_query:
-            del full_query['type']
-        if 'format' in full_query:
-            del full_query['format']
-
-        self.open()
-        response = self._send_query('wget', full_query)
-        script = response.text
-        response.close()
-        self.close()
+        full_query = self._build_wget_query(query_dict,
+                                            shards=self._route_shards(shards))
+        self._ensure_open()
+        try:
+            response = self._send_query('wget', full_query)
+            script = response.text
+            response.close()
+        finally:
+            self._release()
 
         return script
 
-    def _send_query(self, endpoint, full_query):
+    def _send_query(self, endpoint, full_query, stream=False, timeout=None,
+                    retry=True):
         """
         Generally not to be called directly by the user but via SearchContext
         instances.
 
+        Failed requests are retried according to the connection's retry
+        policy.
+
         :param full_query: dictionary of query string parameers to send.
+        :param stream: If True the response body is not read before
+            returning.
+        :param timeout: Overrides the timeout of the connection.
+        :param retry: If False the request is sent only once.
         :return: the requests response object from the query.
 
         """
 
         log.debug('Query dict is %s' % full_query)
 
-        query_url = '%s/%s?%s' % (self.url, endpoint, urlencode(full_query))
+        query_url = self._query_url(endpoint, full_query)
         log.debug('Query request is %s' % query_url)
 
-        response = self.session.get(query_url, verify=self.verify,
-                                    timeout=self.timeout)
-        if response.status_code == 400:
-            # If error code 400, use urllib to find the errors:
-            errors = set(re.findall(r"Invalid HTTP query parameter=(\w+)",
-                         response.text))
-            content = "; ".join([e for e in list(errors)])
-            raise Exception("Invalid query parameter(s): %s" % content)
+        if timeout is None:
+            timeout = self.timeout
+        policy = self.retry if retry else None
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt_timeout = (timeout if policy is None
+                               else policy.timeout(timeout, start))
+            try:
+                response = self._get(query_url, attempt_timeout, stream)
+            except RETRY_EXCEPTIONS as err:
+                delay = (None if policy is None
+                         else policy.next_delay(attempt, start))
+                if delay is None:
+                    raise
+                log.info('Query failed (%s), retrying in %.1fs' %
+                         (err, delay))
+            else:
+                if response.status_code == 400:
+                    raise EsgfInvalidQueryException(
+                        "Invalid query parameter(s): %s" %
+                        _invalid_parameters(response.text))
+
+                retry_after = parse_retry_after(
+                    response.headers.get('Retry-After'))
+                if (self.throttle is not None and retry_after and
+                        response.status_code == 429):
+                    self.throttle.pause(query_url, retry_after)
+
+                delay = None
+                if (policy is not None and
+                        response.status_code in policy.retry_statuses):
+                    delay = policy.next_delay(attempt, start, retry_after)
+                if delay is None:
+                    # Raise if query was unsucessful:
+                    response.raise_for_status()
+                    return response
+
+                log.info('Query returned HTTP %d, retrying in %.1fs' %
+                         (response.status_code, delay))
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _get(self, query_url, timeout, stream):
+        # With stream=True the in-flight slot is released once the headers
+        # have been received.
+        if self.throttle is None:
+            return self.session.get(query_url, verify=self.verify,
+                                    timeout=timeout, stream=stream)
+        with self.throttle.request(query_url):
+            return self.session.get(query_url, verify=self.verify,
+                                    timeout=timeout, stream=stream)
+
+    def _query_url(self, endpoint, full_query):
+        return '%s/%s?%s' % (self.url, endpoint, urlencode(full_query))
+
+    def _build_wget_query(self, query_dict, shards=None):
+        full_query = self._build_query(query_dict, shards=shards)
+        if 'type' in full_query:
+            del full_query['type']
+        if 'format' in full_query:
+            del full_query['format']
+
+        return full_query
+
+    def monitor_shards(self, **kwargs):
+        """
+        Attach a :class:`pyesgf.search.shards.ShardMonitor` to this
+        connection so that distributed queries leave out unhealthy shards.
+
+        :param kwargs: Options of :class:`ShardMonitor`.
+        :return: The monitor.
 
-        # Raise if query was unsucessful:
-        response.raise_for_status()
-        return response
+        """
+        from .shards import ShardMonitor
+
+        self.shard_monitor = ShardMonitor(self, **kwargs)
+        return self.shard_monitor
+
+    def _route_shards(self, shards):
+        """
+        Return the shards a query should be sent to, as chosen by the shard
+        monitor for distributed queries.
+
+        """
+        if self.shard_monitor is None or not self.distrib:
+            return shards
+        return self.shard_monitor.route(shards)
 
     def _build_query(self, query_dict, limit=None, offset=None, shards=None):
         if shards is not None:
@@ -252,7 +508,7 @@ class SearchConnection(object):
 
         return full_query
 
-    def _load_available_shards(self):
+    def _load_available_shards(self, refresh=False):
 
         # Shards are not available if distrib=False.  The server won't send
         # back a list of shards
@@ -260,10 +516,43 @@ class SearchConnection(object):
             raise EsgfSearchException('Shard list not available for '
                                       'non-distributed queries')
 
-        self._available_shards = {}
+        if not refresh and self._load_cached_shards():
+            return
 
-        response_json = self.send_search({'facets': [], 'fields': []})
+        # Not routed: the shard monitor itself needs the shard list
+        response_json = self._send_search(
+            self._build_query({'facets': [], 'fields': []}))
+        self._set_available_shards(self._parse_shards(response_json))
+
+    def _load_cached_shards(self):
+        """
+        Set the available shards from the disk cache if possible.
 
+        :return: True if the shards were found in the cache.
+
+        """
+        if self.shard_cache is None:
+            return False
+
+        shards = self.shard_cache.get(self.url)
+        if shards is None:
+            return False
+
+        log.debug('Shard list of %s loaded from the cache' % self.url)
+        self._available_shards = shards
+        return True
+
+    def _set_available_shards(self, shards):
+        self._available_shards = shards
+        if self.shard_cache is not None:
+            self.shard_cache.set(self.url, shards)
+
+    def _parse_shards(self, response_json):
+        """
+        Extract the shard dictionary from a search response.
+
+        """
+        available_shards = {}
         try:
             shards = (response_json['responseHeader']['params']['shards']
                       .split(','))
@@ -285,10 +574,12 @@ class SearchConnection(object):
                 parsed_url = urlparse(self.url)
                 shard_parts['host'] = parsed_url.hostname
 
-            (self._available_shards.setdefault(shard_parts['host'], [])
+            (available_shards.setdefault(shard_parts['host'], [])
              .append((shard_parts['port'], shard_parts['suffix'])))
 
-    def get_shard_list(self):
+        return available_shards
+
+    def get_shard_list(self, refresh=False):
         """
         return the list of all available shards.  A subset of the returned list
         can be supplied to 'send_query()' to limit the query to selected
@@ -297,14 +588,70 @@ class SearchConnection(object):
         Shards are described by hostname and mapped to SOLr shard descriptions
         internally.
 
+        :param refresh: If True the shards are discovered again rather than
+            taken from this connection or the shard cache.
         :return: the list of available shards
 
         """
-        if self._available_shards is None:
-            self._load_available_shards()
+        if refresh or self._available_shards is None:
+            self._load_available_shards(refresh=refresh)
 
         return self._available_shards
 
+    def _canonical_query(self, query_dict, shards=None):
+        """
+        Return a hashable representation of a query which is equal for
+        equivalent queries, e.g. regardless of the order of multiple values.
+
+        """
+        full_query = self._build_query(query_dict)
+        if shards is not None:
+            full_query['shards'] = ','.join(sorted(shards))
+
+        items = set()
+        for key, value in full_query.items():
+            # The returned fields don't change the counts
+            if key == 'fields':
+                continue
+            if key == 'facets' and isinstance(value, str):
+                values = value.split(',')
+            elif isinstance(value, (list, set)):
+                values = value
+            else:
+                values = [value]
+
+            for v in values:
+                items.add((key, _canonical_value(v)))
+
+        return tuple(sorted(items, key=repr))
+
+    def _get_cached_counts(self, query_dict, shards=None):
+        """
+        :return: ``(hit_count, facet_counts)`` for *query_dict* if cached
+            otherwise None.
+
+        """
+        if self._counts_cache is None:
+            return None
+
+        cached = self._counts_cache.get(self._canonical_query(query_dict,
+                                                              shards))
+        if cached is None:
+            return None
+
+        hit_count, facet_counts = cached
+        return hit_count, dict((facet, dict(counts)) for facet, counts
+                               in facet_counts.items())
+
+    def _set_cached_counts(self, query_dict, shards, hit_count, facet_counts):
+        if self._counts_cache is None:
+            return
+
+        self._counts_cache.set(
+            self._canonical_query(query_dict, shards),
+            (hit_count, dict((facet, dict(counts)) for facet, counts
+                             in facet_counts.items())))
+
     def new_context(self, context_class=None,
                     latest=None, facets=None, fields=None,
                     from_timestamp=None, to_timestamp=None,
@@ -338,8 +685,6 @@ def query_keyword_type(keyword):
     facet keyword
 
     """
-    # !TODO: support "last update" constraints (to/from)
-
     if keyword == 'query':
         return 'freetext'
     elif keyword in ['start', 'end', 'from_timestamp', 'to_timestamp']:
@@ -353,13 +698,35 @@ def query_keyword_type(keyword):
         return 'facet'
 
 
+def _canonical_value(value):
+    # Operator tuples, e.g. from not_equals(), keep their tag
+    if isinstance(value, tuple):
+        tag, value = value
+        return (tag, _canonical_value(value))
+    if isinstance(value, bool) or str(value).lower() in ('true', 'false'):
+        return str(value).lower()
+    return str(value).strip()
+
+
+def _invalid_parameters(text):
+    """
+    Return a description of the invalid query parameters reported in the
+    body of a HTTP 400 response.
+
+    """
+    errors = set(re.findall(r"Invalid HTTP query parameter=(\w+)", text))
+    return "; ".join([e for e in list(errors)])
+
+
 def create_single_session(cache=None, expire_after=datetime.timedelta(hours=1),
-                          **kwargs):
+                          pool_maxsize=None, **kwargs):
     """
     Simple helper function to start a requests or requests_cache session.
 
     cache, if specified is a filename to a threadsafe sqlite database
     expire_after specifies how long the cache should be kept
+    pool_maxsize, if specified, is the number of connections kept open per
+    host by the session's connection pool
     """
     if cache is not None:
         try:
@@ -376,4 +743,9 @@ def create_single_session(cache=None, expire_after=datetime.timedelta(hours=1),
                        .CachedSession(cache, expire_after=expire_after))
     else:
         session = requests.Session()
+
+    if pool_maxsize is not None:
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
     return session
@@ -8,7 +8,18 @@ QUERY_KEYWORD_TYPES = ('system', 'facet', 'freetext', 'temporal', 'geospatial')
 RESPONSE_FORMAT = 'application/solr+json'
 DEFAULT_BATCH_SIZE = 50
 
+# Stable sort used for cursor based paging.  Must include the unique key.
+CURSOR_SORT = 'id asc'
+CURSOR_START = '*'
+
 OPERATOR_NEQ = 'not_equal'
 
+# Number of distinct records held back while removing duplicates
+DEDUP_WINDOW = 10000
+
+# Maximum length of the encoded dataset_id constraints in one bulk query,
+# keeping URLs well within common server limits
+MAX_BULK_QUERY_LENGTH = 6000
+
 SHARD_REXP = (r'^(?P<prefix>https?://)?(?P<host>.+?):?'
               r'(?P<port>\d+)?/(?P<suffix>.*)$')
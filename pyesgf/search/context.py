@@ -17,7 +17,7 @@ from webob.multidict import MultiDict
 from .constraints import GeospatialConstraint
 from .consts import (TYPE_DATASET, TYPE_FILE, TYPE_AGGREGATION,
                      QUERY_KEYWORD_TYPES, DEFAULT_BATCH_SIZE)
-from .results import ResultSet
+from .results import ResultSet, _project_fields
 from .exceptions import EsgfSearchException
 
 
@@ -94,6 +94,7 @@ class SearchContext(object):
         self.freetext_constraint = None
         self.facet_constraints = MultiDict()
         self.temporal_constraint = [from_timestamp, to_timestamp]
+        self.last_update_constraint = (None, None)
         self.geospatial_constraint = None
 
         self._update_constraints(constraints)
@@ -118,13 +119,19 @@ class SearchContext(object):
     # These do not change the constraints on self.
 
     def search(self, batch_size=DEFAULT_BATCH_SIZE, ignore_facet_check=False,
-               **constraints):
+               prefetch=0, max_workers=None, **constraints):
         """
         Perform the search with current constraints returning a set of results.
 
         :batch_size: The number of results to get per HTTP request.
-        :ignore_facet_check: Do not make an extra HTTP request to populate
-            :py:attr:`~facet_counts` and :py:attr:`~hit_count`.
+        :ignore_facet_check: Do not populate :py:attr:`~facet_counts` and
+            :py:attr:`~hit_count`.  Otherwise they are retrieved in the same
+            request as the first batch of results if :py:attr:`facets` is
+            set or the connection isn't distributed, or else in a separate
+            request.
+        :prefetch: The number of batches to fetch ahead in background threads
+            while results are consumed.  See :class:`ResultSet`.
+        :max_workers: The number of threads used for prefetching.
         :param constraints: Further constraints for this query.  Equivalent
             to calling ``self.constrain(**constraints).search()``
         :return: A ResultSet for this query
@@ -135,20 +142,68 @@ class SearchContext(object):
         else:
             sc = self
 
-        if not ignore_facet_check:
+        if (not ignore_facet_check and sc.__hit_count is None and
+                (sc.facets or not sc.connection.distrib)):
+            query_dict = sc._build_facet_query()
+            if not sc._load_cached_counts(query_dict):
+                # Retrieve the facet counts and the first batch in one request
+                _project_fields(query_dict, sc)
+                response = sc.connection.send_search(query_dict,
+                                                     limit=batch_size,
+                                                     offset=0,
+                                                     shards=sc.shards)
+                sc._set_counts(response, query_dict)
+
+                results = ResultSet(sc, batch_size=batch_size, eager=False,
+                                    prefetch=prefetch,
+                                    max_workers=max_workers)
+                results._add_batch(0, response)
+                return results
+        elif not ignore_facet_check:
+            # Distributed queries with facets=* may drop results, so the
+            # first batch is retrieved without facets like the others.
             sc.__update_counts()
 
-        return ResultSet(sc, batch_size=batch_size)
+        return ResultSet(sc, batch_size=batch_size, prefetch=prefetch,
+                         max_workers=max_workers)
 
     def constrain(self, **constraints):
         """
         Return a *new* instance with the additional constraints.
 
+        The new instance shares the connection and any constraint
+        structures which are not changed by *constraints* with this
+        instance.
+
         """
-        new_sc = copy.deepcopy(self)
+        new_sc = copy.copy(self)
+
+        # Copy only the constraint structures that will be modified
+        constraints_split = self._split_constraints(constraints)
+        if constraints_split['facet']:
+            new_sc.facet_constraints = self.facet_constraints.copy()
+        if constraints_split['temporal']:
+            new_sc.temporal_constraint = list(self.temporal_constraint)
+
         new_sc._update_constraints(constraints)
         return new_sc
 
+    def files_by_dataset(self, **kwargs):
+        """
+        Retrieve the files of every dataset matching the current
+        constraints with as few searches as possible.
+
+        See :func:`pyesgf.search.bulk.files_by_dataset` for the arguments.
+
+        :return: A dictionary ``{dataset_id: [FileResult, ...]}``
+
+        """
+        if self.search_type != TYPE_DATASET:
+            raise EsgfSearchException('files_by_dataset() requires a '
+                                      'Dataset search context')
+
+        return self.search(ignore_facet_check=True).files_by_dataset(**kwargs)
+
     def get_download_script(self, **constraints):
         """
         Download a script for downloading all files in the set of results.
@@ -190,16 +245,7 @@ class SearchContext(object):
         which are not relevant for further constraining are removed.
 
         """
-        facet_options = {}
-        hits = self.hit_count
-        for facet, counts in list(self.facet_counts.items()):
-            # filter out counts that match total hits
-            counts = dict(items for items in list(counts.items())
-                          if items[1] < hits)
-            if len(counts) > 1:
-                facet_options[facet] = counts
-
-        return facet_options
+        return _facet_options(self.facet_counts, self.hit_count)
 
     def __update_counts(self):
         # If hit_count is set the counts are already retrieved
@@ -208,6 +254,19 @@ class SearchContext(object):
 
         self.__facet_counts = {}
         self.__hit_count = None
+        query_dict = self._build_facet_query()
+        if self._load_cached_counts(query_dict):
+            return
+
+        response = self.connection.send_search(query_dict, limit=0,
+                                               shards=self.shards)
+        self._set_counts(response, query_dict)
+
+    def _build_facet_query(self):
+        """
+        Build the query used to retrieve facet counts.
+
+        """
         query_dict = self._build_query()
 
         if self.facets:
@@ -217,7 +276,39 @@ class SearchContext(object):
             if self.connection.distrib:
                 self._do_facets_star_warning()
 
-        response = self.connection.send_search(query_dict, limit=0)
+        return query_dict
+
+    def _get_counts(self):
+        """
+        Return the cached ``(hit_count, facet_counts)``.  hit_count is None
+        if the counts have not been retrieved.
+
+        """
+        return self.__hit_count, self.__facet_counts
+
+    def _load_cached_counts(self, query_dict):
+        """
+        Populate :py:attr:`~facet_counts` and :py:attr:`~hit_count` from the
+        connection's cache if *query_dict* has been counted before.
+
+        :return: True if the counts were found in the cache.
+
+        """
+        cached = self.connection._get_cached_counts(query_dict, self.shards)
+        if cached is None:
+            return False
+
+        self.__hit_count, self.__facet_counts = cached
+        return True
+
+    def _set_counts(self, response, query_dict=None):
+        """
+        Populate :py:attr:`~facet_counts` and :py:attr:`~hit_count` from a
+        search response.  If *query_dict* is given the counts are also
+        stored in the connection's cache.
+
+        """
+        self.__facet_counts = {}
         for facet, counts in (list(response['facet_counts']['facet_fields'].items())):
             d = self.__facet_counts[facet] = {}
             while counts:
@@ -225,6 +316,11 @@ class SearchContext(object):
 
         self.__hit_count = response['response']['numFound']
 
+        if query_dict is not None:
+            self.connection._set_cached_counts(query_dict, self.shards,
+                                               self.__hit_count,
+                                               self.__facet_counts)
+
     def _do_facets_star_warning(self):
         env_var_name = 'ESGF_PYCLIENT_NO_FACETS_STAR_WARNING'
         if env_var_name in os.environ:
@@ -278,6 +374,14 @@ or explicitly use  conn.new_context(facets='*')
                                            ['to_timestamp'])
         # self._constrain_geospatial()
 
+        # Range of the records' last update time, the "from" and "to"
+        # parameters of the search API
+        last_update = constraints_split['system']
+        if 'from' in last_update or 'to' in last_update:
+            start, end = self.last_update_constraint
+            self.last_update_constraint = (last_update.get('from', start),
+                                           last_update.get('to', end))
+
         # reset cached values
         self.__hit_count = None
         self.__facet_counts = None
@@ -348,9 +452,24 @@ or explicitly use  conn.new_context(facets='*')
         start, end = self.temporal_constraint
         query_dict.update(start=start, end=end)
 
+        updated_from, updated_to = self.last_update_constraint
+        query_dict.update({'from': updated_from, 'to': updated_to})
+
         return query_dict
 
 
+def _facet_options(facet_counts, hits):
+    facet_options = {}
+    for facet, counts in list(facet_counts.items()):
+        # filter out counts that match total hits
+        counts = dict(items for items in list(counts.items())
+                      if items[1] < hits)
+        if len(counts) > 1:
+            facet_options[facet] = counts
+
+    return facet_options
+
+
 class DatasetSearchContext(SearchContext):
     DEFAULT_SEARCH_TYPE = TYPE_DATASET
 
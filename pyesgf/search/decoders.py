@@ -0,0 +1,62 @@
+"""
+
+Module :mod:`pyesgf.search.decoders`
+====================================
+
+JSON decoders used for search responses.  The fastest installed backend is
+chosen by default, in order of preference orjson_, pysimdjson_ and ujson_,
+falling back to the standard library :mod:`json` module.
+
+.. _orjson: https://pypi.org/project/orjson/
+.. _pysimdjson: https://pypi.org/project/pysimdjson/
+.. _ujson: https://pypi.org/project/ujson/
+
+"""
+
+import json
+
+JSON_DECODERS = {'json': json.loads}
+
+try:
+    import orjson
+    JSON_DECODERS['orjson'] = orjson.loads
+except ImportError:
+    pass
+
+try:
+    import simdjson
+    JSON_DECODERS['simdjson'] = simdjson.loads
+except ImportError:
+    pass
+
+try:
+    import ujson
+    JSON_DECODERS['ujson'] = ujson.loads
+except ImportError:
+    pass
+
+_PREFERENCE = ('orjson', 'simdjson', 'ujson', 'json')
+
+
+def get_json_decoder(decoder=None):
+    """
+    Return a function decoding a JSON document given as bytes or a string.
+
+    :param decoder: The name of a backend in ``JSON_DECODERS``, a callable
+        which is returned unchanged, or None to select the fastest
+        installed backend.
+
+    """
+    if callable(decoder):
+        return decoder
+
+    if decoder is None:
+        for name in _PREFERENCE:
+            if name in JSON_DECODERS:
+                return JSON_DECODERS[name]
+
+    try:
+        return JSON_DECODERS[decoder]
+    except KeyError:
+        raise ValueError('JSON decoder %s is not available.  Choose one of '
+                         '%s' % (decoder, ', '.join(sorted(JSON_DECODERS))))
@@ -0,0 +1,168 @@
+"""
+
+Module :mod:`pyesgf.search.dedup`
+=================================
+
+Removal of duplicate records from search results.  Distributed searches
+return a file once for the master copy and once for each replica.  Records
+are considered duplicates when they have the same ``instance_id``, or
+``title`` if they have no instance id, and the same ``checksum``.  Records
+without a checksum are compared on their ``tracking_id`` instead, so they
+are not merged with copies which have a checksum.  Identical files of
+different datasets are kept apart by their instance id.  The surviving
+record, the master copy if there is one, receives the URLs of all its
+duplicates so that :attr:`BaseResult.urls` lists every replica.
+
+Records other than files have no checksum or tracking id, so
+:meth:`ResultSet.iter_unique()` compares them on their ``instance_id``
+only.
+
+Results are streamed.  Only a window of the most recent distinct records,
+into which duplicates are merged, is held, along with a 128 bit digest of
+the key of each distinct record seen, which still grows with the number of
+distinct records.  Record ids are the instance id followed by the data
+node, so when results are sorted by id, as they are by
+:meth:`ResultSet.iter_cursor()`, the copies of a file arrive together.  A
+duplicate arriving after its survivor has left the window is dropped
+without its URLs being merged.
+
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+
+from ..exceptions import DuplicateHashError
+from ..util import _first
+from .consts import DEDUP_WINDOW
+
+log = logging.getLogger(__name__)
+
+
+class DuplicateIndex(object):
+    """
+    A compact set of the keys seen so far.  Only a 128 bit BLAKE2 digest of
+    each key is held, wide enough for distinct keys not to collide.
+
+    """
+    def __init__(self):
+        self._digests = set()
+
+    def __len__(self):
+        return len(self._digests)
+
+    def __contains__(self, key):
+        return _digest(key) in self._digests
+
+    def add(self, key):
+        """
+        Add *key* to the index.
+
+        :return: False if the key was already present.
+
+        """
+        digest = _digest(key)
+        if digest in self._digests:
+            return False
+        self._digests.add(digest)
+        return True
+
+
+def _digest(key):
+    return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).digest()
+
+
+def iter_unique(results, window=DEDUP_WINDOW, strict=False, key=None):
+    """
+    Yield the results of an iterable of result objects without duplicates.
+
+    Records with neither a checksum nor a tracking id are passed through.
+
+    :param results: An iterable of :class:`BaseResult`.
+    :param window: The number of distinct records held back so that their
+        duplicates can be merged into them.
+    :param strict: If True raise :class:`pyesgf.exceptions.DuplicateHashError`
+        when records within the window share a tracking id but not a
+        checksum, which indicates a corrupt replica.  Otherwise such records
+        are logged and both are kept.
+    :param key: A function returning the key identifying copies of a json
+        document, or None to compare documents as described above.  No
+        consistency check is made with other keys.
+
+    """
+    index = DuplicateIndex()
+    pending = OrderedDict()
+    # The checksums of the tracking ids of the pending records
+    tracking_checksums = {}
+
+    for result in results:
+        doc_key = _key(result.json) if key is None else key(result.json)
+        if doc_key is None:
+            pending[('result', id(result))] = result
+        elif doc_key in pending:
+            pending[doc_key] = _merge(pending[doc_key], result)
+            continue
+        else:
+            if key is None:
+                tracking_id, checksum = _tracking_checksum(result.json)
+                if (tracking_id is not None and checksum is not None and
+                        tracking_checksums.setdefault(tracking_id,
+                                                      checksum) != checksum):
+                    message = ('Records with tracking_id %s have different '
+                               'checksums' % tracking_id)
+                    if strict:
+                        raise DuplicateHashError(message)
+                    log.warning(message)
+
+            if not index.add(doc_key):
+                log.debug('Dropping late duplicate %s' % result.json['id'])
+                continue
+            pending[doc_key] = result
+
+        if len(pending) > window:
+            old_key, old_result = pending.popitem(last=False)
+            if tracking_checksums:
+                tracking_id, checksum = _tracking_checksum(old_result.json)
+                if (tracking_id is not None and
+                        tracking_checksums.get(tracking_id) == checksum):
+                    del tracking_checksums[tracking_id]
+            yield old_result
+
+    for result in pending.values():
+        yield result
+
+
+def _instance_key(doc):
+    return _first(doc.get('instance_id')) or None
+
+
+def _key(doc):
+    tracking_id, checksum = _tracking_checksum(doc)
+    if checksum is None and tracking_id is None:
+        return None
+
+    name = _first(doc.get('instance_id')) or _first(doc.get('title'))
+    if checksum is not None:
+        return (name, checksum)
+    return (name, None, tracking_id)
+
+
+def _tracking_checksum(doc):
+    checksum = _first(doc.get('checksum'))
+    return (_first(doc.get('tracking_id')),
+            checksum.lower() if checksum else None)
+
+
+def _merge(survivor, duplicate):
+    """
+    Merge two copies of a record, keeping the master copy.
+
+    :return: the surviving result.
+
+    """
+    if _first(survivor.json.get('replica')) and \
+            not _first(duplicate.json.get('replica')):
+        survivor, duplicate = duplicate, survivor
+
+    survivor._add_urls(duplicate.json.get('url', []))
+    return survivor
@@ -10,3 +10,11 @@ class EsgfSearchException(Exception):
 
     """
     pass
+
+
+class EsgfInvalidQueryException(EsgfSearchException):
+    """
+    Raised when the search service rejects one or more query parameters.
+
+    """
+    pass
@@ -0,0 +1,191 @@
+"""
+
+Module :mod:`pyesgf.search.export`
+==================================
+
+Columnar export of search results.  Columns are built directly from the
+json documents of each batch without creating result objects.  The export
+formats require the optional libraries pyarrow_, pandas_ or numpy_.
+
+.. _pyarrow: https://pypi.org/project/pyarrow/
+.. _pandas: https://pypi.org/project/pandas/
+.. _numpy: https://pypi.org/project/numpy/
+
+Multi-valued Solr fields holding a single value are exported as that value,
+otherwise as a list.  The URL columns ``download_url``, ``opendap_url``,
+``las_url``, ``gridftp_url`` and ``globus_url`` are derived from the ``url``
+field as for :class:`pyesgf.search.results.BaseResult`.  Columns which are
+not among the default fields of the result class are requested from the
+search service along with them.
+
+"""
+
+import re
+
+try:
+    import pyarrow
+    _has_pyarrow = True
+except ImportError:
+    _has_pyarrow = False
+
+try:
+    import pandas
+    _has_pandas = True
+except ImportError:
+    _has_pandas = False
+
+try:
+    import numpy
+    _has_numpy = True
+except ImportError:
+    _has_numpy = False
+
+from .consts import TYPE_DATASET, TYPE_FILE, TYPE_AGGREGATION
+
+DEFAULT_COLUMNS = {
+    TYPE_DATASET: ('id', 'instance_id', 'title', 'version', 'number_of_files',
+                   'size', 'replica', 'latest', 'data_node', 'index_node'),
+    TYPE_FILE: ('id', 'dataset_id', 'title', 'size', 'checksum',
+                'checksum_type', 'tracking_id', 'version', 'data_node',
+                'index_node', 'download_url', 'opendap_url'),
+    TYPE_AGGREGATION: ('id', 'dataset_id', 'title', 'data_node',
+                       'index_node', 'opendap_url', 'las_url'),
+}
+
+URL_COLUMNS = {
+    'download_url': 'HTTPServer',
+    'opendap_url': 'OPENDAP',
+    'las_url': 'LAS',
+    'gridftp_url': 'GridFTP',
+    'globus_url': 'Globus',
+}
+
+
+def build_columns(docs, columns):
+    """
+    Return a dictionary ``{column: [value, ...]}`` for a list of json
+    documents.
+
+    """
+    return dict((column, [_column_value(doc, column) for doc in docs])
+                for column in columns)
+
+
+def iter_column_batches(result_set, columns=None):
+    """
+    Yield a column dictionary for each batch of *result_set*.
+
+    """
+    if columns is None:
+        columns = DEFAULT_COLUMNS[result_set.context.search_type]
+
+    # The URL columns are derived from the url field
+    fields = set('url' if column in URL_COLUMNS else column
+                 for column in columns)
+    for docs in result_set.iter_doc_batches(fields=fields):
+        yield build_columns(docs, columns)
+
+
+def iter_record_batches(result_set, columns=None):
+    """
+    Yield a ``pyarrow.RecordBatch`` for each batch of *result_set*.
+
+    """
+    _require(_has_pyarrow, 'pyarrow')
+    for cols in iter_column_batches(result_set, columns):
+        yield pyarrow.RecordBatch.from_pydict(cols)
+
+
+def to_arrow(result_set, columns=None):
+    """
+    :return: a ``pyarrow.Table`` of all results.
+
+    """
+    _require(_has_pyarrow, 'pyarrow')
+    return pyarrow.table(_all_columns(result_set, columns))
+
+
+def to_pandas(result_set, columns=None):
+    """
+    :return: a ``pandas.DataFrame`` of all results.
+
+    """
+    _require(_has_pandas, 'pandas')
+    return pandas.DataFrame(_all_columns(result_set, columns))
+
+
+def to_numpy(result_set, columns=None):
+    """
+    :return: a structured ``numpy.ndarray`` of all results.  Integer and
+        float columns have numeric dtypes, other columns are objects.
+
+    """
+    _require(_has_numpy, 'numpy')
+    cols = _all_columns(result_set, columns)
+    arrays = []
+    for values in cols.values():
+        if values and all(isinstance(v, int) and not isinstance(v, bool)
+                          for v in values):
+            dtype = numpy.int64
+        elif values and all(isinstance(v, (int, float)) and
+                            not isinstance(v, bool) for v in values):
+            dtype = numpy.float64
+        else:
+            dtype = object
+        if dtype is object:
+            # numpy.array() would make lists of equal length a 2-D array
+            a = numpy.empty(len(values), dtype=object)
+            for i, value in enumerate(values):
+                a[i] = value
+        else:
+            a = numpy.array(values, dtype=dtype)
+        arrays.append(a)
+
+    n_rows = len(arrays[0]) if arrays else 0
+    array = numpy.empty(n_rows, dtype=[(str(name), a.dtype) for name, a
+                                       in zip(cols, arrays)])
+    for name, a in zip(cols, arrays):
+        array[name] = a
+
+    return array
+
+
+def _all_columns(result_set, columns):
+    all_cols = None
+    for cols in iter_column_batches(result_set, columns):
+        if all_cols is None:
+            all_cols = cols
+        else:
+            for name, values in cols.items():
+                all_cols[name].extend(values)
+
+    if all_cols is None:
+        if columns is None:
+            columns = DEFAULT_COLUMNS[result_set.context.search_type]
+        all_cols = dict((column, []) for column in columns)
+
+    return all_cols
+
+
+def _column_value(doc, column):
+    # Only look at the fields retrieved, so that a projected document never
+    # fetches the rest of its record
+    if column in URL_COLUMNS and not dict.__contains__(doc, column):
+        service = URL_COLUMNS[column]
+        for encoded in dict.get(doc, 'url', []):
+            url, mime_type, url_service = encoded.split('|')
+            if url_service == service:
+                if service == 'OPENDAP':
+                    url = re.sub(r'.html$', '', url)
+                return url
+        return None
+
+    value = dict.get(doc, column)
+    if isinstance(value, list) and len(value) == 1:
+        return value[0]
+    return value
+
+
+def _require(has_module, name):
+    if not has_module:
+        raise ImportError('This export requires the %s package' % name)
@@ -0,0 +1,213 @@
+"""
+
+Module :mod:`pyesgf.search.federated`
+=====================================
+
+Client-side federated search.  Instead of asking one index node to
+distribute a query to its peers, :class:`FederatedSearch` sends the query
+with ``distrib=false`` to several index nodes concurrently and merges their
+hit counts, facet counts and results.  A slow or failing node only delays
+or loses its own share of the results::
+
+  >>> fs = FederatedSearch(['https://esgf-node.llnl.gov/esg-search',
+  ...                       'https://esgf.ceda.ac.uk/esg-search'])
+  >>> results = fs.search(project='CMIP6', source_id='UKESM1-0-LL',
+  ...                     facets='experiment_id')
+  >>> results.hit_count, results.facet_counts['experiment_id']
+  >>> for dataset in results:
+  ...     print(dataset.dataset_id)
+
+Copies of the same record published by several nodes (masters and
+replicas share their ``instance_id``) are merged as described in
+:mod:`pyesgf.search.dedup`.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import queue
+import threading
+
+from .connection import SearchConnection
+from .consts import DEFAULT_BATCH_SIZE, DEDUP_WINDOW
+from . import dedup
+
+log = logging.getLogger(__name__)
+
+# Number of batches buffered from each node while results are merged
+FEDERATED_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class FederatedSearch(object):
+    """
+    Searches several index nodes concurrently.
+
+    :ivar connections: A :class:`SearchConnection` with ``distrib=False``
+                       for each index node.
+
+    """
+    def __init__(self, urls, max_workers=None, **connection_kwargs):
+        """
+        :param urls: The URLs of the search services of the index nodes,
+            or :class:`SearchConnection` objects.
+        :param max_workers: The number of nodes queried concurrently.
+            Defaults to the number of nodes.
+        :param connection_kwargs: Further arguments for each
+            :class:`SearchConnection`, e.g. ``timeout``.
+
+        """
+        self.connections = []
+        for url in urls:
+            if isinstance(url, SearchConnection):
+                self.connections.append(url)
+            else:
+                self.connections.append(
+                    SearchConnection(url, distrib=False, **connection_kwargs))
+        self.max_workers = max_workers or len(self.connections)
+
+    def search(self, batch_size=DEFAULT_BATCH_SIZE, search_type=None,
+               facets=None, fields=None, latest=None, replica=None,
+               **constraints):
+        """
+        Send a search to every index node.
+
+        The counts and first batch of results of each node are retrieved
+        before returning.  Nodes which fail are recorded in
+        :py:attr:`FederatedResultSet.errors` and left out.
+
+        :param batch_size: The number of results to get per HTTP request.
+        :param constraints: Constraints and options as for
+            :meth:`SearchConnection.new_context()`.
+        :return: A :class:`FederatedResultSet`.
+
+        """
+        def search_node(connection):
+            context = connection.new_context(
+                search_type=search_type, facets=facets, fields=fields,
+                latest=latest, replica=replica, **constraints)
+            return context, context.search(batch_size=batch_size)
+
+        results = FederatedResultSet(self.max_workers)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(connection, executor.submit(search_node, connection))
+                       for connection in self.connections]
+            for connection, future in futures:
+                try:
+                    context, result_set = future.result()
+                except Exception as err:
+                    log.warning('Search of %s failed: %s' %
+                                (connection.url, err))
+                    results.errors[connection.url] = err
+                else:
+                    results._add_node(connection.url, context, result_set)
+
+        return results
+
+
+class FederatedResultSet(object):
+    """
+    The merged results of a :class:`FederatedSearch`.
+
+    Iterating fetches the remaining batches of every node concurrently and
+    yields results as they arrive, with copies of the same record merged.
+
+    :ivar result_sets: A dictionary ``{url: ResultSet}`` of the nodes which
+                       responded.
+    :ivar errors: A dictionary ``{url: exception}`` of the nodes which
+                  failed.  Nodes failing while iterating are added.
+    :property hit_count: The sum of the hit counts of the nodes.  Copies
+                         of a record are counted once per node.
+    :property facet_counts: The facet counts summed over the nodes.
+    :property node_hit_counts: A dictionary ``{url: hit_count}``.
+
+    """
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.result_sets = {}
+        self.errors = {}
+        self._contexts = {}
+
+    def _add_node(self, url, context, result_set):
+        self._contexts[url] = context
+        self.result_sets[url] = result_set
+
+    @property
+    def node_hit_counts(self):
+        return dict((url, context.hit_count)
+                    for url, context in self._contexts.items())
+
+    @property
+    def hit_count(self):
+        return sum(self.node_hit_counts.values())
+
+    @property
+    def facet_counts(self):
+        merged = {}
+        for context in self._contexts.values():
+            for facet, counts in context.facet_counts.items():
+                merged_counts = merged.setdefault(facet, {})
+                for value, count in counts.items():
+                    merged_counts[value] = merged_counts.get(value, 0) + count
+        return merged
+
+    def __iter__(self):
+        return self.iter_unique()
+
+    def iter_unique(self, window=DEDUP_WINDOW):
+        """
+        Iterate over the results of all nodes, merging copies of a record.
+
+        :param window: See :func:`pyesgf.search.dedup.iter_unique`.
+
+        """
+        return dedup.iter_unique(self.iter_all(), window=window,
+                                 key=dedup._instance_key)
+
+    def iter_all(self):
+        """
+        Iterate over the results of all nodes without removing copies.
+
+        """
+        batches = queue.Queue(maxsize=FEDERATED_QUEUE_SIZE *
+                              max(len(self.result_sets), 1))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_node(url, result_set):
+            try:
+                for docs in result_set.iter_doc_batches():
+                    if not put([result_set._make_result(doc)
+                                for doc in docs]):
+                        return
+            except Exception as err:
+                log.warning('Search of %s failed: %s' % (url, err))
+                self.errors[url] = err
+            finally:
+                put(_DONE)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for url, result_set in self.result_sets.items():
+                executor.submit(read_node, url, result_set)
+
+            n_running = len(self.result_sets)
+            while n_running:
+                batch = batches.get()
+                if batch is _DONE:
+                    n_running -= 1
+                    continue
+                for result in batch:
+                    yield result
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
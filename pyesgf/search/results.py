@@ -11,21 +11,29 @@ hides paging of large result sets behind a client-side cache.  Subclasses of
 
 from collections import defaultdict
 from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 import re
 
 from .consts import (DEFAULT_BATCH_SIZE, TYPE_DATASET, TYPE_FILE,
-                     TYPE_AGGREGATION)
+                     TYPE_AGGREGATION, CURSOR_SORT, CURSOR_START,
+                     DEDUP_WINDOW)
+from .exceptions import EsgfInvalidQueryException
+from . import dedup, export
 
 
 class ResultSet(Sequence):
     """
     :ivar context: The search context object used to generate this resultset
+    :ivar resume_index: The index of the result :meth:`iter_from()` was
+        about to yield when it last stopped, e.g. because a batch could not
+        be retrieved.
     :property batch_size: The number of results that will be requested
         from esgf-search as one call.  This must be set on creation and
         cannot change.
 
     """
-    def __init__(self, context, batch_size=DEFAULT_BATCH_SIZE, eager=True):
+    def __init__(self, context, batch_size=DEFAULT_BATCH_SIZE, eager=True,
+                 prefetch=0, max_workers=None):
         """
         :param context: The search context object used to generate this
                         resultset
@@ -33,11 +41,21 @@ class ResultSet(Sequence):
             esgf-search as one call.
         :param eager: Boolean specifying whether to retrieve the first batch on
             instantiation.
+        :param prefetch: The number of batches following the one currently
+            being read that are fetched concurrently in background threads.
+            0 disables prefetching.
+        :param max_workers: The number of threads used for prefetching.
+            Defaults to ``prefetch``.
         """
         self.context = context
         self.__batch_size = batch_size
         self.__batch_cache = {}
         self.__len_cache = None
+        self.__prefetch = prefetch
+        self.__max_workers = max_workers or prefetch
+        self.__executor = None
+        self.__pending = {}
+        self.resume_index = 0
         if eager:
             self.__get_batch(0)
 
@@ -50,11 +68,15 @@ class ResultSet(Sequence):
         offset = index % self.batch_size
         batch = self.__get_batch(batch_i)
 
-        search_type = self.context.search_type
-        ResultClass = _result_classes[search_type]
+        return batch[offset]
 
-        # !TODO: should probably wrap the json inside self.__batch_cache
-        return ResultClass(batch[offset], self.context)
+    def __iter__(self):
+        # Stopping early releases the prefetch threads
+        try:
+            for result in super(ResultSet, self).__iter__():
+                yield result
+        finally:
+            self.close()
 
     def __len__(self):
         if self.__len_cache is None:
@@ -65,6 +87,261 @@ class ResultSet(Sequence):
     def batch_size(self):
         return self.__batch_size
 
+    def iter_cursor(self, sort=CURSOR_SORT):
+        """
+        Iterate over all results using cursor based deep paging.
+
+        Solr's cost of retrieving a page with ``offset`` grows with the
+        offset, so the last batches of very large result sets are much
+        slower than the first.  Paging with a cursor keeps the latency of
+        each batch constant.  Results are streamed and not cached in the
+        ResultSet.
+
+        If the search service does not support cursors this falls back to
+        iterating with offset paging, still without caching, as
+        :meth:`iter_from()` does.
+
+        :param sort: A sort specification including the unique key ``id``
+            so that the result order is stable.
+
+        """
+        connection = self.context.connection
+        if connection._cursor_supported is False:
+            for result in self.iter_from():
+                yield result
+            return
+
+        query_dict = self._build_query()
+        query_dict['sort'] = sort
+        cursor = CURSOR_START
+        while True:
+            query_dict['cursorMark'] = cursor
+            try:
+                response = connection.send_search(query_dict,
+                                                  limit=self.batch_size,
+                                                  shards=self.context.shards)
+            except EsgfInvalidQueryException:
+                if cursor != CURSOR_START:
+                    raise
+                response = None
+
+            if response is None or 'nextCursorMark' not in response:
+                # The service rejected or ignored the cursor.
+                connection._cursor_supported = False
+                for result in self.iter_from():
+                    yield result
+                return
+            connection._cursor_supported = True
+
+            if self.__len_cache is None:
+                self.__len_cache = response['response']['numFound']
+
+            docs = response['response']['docs']
+            for doc in docs:
+                yield self._make_result(doc)
+
+            next_cursor = response['nextCursorMark']
+            if not docs or next_cursor == cursor:
+                return
+            cursor = next_cursor
+
+    def iter_stream(self):
+        """
+        Iterate over all results decoding each batch incrementally.
+
+        Documents are decoded and yielded as they are received rather than
+        after the whole response body has been read, and batches are not
+        cached in the ResultSet, so memory use is bounded even for large
+        batch sizes.
+
+        """
+        connection = self.context.connection
+        query_dict = self._build_query()
+
+        offset = 0
+        while True:
+            with connection.send_search(query_dict, limit=self.batch_size,
+                                        offset=offset,
+                                        shards=self.context.shards,
+                                        stream=True) as response:
+                if self.__len_cache is None:
+                    self.__len_cache = response.num_found
+
+                n_docs = 0
+                for doc in response:
+                    n_docs += 1
+                    yield self._make_result(doc)
+
+            offset += n_docs
+            if n_docs == 0 or offset >= response.num_found:
+                return
+
+    def iter_unique(self, strict=False, window=DEDUP_WINDOW):
+        """
+        Iterate over all results with the duplicates returned by
+        distributed searches removed.
+
+        Copies of a file with the same instance id and checksum, or of
+        another record with the same instance id, are merged into one
+        result carrying the URLs of every copy.  Results are
+        retrieved with :meth:`iter_cursor()`, which sorts them by id so
+        that copies arrive together.  See :mod:`pyesgf.search.dedup`.
+
+        :param strict: If True raise
+            :class:`pyesgf.exceptions.DuplicateHashError` for records with
+            the same tracking id but different checksums.
+        :param window: The number of distinct results held back so that
+            their duplicates can be merged into them.
+
+        """
+        # Only files have checksums and tracking ids
+        key = None if self.context.search_type == TYPE_FILE else \
+            dedup._instance_key
+        return dedup.iter_unique(self.iter_cursor(), window=window,
+                                 strict=strict, key=key)
+
+    def iter_from(self, index=0):
+        """
+        Iterate over the results starting at *index*, so that an iteration
+        interrupted by an error can be resumed::
+
+          >>> try:
+          ...     for result in results.iter_from():
+          ...         process(result)
+          ... except requests.RequestException:
+          ...     for result in results.iter_from(results.resume_index):
+          ...         process(result)
+
+        :py:attr:`resume_index` is the index of the result being yielded,
+        or of the next one while its batch is retrieved, so a result may be
+        yielded again when resuming.  Batches are not
+        cached, except for those retrieved beforehand, so memory use stays
+        bounded.  Batches are prefetched as for normal iteration.
+
+        """
+        batch_size = self.batch_size
+        while index < len(self):
+            self.resume_index = index
+            batch_i = index // batch_size
+            docs = self.__get_docs(batch_i)
+            for doc in docs[index % batch_size:]:
+                self.resume_index = index
+                yield self._make_result(doc)
+                index += 1
+            if not docs:
+                return
+        self.resume_index = index
+
+    def iter_doc_batches(self, fields=None):
+        """
+        Yield the json documents of each batch in turn.  Batches already
+        retrieved are taken from the cache, others are requested without
+        being cached so that the whole result set need not be held in
+        memory.
+
+        :param fields: Fields the documents must include.  If the result set
+            only requests the default fields of its result class and some of
+            these are not among them, every batch is requested again with
+            the extra fields, bypassing the cache and prefetching.
+
+        """
+        extra_fields = self._extra_fields(fields)
+        n_batches = -(-len(self) // self.batch_size)
+        try:
+            for batch_i in range(n_batches):
+                if extra_fields:
+                    response = self._fetch_batch(batch_i, extra_fields)
+                    yield response['response']['docs']
+                else:
+                    yield self.__get_docs(batch_i)
+        finally:
+            self.close()
+
+    def files_by_dataset(self, **kwargs):
+        """
+        Retrieve the files of every dataset in this dataset result set with
+        as few searches as possible.
+
+        See :func:`pyesgf.search.bulk.files_by_dataset` for the arguments.
+
+        :return: A dictionary ``{dataset_id: [FileResult, ...]}``
+
+        """
+        from .bulk import files_by_dataset
+
+        return files_by_dataset(self.context.connection, self, **kwargs)
+
+    def iter_record_batches(self, columns=None):
+        """
+        Yield a ``pyarrow.RecordBatch`` for each batch of results.
+
+        :param columns: The fields to export.  See
+            :mod:`pyesgf.search.export` for the defaults.
+
+        """
+        return export.iter_record_batches(self, columns)
+
+    def to_arrow(self, columns=None):
+        """
+        Return all results as a ``pyarrow.Table``.
+
+        :param columns: The fields to export.  See
+            :mod:`pyesgf.search.export` for the defaults.
+
+        """
+        return export.to_arrow(self, columns)
+
+    def to_pandas(self, columns=None):
+        """
+        Return all results as a ``pandas.DataFrame``.
+
+        :param columns: The fields to export.  See
+            :mod:`pyesgf.search.export` for the defaults.
+
+        """
+        return export.to_pandas(self, columns)
+
+    def to_numpy(self, columns=None):
+        """
+        Return all results as a structured ``numpy.ndarray``.
+
+        :param columns: The fields to export.  See
+            :mod:`pyesgf.search.export` for the defaults.
+
+        """
+        return export.to_numpy(self, columns)
+
+    def __get_docs(self, batch_i):
+        """
+        Return the json documents of batch number *batch_i* without adding
+        them to the cache.
+
+        """
+        if batch_i in self.__batch_cache:
+            return [result.json for result in self.__batch_cache[batch_i]]
+
+        future = self.__pending.pop(batch_i, None)
+        if future is not None:
+            response = future.result()
+        else:
+            response = self._fetch_batch(batch_i)
+        if self.__prefetch:
+            self.__schedule_prefetch(batch_i)
+
+        return response['response']['docs']
+
+    def close(self):
+        """
+        Cancel any outstanding prefetches and release the prefetch threads.
+
+        """
+        for future in self.__pending.values():
+            future.cancel()
+        self.__pending = {}
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
     def _build_result(self, result):
         """
         Construct a result object from the raw json.
@@ -77,25 +354,176 @@ class ResultSet(Sequence):
 
     def __get_batch(self, batch_i):
         if batch_i in self.__batch_cache:
-            return self.__batch_cache[batch_i]
+            batch = self.__batch_cache[batch_i]
+        else:
+            future = self.__pending.pop(batch_i, None)
+            if future is not None:
+                response = future.result()
+            else:
+                response = self._fetch_batch(batch_i)
 
-        offset = self.batch_size * batch_i
-        limit = self.batch_size
+            batch = self._add_batch(batch_i, response)
+
+        if self.__prefetch:
+            self.__schedule_prefetch(batch_i)
+
+        return batch
 
-        query_dict = self.context._build_query()
-        response = (self.context.connection
-                    .send_search(query_dict, limit=limit, offset=offset,
-                                 shards=self.context.shards))
+    def _add_batch(self, batch_i, response):
+        """
+        Store the documents of a search response as batch number *batch_i*.
+        This allows a response retrieved elsewhere, e.g. together with the
+        facet counts, to seed the cache.
 
+        """
         if self.__len_cache is None:
             self.__len_cache = response['response']['numFound']
 
-        # !TODO: strip out results
-        batch = response['response']['docs']
-
+        # Result objects are created once per document and cached
+        batch = [self._make_result(doc)
+                 for doc in response['response']['docs']]
         self.__batch_cache[batch_i] = batch
         return batch
 
+    def _build_query(self):
+        """
+        Build the query for retrieving results, requesting only the default
+        fields of the result class if the context doesn't specify fields.
+
+        """
+        return _project_fields(self.context._build_query(), self.context)
+
+    def _make_result(self, doc):
+        """
+        Construct a result object from a json document.
+
+        """
+        ResultClass = _result_classes[self.context.search_type]
+        if self.context.fields is None and ResultClass.default_fields:
+            doc = ProjectedDocument(doc, self.context,
+                                    ResultClass.default_fields)
+
+        return ResultClass(doc, self.context)
+
+    def _extra_fields(self, fields):
+        """
+        Return those of *fields* which are not requested because only the
+        default fields of the result class are.
+
+        """
+        default_fields = _result_classes[self.context.search_type] \
+            .default_fields
+        if fields is None or self.context.fields is not None or \
+                not default_fields:
+            return []
+
+        return sorted(set(fields) - set(default_fields))
+
+    def _fetch_batch(self, batch_i, extra_fields=None):
+        """
+        Send the query for batch number *batch_i* and return the json
+        response.  This may be called from prefetch threads so it must not
+        modify the state of the ResultSet.
+
+        :param extra_fields: Fields to request in addition to the default
+            fields of the result class.
+
+        """
+        offset = self.batch_size * batch_i
+        limit = self.batch_size
+
+        query_dict = self._build_query()
+        if extra_fields:
+            query_dict['fields'] = ','.join([query_dict['fields']] +
+                                            list(extra_fields))
+        return (self.context.connection
+                .send_search(query_dict, limit=limit, offset=offset,
+                             shards=self.context.shards))
+
+    def __schedule_prefetch(self, batch_i):
+        n_batches = -(-self.__len_cache // self.batch_size)
+        upcoming = [i for i in range(batch_i + 1,
+                                     min(batch_i + 1 + self.__prefetch,
+                                         n_batches))
+                    if i not in self.__batch_cache and i not in self.__pending]
+        if not upcoming:
+            if len(self.__batch_cache) == n_batches:
+                self.close()
+            return
+
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(
+                max_workers=self.__max_workers,
+                thread_name_prefix='esgf-prefetch')
+        for i in upcoming:
+            self.__pending[i] = self.__executor.submit(self._fetch_batch, i)
+
+
+class ProjectedDocument(dict):
+    """
+    The json document of a result retrieved with only the default fields
+    of its result class.
+
+    Looking up a field which was not requested with ``[]`` fetches all the
+    fields of the record from the search service once.  A requested field
+    missing from the document is absent from the record and doesn't cause
+    a fetch.  ``get()``, ``in`` and iteration, e.g. with ``keys()`` or
+    ``items()``, only see the fields retrieved so far so that they never
+    send a query; call :meth:`fetch` first to see all the fields.
+
+    """
+    __slots__ = ('_context', '_fields', '_complete')
+
+    def __init__(self, doc, context, fields):
+        super(ProjectedDocument, self).__init__(doc)
+        self._context = context
+        self._fields = frozenset(fields)
+        self._complete = False
+
+    def __missing__(self, key):
+        if not self._fetch_needed(key):
+            raise KeyError(key)
+
+        self.fetch()
+        return dict.__getitem__(self, key)
+
+    def _fetch_needed(self, key):
+        return (not self._complete and key not in self._fields and
+                dict.__contains__(self, 'id'))
+
+    def fetch(self):
+        """
+        Retrieve all stored fields of this record.
+
+        """
+        context = self._context
+        response = context.connection.send_search(self._fetch_query(),
+                                                  limit=1,
+                                                  shards=context.shards)
+        self._set_fetched(response)
+
+    def _fetch_query(self):
+        return {'type': self._context.search_type, 'id': self['id'],
+                'fields': '*'}
+
+    def _set_fetched(self, response):
+        for doc in response['response']['docs']:
+            self.update(doc)
+        self._complete = True
+
+
+def _project_fields(query_dict, context):
+    """
+    Add the default fields of the context's result class to *query_dict* if
+    the context doesn't specify fields.
+
+    """
+    default_fields = _result_classes[context.search_type].default_fields
+    if context.fields is None and default_fields:
+        query_dict['fields'] = ','.join(default_fields)
+
+    return query_dict
+
 
 class BaseResult(object):
     """
@@ -120,18 +548,51 @@ class BaseResult(object):
         Calls to ``*_context()`` will optimise queries to only address this node.
 
     """
+    __slots__ = ('json', 'context', '_urls')
+
+    # The fields requested when the context doesn't specify any.  Other
+    # fields are fetched when first looked up with ``[]``.  None requests
+    # all fields.
+    default_fields = None
+
     def __init__(self, json, context):
         self.json = json
         self.context = context
+        self._urls = None
+
+    @classmethod
+    def add_default_fields(cls, *fields):
+        """
+        Add fields to those requested by default for this result class.
+
+        """
+        if cls.default_fields is not None:
+            cls.default_fields = cls.default_fields + tuple(
+                f for f in fields if f not in cls.default_fields)
+
+    def _add_urls(self, encoded_urls):
+        """
+        Add encoded ``url|mime_type|service`` strings, e.g. of a replica,
+        to this result.
+
+        """
+        urls = self.json.setdefault('url', [])
+        for encoded in encoded_urls:
+            if encoded not in urls:
+                urls.append(encoded)
+        self._urls = None
 
     @property
     def urls(self):
-        url_dict = defaultdict(list)
-        for encoded in self.json['url']:
-            url, mime_type, service = encoded.split('|')
-            url_dict[service].append((url, mime_type))
+        # Parsed once on first access
+        if self._urls is None:
+            url_dict = defaultdict(list)
+            for encoded in self.json['url']:
+                url, mime_type, service = encoded.split('|')
+                url_dict[service].append((url, mime_type))
+            self._urls = url_dict
 
-        return url_dict
+        return self._urls
 
     @property
     def opendap_url(self):
@@ -198,6 +659,12 @@ class DatasetResult(BaseResult):
                           system.
 
     """
+    __slots__ = ()
+
+    default_fields = ('id', 'master_id', 'instance_id', 'drs_id', 'version',
+                      'title', 'number_of_files', 'size', 'replica', 'latest',
+                      'data_node', 'index_node', 'url', 'project',
+                      '_timestamp')
 
     @property
     def dataset_id(self):
@@ -218,22 +685,10 @@ class DatasetResult(BaseResult):
         """
         from .context import FileSearchContext
 
-        if self.context.connection.distrib:
-            # If the index node is in the available shards for this connection
-            # then restrict shards to that node.  Otherwise do nothing to
-            # handle the case when the shard is replicated
-            available_shards = list(self.context.connection.get_shard_list().keys())
-            if self.index_node in available_shards:
-                shards = [self.index_node]
-            else:
-                shards = None
-        else:
-            shards = None
-
         files_context = FileSearchContext(
             connection=self.context.connection,
             constraints={'dataset_id': self.dataset_id},
-            shards=shards,
+            shards=self._index_shards(),
             )
         return files_context
 
@@ -244,25 +699,28 @@ class DatasetResult(BaseResult):
         """
         from .context import AggregationSearchContext
 
-        if self.context.connection.distrib:
-            # If the index node is in the available shards for this connection
-            # then restrict shards to that node.  Otherwise do nothing to
-            # handle the case  when the shard is replicated
-            available_shards = list(self.context.connection.get_shard_list().keys())
-            if self.index_node in available_shards:
-                shards = [self.index_node]
-            else:
-                shards = None
-        else:
-            shards = None
-
         agg_context = AggregationSearchContext(
             connection=self.context.connection,
             constraints={'dataset_id': self.dataset_id},
-            shards=shards,
+            shards=self._index_shards(),
             )
         return agg_context
 
+    def _index_shards(self):
+        """
+        Return the shards to use when searching for records within this
+        dataset.
+
+        """
+        if self.context.connection.distrib:
+            # If the index node is in the available shards for this connection
+            # then restrict shards to that node.  Otherwise do nothing to
+            # handle the case when the shard is replicated
+            available_shards = list(self.context.connection.get_shard_list().keys())
+            if self.index_node in available_shards:
+                return [self.index_node]
+        return None
+
 
 class FileResult(BaseResult):
     """
@@ -276,6 +734,13 @@ class FileResult(BaseResult):
     :property size: The file size in bytes
 
     """
+    __slots__ = ()
+
+    default_fields = ('id', 'master_id', 'instance_id', 'dataset_id', 'title',
+                      'version', 'size', 'checksum', 'checksum_type',
+                      'tracking_id', 'replica', 'latest', 'data_node',
+                      'index_node', 'url', '_timestamp')
+
     @property
     def file_id(self):
         return self.json['id']
@@ -317,6 +782,11 @@ class AggregationResult(BaseResult):
 
     :property aggregation_id: The aggregation id
     """
+    __slots__ = ()
+
+    default_fields = ('id', 'dataset_id', 'title', 'data_node', 'index_node',
+                      'url')
+
     @property
     def aggregation_id(self):
         return self.json['id']
@@ -0,0 +1,131 @@
+"""
+
+Module :mod:`pyesgf.search.retry`
+=================================
+
+Retry policy for the HTTP requests sent by
+:class:`pyesgf.search.connection.SearchConnection`.  Search queries are
+idempotent GET requests, so connection errors, including connections reset
+while the response is read, timeouts and the HTTP statuses in
+``retry_statuses`` are retried after an exponentially growing
+delay with random jitter.  A ``Retry-After`` header sent by the server is
+respected, and an optional deadline bounds the total time spent on one
+request including its retries::
+
+  >>> conn = SearchConnection(url, retry=RetryPolicy(max_retries=5,
+  ...                                                 deadline=600))
+
+"""
+
+import email.utils
+import random
+import time
+
+# HTTP statuses indicating a transient failure
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryPolicy(object):
+    """
+    :ivar max_retries: The maximum number of retries of a request.
+    :ivar backoff: The delay (in seconds) before the first retry.  It
+                   doubles with each further retry.
+    :ivar max_backoff: The maximum delay (in seconds) between attempts.
+    :ivar jitter: boolean, if True each delay is drawn at random between
+                  half and all of the exponential delay so that many
+                  clients don't retry in step.
+    :ivar deadline: Time (in seconds) after which a request is not retried
+                    again, or None.  The timeout of each attempt is reduced
+                    so that it doesn't run past the deadline.
+    :ivar retry_statuses: The HTTP statuses that are retried.
+
+    """
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=60,
+                 jitter=True, deadline=None, retry_statuses=RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_statuses = retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """
+        :return: The time (in seconds) to wait after failed attempt number
+            *attempt*, counting from 0.
+
+        """
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        if self.jitter:
+            delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def next_delay(self, attempt, start, retry_after=None):
+        """
+        :param attempt: The number of the attempt which failed.
+        :param start: The time (from ``time.monotonic()``) of the first
+            attempt.
+        :return: The time to wait before retrying, or None if the request
+            must not be retried.
+
+        """
+        if attempt >= self.max_retries:
+            return None
+
+        delay = self.delay(attempt, retry_after)
+        if (self.deadline is not None and
+                time.monotonic() + delay - start >= self.deadline):
+            return None
+        return delay
+
+    def timeout(self, timeout, start):
+        """
+        :return: The timeout for an attempt made now, given the timeout of
+            the connection.
+
+        """
+        if self.deadline is None:
+            return timeout
+
+        remaining = max(self.deadline - (time.monotonic() - start), 0.001)
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+
+def get_retry_policy(retry):
+    """
+    Return a :class:`RetryPolicy` for the ``retry`` argument of
+    :class:`SearchConnection`: None or False for no retries, a number of
+    retries, or a :class:`RetryPolicy`.
+
+    """
+    if retry is None or retry is False:
+        return None
+    if isinstance(retry, RetryPolicy):
+        return retry
+    return RetryPolicy(max_retries=int(retry))
+
+
+def parse_retry_after(value):
+    """
+    :return: The delay (in seconds) requested by a ``Retry-After`` header,
+        or None.
+
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time is None:
+        return None
+    return max(retry_time.timestamp() - time.time(), 0.0)
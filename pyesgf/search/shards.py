@@ -0,0 +1,268 @@
+"""
+
+Module :mod:`pyesgf.search.shards`
+==================================
+
+Health monitoring of the shards a distributed search is sent to.  An index
+node forwards distributed queries to every shard in parallel and waits for
+all of them, so a single slow or unreachable shard delays every query until
+the timeout.  :class:`ShardMonitor` probes each shard with a cheap
+``limit=0`` query, keeps a rolling average of its latency and counts its
+errors.  Once a monitor is attached to a connection distributed queries are
+restricted to the healthy shards::
+
+  >>> conn = SearchConnection(url, distrib=True)
+  >>> monitor = conn.monitor_shards(max_latency=5, probe_interval=600)
+  >>> monitor.probe()
+  >>> monitor.stats['esgf-data.dkrz.de']
+  <ShardStats esgf-data.dkrz.de: latency 0.412s, 0/1 errors>
+
+Because shards are queried in parallel, the order in which they are listed
+doesn't matter; slow shards are deprioritised by excluding them for a
+while once their latency exceeds *max_latency*.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+
+from .consts import TYPE_DATASET
+
+log = logging.getLogger(__name__)
+
+# Time (in seconds) allowed for a probe query
+PROBE_TIMEOUT = 10
+
+# Weight of the latest latency in the rolling average
+LATENCY_SMOOTHING = 0.3
+
+
+class ShardStats(object):
+    """
+    Probe statistics of one shard.
+
+    :ivar shard: The shard host name.
+    :ivar latency: The rolling average latency (in seconds) of successful
+                   probes, or None.
+    :ivar n_probes: The number of probes sent.
+    :ivar n_errors: The number of probes which failed.
+    :ivar consecutive_errors: The number of failures since the last success.
+    :ivar last_probe: The time (from ``time.monotonic()``) of the last probe.
+    :ivar last_error: The exception raised by the last failed probe, or None.
+
+    """
+    def __init__(self, shard):
+        self.shard = shard
+        self.latency = None
+        self.n_probes = 0
+        self.n_errors = 0
+        self.consecutive_errors = 0
+        self.last_probe = None
+        self.last_error = None
+
+    def __repr__(self):
+        latency = 'unknown' if self.latency is None else '%.3fs' % self.latency
+        return '<ShardStats %s: latency %s, %d/%d errors>' % (
+            self.shard, latency, self.n_errors, self.n_probes)
+
+
+class ShardMonitor(object):
+    """
+    Tracks the health of the shards of a :class:`SearchConnection`.
+
+    A shard is unhealthy after *max_errors* consecutive failed probes, or
+    when its average latency exceeds *max_latency*.  An unhealthy shard is
+    used again *retry_interval* seconds after its last probe, or as soon as
+    a probe succeeds or brings its latency down, so that one slow or failed
+    probe doesn't exclude it for the life of the connection.  If every
+    shard is unhealthy queries are sent to all of them rather than failing.
+
+    :ivar connection: The monitored connection.
+    :ivar probe_timeout: Time (in seconds) after which a probe fails.
+    :ivar max_errors: Consecutive errors after which a shard is unhealthy.
+    :ivar max_latency: Latency (in seconds) above which a shard is
+                       unhealthy, or None.
+    :ivar retry_interval: Time (in seconds) before an unhealthy shard is
+                          used again.
+    :ivar probe_interval: If not None, all shards are probed again before a
+                          query once the last probe is older than this.
+    :ivar max_workers: The number of shards probed concurrently.
+
+    """
+    def __init__(self, connection, probe_timeout=PROBE_TIMEOUT, max_errors=1,
+                 max_latency=None, retry_interval=300, probe_interval=None,
+                 max_workers=8, smoothing=LATENCY_SMOOTHING):
+        self.connection = connection
+        self.probe_timeout = probe_timeout
+        self.max_errors = max_errors
+        self.max_latency = max_latency
+        self.retry_interval = retry_interval
+        self.probe_interval = probe_interval
+        self.max_workers = max_workers
+        self.smoothing = smoothing
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._last_probe = None
+
+    def __getstate__(self):
+        # Copies start without statistics
+        state = self.__dict__.copy()
+        del state['_lock']
+        state.update(_stats={}, _last_probe=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        """
+        A dictionary ``{shard: ShardStats}`` of the shards probed so far.
+
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def probe(self, shards=None):
+        """
+        Probe shards concurrently.
+
+        :param shards: The shards to probe.  Defaults to all the shards of
+            the connection.
+        :return: The :py:attr:`stats` dictionary.
+
+        """
+        if shards is None:
+            shards = list(self.connection.get_shard_list())
+
+        self._last_probe = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self.probe_shard, shards))
+
+        return self.stats
+
+    def probe_shard(self, shard):
+        """
+        Send a ``limit=0`` query restricted to *shard* and record its
+        latency or error.
+
+        :return: The latency in seconds, or None if the probe failed.
+
+        """
+        connection = self.connection
+        full_query = connection._build_query({'type': TYPE_DATASET}, limit=0,
+                                             shards=[shard])
+        start = time.monotonic()
+        connection._ensure_open()
+        try:
+            response = connection._send_query('search', full_query,
+                                              timeout=self.probe_timeout,
+                                              retry=False)
+            response.close()
+        except Exception as err:
+            log.info('Probe of shard %s failed: %s' % (shard, err))
+            self.record(shard, error=err)
+            return None
+        finally:
+            connection._release()
+
+        latency = time.monotonic() - start
+        self.record(shard, latency=latency)
+        return latency
+
+    def record(self, shard, latency=None, error=None):
+        """
+        Record the outcome of a query sent to *shard*.
+
+        """
+        with self._lock:
+            stats = self._stats.get(shard)
+            if stats is None:
+                stats = self._stats[shard] = ShardStats(shard)
+            stats.n_probes += 1
+            stats.last_probe = time.monotonic()
+            if error is not None:
+                stats.n_errors += 1
+                stats.consecutive_errors += 1
+                stats.last_error = error
+            else:
+                stats.consecutive_errors = 0
+                if stats.latency is None:
+                    stats.latency = latency
+                else:
+                    stats.latency += self.smoothing * (latency - stats.latency)
+
+    def is_healthy(self, shard):
+        """
+        :return: False if *shard* should currently be left out of queries.
+
+        """
+        with self._lock:
+            return self._is_healthy(self._stats.get(shard), time.monotonic())
+
+    def healthy_shards(self, shards=None):
+        """
+        :return: The healthy shards among *shards*, or all probed shards,
+            fastest first.
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            if shards is None:
+                shards = list(self._stats)
+            healthy = [s for s in shards
+                       if self._is_healthy(self._stats.get(s), now)]
+
+            def latency(shard):
+                stats = self._stats.get(shard)
+                if stats is None or stats.latency is None:
+                    return float('inf')
+                return stats.latency
+
+            return sorted(healthy, key=latency)
+
+    def route(self, shards):
+        """
+        Choose the shards for a distributed query.
+
+        :param shards: The shards requested, or None for all shards.
+        :return: The shards to query, or None for all shards.
+
+        """
+        if (self.probe_interval is not None and
+                (self._last_probe is None or
+                 time.monotonic() - self._last_probe > self.probe_interval)):
+            self.probe()
+
+        if not self._stats:
+            return shards
+
+        if shards is None:
+            candidates = list(self.connection.get_shard_list())
+        else:
+            candidates = list(shards)
+
+        healthy = self.healthy_shards(candidates)
+        if not healthy:
+            log.warning('No healthy shards, querying all of them')
+            return shards
+        if shards is None and len(healthy) == len(candidates):
+            return None
+
+        return healthy
+
+    # -------------------------------------------------------------------------
+
+    def _is_healthy(self, stats, now):
+        if stats is None or now - stats.last_probe >= self.retry_interval:
+            return True
+        if stats.consecutive_errors >= self.max_errors:
+            return False
+        if (self.max_latency is not None and stats.latency is not None and
+                stats.latency > self.max_latency):
+            return False
+        return True
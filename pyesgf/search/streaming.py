@@ -0,0 +1,227 @@
+"""
+
+Module :mod:`pyesgf.search.streaming`
+=====================================
+
+Incremental decoding of search responses.  :class:`StreamingSearchResponse`
+parses the JSON body of a Solr response as it is received so that documents
+in ``response.docs`` can be processed one at a time without holding the
+whole body or the full decoded object tree in memory.
+
+"""
+
+import codecs
+import json
+
+from .exceptions import EsgfSearchException
+
+# Size of the chunks read from the HTTP response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]}'
+
+
+class StreamingSearchResponse(object):
+    """
+    A search response whose documents are decoded lazily.
+
+    The response header and the ``numFound`` and ``start`` values precede
+    the documents in Solr's output so they are available as soon as the
+    instance is created.  Documents are then yielded by iterating over the
+    instance.  Anything following the documents, such as ``facet_counts``,
+    becomes available once the documents have been consumed; accessing it
+    earlier discards the remaining documents.
+
+    :ivar response_header: The ``responseHeader`` dictionary.
+    :ivar response: The ``response`` dictionary without ``docs``.
+    :property num_found: The total number of hits for the query.
+    :property facet_counts: The ``facet_counts`` dictionary, or None.
+
+    """
+    def __init__(self, chunks, on_close=None):
+        """
+        :param chunks: An iterable of bytes making up the response body.
+        :param on_close: A callable invoked once the body has been read or
+            :meth:`close()` is called.
+
+        """
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._on_close = on_close
+        self._docs_pending = False
+        self._consumed = False
+
+        self.response_header = None
+        self.response = {}
+        self._top = {}
+
+        try:
+            self._parse_head()
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def num_found(self):
+        return self.response['numFound']
+
+    @property
+    def facet_counts(self):
+        self._finish()
+        return self._top.get('facet_counts')
+
+    def __iter__(self):
+        if self._consumed:
+            raise EsgfSearchException('Documents have already been consumed')
+        self._consumed = True
+
+        try:
+            while self._docs_pending:
+                c = self._peek()
+                if c == ']':
+                    self._pos += 1
+                    self._docs_pending = False
+                elif c == ',':
+                    self._pos += 1
+                else:
+                    yield self._value()
+            self._parse_tail()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    # -------------------------------------------------------------------------
+
+    def _finish(self):
+        if not self._consumed:
+            for doc in self:
+                pass
+
+    def _parse_head(self):
+        self._expect('{')
+        for key in self._keys('}'):
+            if key == 'response':
+                self._expect('{')
+                for rkey in self._keys('}'):
+                    if rkey == 'docs':
+                        self._expect('[')
+                        self._docs_pending = True
+                        return
+                    self.response[rkey] = self._value()
+                # No docs in the response
+                self._parse_top()
+                return
+            elif key == 'responseHeader':
+                self.response_header = self._value()
+            else:
+                self._top[key] = self._value()
+
+    def _parse_tail(self):
+        # Remainder of the response object after docs then the top level
+        for rkey in self._keys('}', first=False):
+            self.response[rkey] = self._value()
+        self._parse_top()
+
+    def _parse_top(self):
+        for key in self._keys('}', first=False):
+            self._top[key] = self._value()
+
+    def _keys(self, closing, first=True):
+        """
+        Yield the keys of an object, leaving the position at the start of
+        each value, until *closing* is consumed.
+
+        """
+        while True:
+            c = self._peek()
+            if c == closing:
+                self._pos += 1
+                return
+            if c == ',':
+                self._pos += 1
+            elif not first:
+                self._error('Expected "," or "%s"' % closing)
+            first = False
+            key = self._value()
+            self._expect(':')
+            yield key
+
+    def _expect(self, char):
+        if self._peek() != char:
+            self._error('Expected "%s"' % char)
+        self._pos += 1
+
+    def _peek(self):
+        while True:
+            while (self._pos < len(self._buf) and
+                   self._buf[self._pos] in _WHITESPACE):
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read():
+                return ''
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if self._read():
+                    continue
+                raise
+
+            # A number is only complete once it is followed by a delimiter
+            if (isinstance(value, (int, float)) and not self._eof and
+                    (end >= len(self._buf) or
+                     self._buf[end] not in _DELIMITERS)):
+                self._read()
+                continue
+
+            self._pos = end
+            return value
+
+    def _read(self):
+        """
+        Append the next chunk of the body to the buffer.
+
+        :return: False if the body has been read completely.
+
+        """
+        if self._eof:
+            return False
+
+        # Drop the consumed part of the buffer
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buf += text
+                return True
+
+        self._buf += self._decoder.decode(b'', final=True)
+        self._eof = True
+        return True
+
+    def _error(self, message):
+        raise EsgfSearchException('Cannot decode search response: %s at '
+                                  '%r' % (message,
+                                          self._buf[self._pos:self._pos + 40]))
@@ -0,0 +1,202 @@
+"""
+
+Module :mod:`pyesgf.search.throttle`
+====================================
+
+Client-side limits on the requests sent to each index node.  A
+:class:`RequestThrottle` holds, for each host, a token bucket limiting the
+rate of requests and a semaphore limiting the number of requests in
+flight.  It is shared by all the contexts, result sets and threads using a
+connection, and may be shared by several connections so that they respect
+the same limits::
+
+  >>> conn = SearchConnection(url, rate_limit=5, max_in_flight=4)
+  >>> throttle = RequestThrottle(rate=5, burst=10, max_in_flight=4)
+  >>> fs = FederatedSearch(urls, throttle=throttle)
+
+A ``429 Too Many Requests`` response carrying a ``Retry-After`` header
+pauses all requests to its host for the time asked.
+
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket.
+
+    :ivar rate: The number of tokens added per second.
+    :ivar burst: The maximum number of tokens held, i.e. the number of
+                 requests which may be sent at once after a quiet period.
+
+    """
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._not_before = 0.0
+
+    def reserve(self):
+        """
+        Take a token, going into debt if the bucket is empty.
+
+        :return: The time (in seconds) to wait before using the token.
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, self._not_before - now)
+            return max(wait, 0.0)
+
+    def acquire(self):
+        """
+        Take a token, sleeping until it may be used.
+
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Don't hand out usable tokens for *seconds*.
+
+        """
+        with self._lock:
+            self._not_before = max(self._not_before,
+                                   time.monotonic() + seconds)
+
+
+class HostThrottle(object):
+    """
+    The limits applied to one host.
+
+    :ivar host: The host name.
+    :ivar bucket: The :class:`TokenBucket` limiting the request rate, or
+                  None.
+    :ivar max_in_flight: The maximum number of concurrent requests, or None.
+
+    """
+    def __init__(self, host, rate=None, burst=None, max_in_flight=None):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_in_flight = max_in_flight
+        if max_in_flight:
+            self._slots = threading.BoundedSemaphore(max_in_flight)
+        else:
+            self._slots = None
+
+    @contextmanager
+    def request(self):
+        """
+        A context manager held while a request is sent.  It waits for a
+        slot, then for a token.
+
+        """
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            yield self
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def reserve(self):
+        """
+        :return: The time (in seconds) to wait before sending a request.
+            Used by callers which can't block, e.g. coroutines.
+
+        """
+        if self.bucket is None:
+            return 0.0
+        return self.bucket.reserve()
+
+    def pause(self, seconds):
+        if self.bucket is not None:
+            self.bucket.pause(seconds)
+
+
+class RequestThrottle(object):
+    """
+    Rate and concurrency limits applied separately to each host.
+
+    :ivar rate: The maximum number of requests per second to a host, or
+                None for no limit.
+    :ivar burst: The number of requests which may be sent to a host at once
+                 after a quiet period.  Defaults to *rate*.
+    :ivar max_in_flight: The maximum number of concurrent requests to a
+                         host, or None for no limit.
+
+    """
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def __getstate__(self):
+        # Copies, e.g. in other processes, keep their own limits
+        return {'rate': self.rate, 'burst': self.burst,
+                'max_in_flight': self.max_in_flight}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def host(self, url):
+        """
+        :return: The :class:`HostThrottle` of the host of *url*.
+
+        """
+        host = urlparse(url).netloc or url
+        with self._lock:
+            throttle = self._hosts.get(host)
+            if throttle is None:
+                throttle = self._hosts[host] = HostThrottle(
+                    host, self.rate, self.burst, self.max_in_flight)
+            return throttle
+
+    def request(self, url):
+        """
+        A context manager held while a request is sent to *url*::
+
+          >>> with throttle.request(url):
+          ...     response = session.get(url)
+
+        """
+        return self.host(url).request()
+
+    def pause(self, url, seconds):
+        """
+        Delay all requests to the host of *url* by *seconds*.
+
+        """
+        self.host(url).pause(seconds)
+
+
+def get_throttle(throttle=None, rate_limit=None, max_in_flight=None):
+    """
+    Return the :class:`RequestThrottle` of a :class:`SearchConnection`:
+    *throttle* if given, otherwise one built from *rate_limit* and
+    *max_in_flight*, or None if there are no limits.
+
+    """
+    if throttle is not None:
+        return throttle
+    if rate_limit or max_in_flight:
+        return RequestThrottle(rate=rate_limit, max_in_flight=max_in_flight)
+    return None
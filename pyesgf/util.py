@@ -4,6 +4,7 @@ Utility functions using the pyesgf package.
 """
 
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import quote_plus
 
 
@@ -53,6 +54,91 @@ def get_manifest(drs_id, version, connection):
     return manifest
 
 
+def get_manifests(datasets, connection, max_workers=4, batch_size=500):
+    """
+    Retrieve the filenames, sizes and checksums of many datasets.
+
+    This is the bulk equivalent of :func:`get_manifest`.  Dataset lookups
+    are batched into searches on many ``drs_id`` values and the file records
+    are retrieved concurrently with only the fields needed for the manifest.
+
+    ValueError is raised if a dataset is not found or if more than one
+    dataset matches a drs_id and version.
+
+    :param datasets: an iterable of ``(drs_id, version)`` tuples.  version
+        may be a string or int.
+    :param max_workers: the number of searches run concurrently.
+    :param batch_size: the number of records to get per HTTP request.
+    :return: a generator yielding ``((drs_id, version), manifest)`` as each
+        manifest is completed, where version is a string.
+
+    """
+    from .search.bulk import _chunk_ids, files_by_dataset
+    from .search.consts import MAX_BULK_QUERY_LENGTH
+
+    wanted = {}
+    for drs_id, version in datasets:
+        wanted.setdefault(drs_id, set()).add(str(version))
+
+    def get_chunk(drs_ids):
+        context = connection.new_context(
+            drs_id=drs_ids, fields='id,drs_id,version,index_node')
+        found = {}
+        for result in context.search(batch_size=batch_size,
+                                     ignore_facet_check=True):
+            drs_id = _first(result.json['drs_id'])
+            key = (drs_id, str(_first(result.json['version'])))
+            if key[1] not in wanted.get(drs_id, ()):
+                continue
+            if key in found:
+                raise ValueError("Search for dataset %s.v%s returns "
+                                 "multiple hits" % key)
+            found[key] = result
+
+        for drs_id in drs_ids:
+            for version in wanted[drs_id]:
+                if (drs_id, version) not in found:
+                    raise ValueError("Search for dataset %s.v%s returns no "
+                                     "hits" % (drs_id, version))
+
+        files = files_by_dataset(
+            connection, list(found.values()), batch_size=batch_size,
+            max_workers=1, fields='title,size,checksum,checksum_type')
+
+        manifests = []
+        for key, result in found.items():
+            manifest = {}
+            for file in files[result.dataset_id]:
+                manifest[file.filename] = {
+                    'checksum_type': file.checksum_type,
+                    'checksum': file.checksum,
+                    'size': file.size,
+                }
+            manifests.append((key, manifest))
+        return manifests
+
+    chunks = _chunk_ids(list(wanted), MAX_BULK_QUERY_LENGTH, 'drs_id')
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = []
+    try:
+        futures = [executor.submit(get_chunk, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            for item in future.result():
+                yield item
+    finally:
+        # Stopping early doesn't wait for the remaining chunks
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _first(value):
+    # Solr multi-valued fields are returned as lists
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
 def urlencode(query):
     """
     Encode a sequence of two-element tuples or dictionary into a URL query
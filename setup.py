@@ -49,5 +49,6 @@ setup(name='esgf-pyclient',
       install_requires=reqs,
       extras_require={
           "dev": dev_reqs,              # pip install ".[dev]"
+          "aio": ["aiohttp"],           # pip install ".[aio]"
       },
       entry_points={},)
@@ -0,0 +1,156 @@
+"""
+Shared fixtures for the tests run against a local HTTP server
+
+"""
+
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+# Query parameters which are not constraints on the documents
+_SEARCH_PARAMS = {'format', 'limit', 'offset', 'distrib', 'type', 'facets',
+                  'fields', 'shards', 'sort', 'cursorMark', 'latest',
+                  'replica', 'query', 'start', 'end', 'from', 'to'}
+
+
+def _serve(request, handler):
+    # Keep request logging out of the test output
+    quiet_handler = type(handler.__name__, (handler,),
+                         {'log_message': lambda self, *args: None})
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), quiet_handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    request.instance.server = server
+    request.instance.base_url = 'http://127.0.0.1:%d' % server.server_port
+    return server
+
+
+@pytest.fixture
+def local_server(request):
+    """
+    Serve the ``handler`` class attribute of the test class, a
+    ``BaseHTTPRequestHandler`` subclass, on a free local port for the
+    duration of a test.  The server and its URL are set as the ``server``
+    and ``base_url`` attributes of the test case::
+
+      @pytest.mark.usefixtures('local_server')
+      class TestSomething(TestCase):
+          handler = _Handler
+
+    """
+    server = _serve(request, request.cls.handler)
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+class _SearchHandler(BaseHTTPRequestHandler):
+    """
+    A minimal ESGF search service holding the documents in
+    ``server.docs``.  It supports constraints on document fields, paging,
+    ``fields``, ``facets`` and, if ``server.cursor`` is True, cursors.
+
+    """
+    def do_GET(self):
+        # Parameters given more than once, e.g. OR'ed constraints, are lists
+        query = dict((key, values[0] if len(values) == 1 else values)
+                     for key, values
+                     in parse_qs(urlparse(self.path).query).items())
+        self.server.queries.append(query)
+
+        if 'cursorMark' in query and not self.server.cursor:
+            self._send(400, b'Invalid HTTP query parameter=cursorMark')
+            return
+
+        docs = [doc for doc in self.server.docs
+                if all(_matches(doc, key, value)
+                       for key, value in query.items()
+                       if key not in _SEARCH_PARAMS)]
+
+        if 'cursorMark' in query:
+            docs.sort(key=lambda doc: doc['id'])
+            offset = 0 if query['cursorMark'] == '*' else \
+                int(query['cursorMark'])
+        else:
+            offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 10))
+        page = docs[offset:offset + limit]
+
+        fields = query.get('fields', '*')
+        if fields != '*':
+            fields = fields.split(',')
+            page = [dict((k, v) for k, v in doc.items() if k in fields)
+                    for doc in page]
+
+        response = {
+            'responseHeader': {'params': query},
+            'response': {'numFound': len(docs), 'start': offset,
+                         'docs': page},
+        }
+        if 'cursorMark' in query:
+            response['nextCursorMark'] = str(offset + len(page))
+        if query.get('facets'):
+            response['facet_counts'] = {
+                'facet_fields': _facet_counts(docs, query['facets'])}
+
+        self._send(200, json.dumps(response).encode())
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _matches(doc, key, value):
+    if isinstance(value, list):
+        return any(_matches(doc, key, v) for v in value)
+
+    doc_value = doc.get(key)
+    if isinstance(doc_value, list):
+        return value in [str(v) for v in doc_value]
+    return str(doc_value) == value
+
+
+def _facet_counts(docs, facets):
+    if facets == '*':
+        facets = sorted(set(key for doc in docs for key in doc))
+    else:
+        facets = facets.split(',')
+
+    facet_fields = {}
+    for facet in facets:
+        counts = {}
+        for doc in docs:
+            values = doc.get(facet, [])
+            for value in values if isinstance(values, list) else [values]:
+                counts[str(value)] = counts.get(str(value), 0) + 1
+        facet_fields[facet] = [item for value_count in sorted(counts.items())
+                               for item in value_count]
+
+    return facet_fields
+
+
+@pytest.fixture
+def search_service(request):
+    """
+    Serve the documents of the ``docs`` class attribute of the test class
+    with a minimal search service.  The URL of the service is set as the
+    ``url`` attribute of the test case and the query dictionaries received
+    are appended to ``server.queries``.  Cursors are accepted if the test
+    class's ``cursor`` attribute is True.
+
+    """
+    server = _serve(request, _SearchHandler)
+    server.docs = request.cls.docs
+    server.cursor = getattr(request.cls, 'cursor', False)
+    server.queries = []
+    request.instance.url = request.instance.base_url + '/esg-search'
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,109 @@
+"""
+Test the asyncio search interface
+
+"""
+
+import asyncio
+
+import pytest
+
+from unittest import TestCase
+
+pytest.importorskip('aiohttp')
+
+from pyesgf.search.aio import AsyncSearchConnection  # noqa: E402
+from pyesgf.search.connection import SearchConnection  # noqa: E402
+from pyesgf.search.exceptions import EsgfSearchException  # noqa: E402
+
+
+class TestAsyncSearch(TestCase):
+
+    _test_facets = 'project,model,index_node,data_node'
+
+    def setUp(self):
+        self.test_service = 'https://esgf.ceda.ac.uk/esg-search'
+
+    def test_hit_count(self):
+        async def hit_count():
+            async with AsyncSearchConnection(self.test_service,
+                                             distrib=False) as conn:
+                ctx = conn.new_context(project='CMIP5',
+                                       facets=self._test_facets)
+                return await ctx.hit_count
+
+        conn = SearchConnection(self.test_service, distrib=False)
+        ctx = conn.new_context(project='CMIP5', facets=self._test_facets)
+
+        assert asyncio.run(hit_count()) == ctx.hit_count
+
+    def test_async_iteration(self):
+        async def dataset_ids():
+            async with AsyncSearchConnection(self.test_service,
+                                             distrib=False) as conn:
+                ctx = conn.new_context(project='CMIP5', model='HadGEM2-ES',
+                                       experiment='historical',
+                                       facets=self._test_facets)
+                results = await ctx.search(batch_size=10)
+                return len(results), [r.dataset_id async for r in results]
+
+        n_results, ids = asyncio.run(dataset_ids())
+        assert len(ids) == n_results
+        assert len(set(ids)) == n_results
+
+
+@pytest.mark.usefixtures('search_service')
+class TestAsyncSearchOffline(TestCase):
+    docs = [{'id': 'ds%02d|node' % i, 'project': ['CMIP6'],
+             'variable': ['tas'], 'url': []}
+            for i in range(15)]
+
+    def _run(self, search, **kwargs):
+        async def run():
+            async with AsyncSearchConnection(self.url, **kwargs) as conn:
+                return await search(conn)
+        return asyncio.run(run())
+
+    def test_same_queries(self):
+        async def search(conn):
+            ctx = conn.new_context(project='CMIP6', facets='project')
+            results = await ctx.search(batch_size=10)
+            return await ctx.hit_count, [r async for r in results]
+
+        hit_count, results = self._run(search, distrib=False)
+        assert hit_count == 15
+        assert [r.dataset_id for r in results] == [d['id'] for d in self.docs]
+        async_queries = list(self.server.queries)
+
+        conn = SearchConnection(self.url, distrib=False)
+        ctx = conn.new_context(project='CMIP6', facets='project')
+        list(ctx.search(batch_size=10))
+        assert self.server.queries[len(async_queries):] == async_queries
+        assert 'variable' not in async_queries[0]['fields'].split(',')
+
+    def test_fetch_async(self):
+        async def search(conn):
+            results = await conn.new_context().search(
+                batch_size=10, ignore_facet_check=True)
+            result = await results.get(0)
+            assert 'variable' not in result.json
+            assert result.json.get('variable', []) == []
+            with pytest.raises(EsgfSearchException):
+                result.json['variable']
+            await result.json.fetch_async()
+            return result.json['variable']
+
+        assert self._run(search, distrib=False) == ['tas']
+
+    def test_monitor_shards(self):
+        async def search(conn):
+            conn.monitor_shards()
+
+        with pytest.raises(TypeError):
+            self._run(search)
+
+    def test_files_by_dataset(self):
+        async def search(conn):
+            conn.new_context().files_by_dataset()
+
+        with pytest.raises(TypeError):
+            self._run(search)
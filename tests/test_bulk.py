@@ -0,0 +1,64 @@
+"""
+Test the retrieval of the files of many datasets at once
+
+"""
+
+from unittest import TestCase
+
+import pytest
+
+from pyesgf.search.bulk import files_by_dataset, _chunk_ids
+from pyesgf.search.connection import SearchConnection
+from pyesgf.search.results import DatasetResult
+
+
+def _index_node(i):
+    return 'node-a' if i < 3 else 'node-b'
+
+
+def _dataset_id(i):
+    return 'cmip6.ds%d.v1|%s' % (i, _index_node(i))
+
+
+@pytest.mark.usefixtures('search_service')
+class TestFilesByDataset(TestCase):
+    # One file in each dataset but the last, which has two
+    docs = [{'id': 'f%d.nc|data' % i, 'dataset_id': _dataset_id(min(i, 4))}
+            for i in range(6)]
+
+    def test_files_by_dataset(self):
+        conn = SearchConnection(self.url)
+        conn._available_shards = {'node-a': [(None, 'solr')],
+                                  'node-b': [('8983', 'solr')]}
+        context = conn.new_context(search_type='Dataset')
+        datasets = [DatasetResult({'id': _dataset_id(i),
+                                   'index_node': _index_node(i)}, context)
+                    for i in range(5)]
+
+        # Room for the encoded constraints of two datasets per search
+        files = files_by_dataset(conn, datasets, max_workers=2,
+                                 max_query_length=70)
+        assert list(files) == [_dataset_id(i) for i in range(5)]
+        assert [[f.file_id for f in dataset_files]
+                for dataset_files in files.values()] == [
+            ['f0.nc|data'], ['f1.nc|data'], ['f2.nc|data'], ['f3.nc|data'],
+            ['f4.nc|data', 'f5.nc|data']]
+
+        chunks = sorted((query['shards'], query['dataset_id'])
+                        for query in self.server.queries
+                        if isinstance(query['dataset_id'], list))
+        assert chunks == [
+            ('node-a/solr', [_dataset_id(0), _dataset_id(1)]),
+            ('node-b:8983/solr', [_dataset_id(3), _dataset_id(4)])]
+        assert [(query['shards'], query['dataset_id'])
+                for query in self.server.queries
+                if isinstance(query['dataset_id'], str)] == [
+            ('node-a/solr', _dataset_id(2))]
+
+
+class TestChunkIds(TestCase):
+    def test_chunk_ids(self):
+        # Each id takes 9 characters as a drs_id, 13 as a dataset_id
+        ids = ['a', 'b', 'c']
+        assert list(_chunk_ids(ids, 27, 'drs_id')) == [['a', 'b', 'c']]
+        assert list(_chunk_ids(ids, 27)) == [['a', 'b'], ['c']]
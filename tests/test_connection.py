@@ -10,8 +10,11 @@ import pytest
 from pyesgf.search.connection import SearchConnection
 import pyesgf.search.exceptions as exc
 from unittest import TestCase
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 import os
 import datetime
+import json
 
 
 class TestConnection(TestCase):
@@ -83,3 +86,199 @@ class TestConnection(TestCase):
         with SearchConnection(self.test_service, session=session) as conn:
             context = conn.new_context(project='cmip5')
         assert context.facet_constraints['project'] == 'cmip5'
+
+    def test_keep_alive(self):
+        conn = SearchConnection(self.test_service, keep_alive=True)
+        conn.send_search({}, limit=0)
+        session = conn.session
+        conn.send_search({}, limit=0)
+        assert conn.session is session
+        conn.close()
+        assert not conn._isopen
+
+    def test_idle_timeout(self):
+        conn = SearchConnection(self.test_service, keep_alive=True,
+                                idle_timeout=0)
+        conn.send_search({}, limit=0)
+        session = conn.session
+        conn.send_search({}, limit=0)
+        assert conn.session is not session
+        conn.close()
+
+    def test_canonical_query(self):
+        conn = SearchConnection(self.test_service)
+        q1 = conn._canonical_query({'project': 'CMIP5',
+                                    'model': ['IPSL-CM5A-LR', 'IPSL-CM5A-MR'],
+                                    'latest': True,
+                                    'facets': 'project,model'})
+        q2 = conn._canonical_query({'model': ['IPSL-CM5A-MR', 'IPSL-CM5A-LR'],
+                                    'latest': 'true',
+                                    'facets': 'model,project',
+                                    'project': 'CMIP5'})
+        q3 = conn._canonical_query({'project': 'CMIP5',
+                                    'model': 'IPSL-CM5A-LR',
+                                    'latest': True,
+                                    'facets': 'project,model'})
+        assert q1 == q2
+        assert q1 != q3
+
+    def test_counts_cache_shared_between_contexts(self):
+        conn = SearchConnection(self.test_service, cache=self.cache,
+                                distrib=False)
+        ctx1 = conn.new_context(project='CMIP5', model='IPSL-CM5A-LR',
+                                facets='project,model')
+        hits = ctx1.hit_count
+
+        def fail(*args, **kwargs):
+            raise AssertionError('facet counts not taken from the cache')
+
+        conn.send_search = fail
+        ctx2 = (conn.new_context(model='IPSL-CM5A-LR', facets='model,project')
+                .constrain(project='CMIP5'))
+        assert ctx2.hit_count == hits
+
+    def test_json_decoder(self):
+        import json
+        from pyesgf.search.decoders import get_json_decoder
+
+        assert get_json_decoder('json') is json.loads
+        assert get_json_decoder(json.loads) is json.loads
+        assert get_json_decoder()(b'{"a": [1, 2.5]}') == {'a': [1, 2.5]}
+        with pytest.raises(ValueError):
+            get_json_decoder('nonexistent')
+
+        conn = SearchConnection(self.test_service, json_decoder='json')
+        assert conn.json_decoder is json.loads
+
+    def test_shard_routing(self):
+        conn = SearchConnection(self.test_service, distrib=True)
+        conn._available_shards = {'a.org': [('8983', 'solr')],
+                                  'b.org': [('8983', 'solr')],
+                                  'c.org': [('8983', 'solr')]}
+        monitor = conn.monitor_shards(max_latency=5)
+
+        # Nothing known yet: query all shards
+        assert conn._route_shards(None) is None
+
+        monitor.record('a.org', latency=0.5)
+        monitor.record('b.org', latency=0.2)
+        monitor.record('c.org', latency=0.3)
+        assert conn._route_shards(None) is None
+
+        monitor.record('a.org', error=IOError('timed out'))
+        monitor.record('c.org', latency=20)
+        assert not monitor.is_healthy('a.org')
+        assert conn._route_shards(None) == ['b.org']
+        assert conn._route_shards(['a.org', 'c.org']) == ['a.org', 'c.org']
+        assert monitor.stats['a.org'].n_errors == 1
+
+        monitor.record('a.org', latency=0.5)
+        assert conn._route_shards(None) == ['b.org', 'a.org']
+
+    def test_pickle(self):
+        import copy
+        import pickle
+
+        conn = SearchConnection(self.test_service, keep_alive=True,
+                                rate_limit=5, retry=2)
+        conn.monitor_shards(max_latency=5)
+        conn.open()
+        ctx = conn.new_context(project='CMIP5', facets='project')
+        conn._counts_cache.set('query', 'counts')
+
+        for new_ctx in (pickle.loads(pickle.dumps(ctx)), copy.deepcopy(ctx)):
+            new_conn = new_ctx.connection
+            assert new_ctx.facet_constraints['project'] == 'CMIP5'
+            assert new_conn.url == self.test_service
+            assert new_conn.retry.max_retries == 2
+            assert new_conn.throttle.rate == 5
+            assert new_conn.shard_monitor.connection is new_conn
+            assert not new_conn._isopen
+            assert len(new_conn._counts_cache) == 0
+
+            new_conn._ensure_open()
+            new_conn._release()
+            assert new_conn._isopen
+            new_conn.close()
+        conn.close()
+
+    def test_shard_cache(self):
+        import shutil
+        import tempfile
+        from pyesgf.search.cache import ShardListCache
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            shards = {'esgf.ceda.ac.uk': [('8983', 'solr')]}
+            ShardListCache(cache_dir).set(self.test_service, shards)
+
+            # Another process finds the shards without a query
+            conn = SearchConnection(self.test_service, shard_cache=cache_dir)
+            conn.send_search = None
+            assert conn.get_shard_list() == shards
+
+            assert ShardListCache(cache_dir).get('http://other') is None
+            assert ShardListCache(cache_dir, ttl=-1).get(
+                self.test_service) is None
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+class _ShardHandler(BaseHTTPRequestHandler):
+    # An index node with two shards, queries including b.org fail
+    queries = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        _ShardHandler.queries.append(query)
+        if 'b.org' in query.get('shards', [''])[0]:
+            self.send_error(500)
+            return
+
+        body = json.dumps({
+            'responseHeader': {'params': {
+                'shards': 'a.org:8983/solr,b.org:8983/solr'}},
+            'response': {'numFound': 0, 'start': 0, 'docs': []},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.mark.usefixtures('local_server')
+class TestShardMonitor(TestCase):
+    handler = _ShardHandler
+
+    def setUp(self):
+        _ShardHandler.queries = []
+        self.url = self.base_url + '/esg-search'
+
+    def test_probe_before_shard_list(self):
+        conn = SearchConnection(self.url, distrib=True)
+        monitor = conn.monitor_shards(probe_interval=600)
+        stats = monitor.probe()
+        assert stats['a.org'].n_errors == 0
+        assert stats['b.org'].n_errors == 1
+
+    def test_first_query_probes(self):
+        conn = SearchConnection(self.url, distrib=True)
+        conn.monitor_shards(probe_interval=600)
+        conn.send_search({'type': 'Dataset'}, limit=0)
+
+        # Discovery, two probes, then the query sent to the healthy shard
+        assert len(_ShardHandler.queries) == 4
+        assert _ShardHandler.queries[-1]['shards'] == ['a.org:8983/solr']
+
+    def test_exclusions_expire(self):
+        conn = SearchConnection(self.url, distrib=True)
+        monitor = conn.monitor_shards(max_latency=1, retry_interval=300)
+        monitor.record('a.org', latency=5)
+        monitor.record('b.org', error=Exception('probe failed'))
+        assert monitor.healthy_shards(['a.org', 'b.org']) == []
+
+        # A slow shard is used again after retry_interval, as a failing one
+        for stats in monitor.stats.values():
+            stats.last_probe -= 300
+        healthy = monitor.healthy_shards(['a.org', 'b.org'])
+        assert sorted(healthy) == ['a.org', 'b.org']
@@ -259,3 +259,82 @@ class TestContext(TestCase):
 
         context2 = context.constrain(variable='tas')
         self.assertTrue(context2.hit_count > 10)
+
+    def test_search_single_request(self):
+        conn = SearchConnection(self.test_service, cache=self.cache,
+                                distrib=False)
+        context = conn.new_context(project='CMIP5',
+                                   facets=self._test_few_facets)
+
+        calls = []
+        send_search = conn.send_search
+
+        def counting_send_search(*args, **kwargs):
+            calls.append((args, kwargs))
+            return send_search(*args, **kwargs)
+
+        conn.send_search = counting_send_search
+        results = context.search()
+        assert len(results) == context.hit_count
+        assert results[0].json['project'] == ['CMIP5']
+        assert len(calls) == 1
+
+    def test_constrain_shares_connection(self):
+        conn = SearchConnection(self.test_service, cache=self.cache)
+        context = conn.new_context(project='CMIP5', query='humidity')
+
+        context2 = context.constrain(model='IPSL-CM5A-LR')
+        assert context2.connection is conn
+        assert 'model' not in context.facet_constraints
+        assert context2.temporal_constraint is context.temporal_constraint
+
+        context3 = context2.constrain(from_timestamp='2000-01-01T00:00:00Z')
+        assert context3.facet_constraints is context2.facet_constraints
+        assert context2.temporal_constraint == [None, None]
+
+    def test_last_update_constraint(self):
+        conn = SearchConnection(self.test_service, cache=self.cache)
+        context = conn.new_context(project='CMIP5')
+
+        context2 = context.constrain(**{'from': '2020-01-01T00:00:00Z'})
+        assert context.last_update_constraint == (None, None)
+        query_dict = context2._build_query()
+        assert query_dict['from'] == '2020-01-01T00:00:00Z'
+        assert query_dict['to'] is None
+        assert 'from' not in context2.facet_constraints
+
+
+@pytest.mark.usefixtures('search_service')
+class TestContextSearch(TestCase):
+    docs = [{'id': 'ds%02d|node' % i, 'project': ['CMIP6'], 'url': []}
+            for i in range(15)]
+
+    def setUp(self):
+        os.environ['ESGF_PYCLIENT_NO_FACETS_STAR_WARNING'] = '1'
+
+    def tearDown(self):
+        del os.environ['ESGF_PYCLIENT_NO_FACETS_STAR_WARNING']
+
+    def test_counts_with_first_batch(self):
+        conn = SearchConnection(self.url, distrib=True)
+        results = conn.new_context(facets='project').search(batch_size=10)
+        assert results.context.hit_count == 15
+        assert len(list(results)) == 15
+        # The counts come with the first batch
+        assert [q['limit'] for q in self.server.queries] == ['10', '10']
+
+    def test_separate_counts_for_distributed_facets_star(self):
+        conn = SearchConnection(self.url, distrib=True)
+        results = conn.new_context().search(batch_size=10)
+        assert results.context.facet_counts['project'] == {'CMIP6': 15}
+        assert len(list(results)) == 15
+
+        # The results are all retrieved with the same query
+        queries = self.server.queries
+        assert (queries[0]['facets'], queries[0]['limit']) == ('*', '0')
+        assert [q.get('facets') for q in queries[1:]] == [None, None]
+
+        conn = SearchConnection(self.url, distrib=False)
+        conn.new_context().search(batch_size=10)
+        assert queries[-1]['facets'] == '*'
+        assert queries[-1]['limit'] == '10'
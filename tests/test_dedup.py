@@ -0,0 +1,75 @@
+"""
+Test the removal of duplicate records from search results
+
+"""
+
+from unittest import TestCase
+
+import pytest
+
+from pyesgf.exceptions import DuplicateHashError
+from pyesgf.search.dedup import DuplicateIndex, iter_unique
+from pyesgf.search.results import DatasetResult, FileResult
+
+
+def _file(node, checksum, tracking_id, replica=True):
+    return FileResult({
+        'id': 'f.nc|%s' % node, 'checksum': [checksum],
+        'tracking_id': [tracking_id], 'replica': replica,
+        'url': ['http://%s/f.nc|application/netcdf|HTTPServer' % node]}, None)
+
+
+class TestDedup(TestCase):
+    def test_iter_unique(self):
+        results = [_file('a', 'c1', 't1'), _file('b', 'c1', 't1', False),
+                   _file('c', 'c2', 't2'), _file('d', 'c1', 't1')]
+        unique = list(iter_unique(results))
+        assert [r.json['id'] for r in unique] == ['f.nc|b', 'f.nc|c']
+        assert [url for url, mime in unique[0].urls['HTTPServer']] == [
+            'http://b/f.nc', 'http://a/f.nc', 'http://d/f.nc']
+
+        # Late duplicates are dropped without merging
+        results = [_file('a', 'c1', 't1'), _file('c', 'c2', 't2'),
+                   _file('d', 'c1', 't1')]
+        unique = list(iter_unique(results, window=1))
+        assert len(unique) == 2
+        assert len(unique[0].urls['HTTPServer']) == 1
+
+        with pytest.raises(DuplicateHashError):
+            list(iter_unique([_file('a', 'c1', 't1'), _file('b', 'c3', 't1')],
+                             strict=True))
+
+    def test_iter_unique_partial(self):
+        # A replica without a tracking_id is merged with the master copy
+        replica = _file('a', 'c1', None)
+        del replica.json['tracking_id']
+        unique = list(iter_unique([_file('b', 'C1', 't1', False), replica]))
+        assert [r.json['id'] for r in unique] == ['f.nc|b']
+
+        # Identical fx files of two datasets are both kept
+        results = [FileResult({'id': '%s.orog_fx.nc|node' % ds,
+                               'instance_id': '%s.orog_fx.nc' % ds,
+                               'title': 'orog_fx.nc', 'checksum': ['c1'],
+                               'url': []}, None)
+                   for ds in ('historical', 'piControl')]
+        assert len(list(iter_unique(results))) == 2
+
+    def test_iter_unique_key(self):
+        docs = [{'id': 'ds.v1|a', 'instance_id': 'ds.v1', 'url': []},
+                {'id': 'ds.v1|b', 'instance_id': 'ds.v1', 'url': []},
+                {'id': 'other|a', 'url': []},
+                {'id': 'other|a', 'url': []}]
+        results = [DatasetResult(doc, None) for doc in docs]
+        unique = list(iter_unique(results,
+                                  key=lambda doc: doc.get('instance_id')))
+        assert [r.json['id'] for r in unique] == ['ds.v1|a', 'other|a',
+                                                  'other|a']
+
+    def test_duplicate_index(self):
+        index = DuplicateIndex()
+        assert index.add(('f.nc', 'c1'))
+        assert not index.add(('f.nc', 'c1'))
+        # hash(-1) == hash(-2) but the keys are distinct
+        assert index.add(-1)
+        assert index.add(-2)
+        assert len(index) == 3
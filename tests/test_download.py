@@ -0,0 +1,257 @@
+"""
+Test the download engine against a local HTTP server
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+
+import pytest
+
+from pyesgf.download import Downloader
+from pyesgf.download.checksum import CHECKSUM_SUFFIX
+from pyesgf.download.exceptions import EsgfChecksumException
+from pyesgf.download.mirrors import MirrorPlanner
+from pyesgf.download.sync import SyncIndex
+from pyesgf.search.connection import SearchConnection
+from pyesgf.search.results import FileResult
+
+
+DATA = dict(('file%d.nc' % i, os.urandom(10000 + i)) for i in range(6))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = DATA.get(self.path.lstrip('/'))
+        if data is None:
+            self.send_error(404)
+            return
+
+        mo = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if mo:
+            start = int(mo.group(1))
+            end = int(mo.group(2)) if mo.group(2) else len(data) - 1
+            if start >= len(data):
+                self.send_error(416)
+                return
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, end, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.mark.usefixtures('local_server')
+class TestDownloader(TestCase):
+    handler = _Handler
+
+    def setUp(self):
+        self.dest_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_dir)
+
+    def _file(self, name, size=None, checksum=None):
+        doc = {
+            'id': name, 'title': name,
+            'size': len(DATA[name]) if size is None else size,
+            'url': ['%s/%s|application/netcdf|HTTPServer' % (self.base_url,
+                                                             name)],
+        }
+        if checksum is not None:
+            doc['checksum'] = [checksum]
+            doc['checksum_type'] = ['SHA256']
+        return FileResult(doc, None)
+
+    def _read(self, name):
+        with open(os.path.join(self.dest_dir, name), 'rb') as fh:
+            return fh.read()
+
+    def test_download(self):
+        progress = []
+        downloader = Downloader(max_workers=3, max_per_host=2,
+                                chunk_size=1000,
+                                progress=lambda p: progress.append(p.filename))
+        results = downloader.download([self._file(name) for name in DATA],
+                                      self.dest_dir)
+
+        assert [r.status for r in results] == ['done'] * len(DATA)
+        for name, data in DATA.items():
+            assert self._read(name) == data
+        assert downloader.bytes_transferred == sum(map(len, DATA.values()))
+        assert set(progress) == set(DATA)
+
+        results = downloader.download([self._file('file0.nc')], self.dest_dir)
+        assert results[0].status == 'skipped'
+
+    def test_resume(self):
+        data = DATA['file1.nc']
+        with open(os.path.join(self.dest_dir, 'file1.nc.part'), 'wb') as fh:
+            fh.write(data[:4000])
+
+        result = Downloader().download_file(self._file('file1.nc'),
+                                            self.dest_dir)
+        assert result.status == 'done'
+        assert result.bytes_transferred == len(data) - 4000
+        assert self._read('file1.nc') == data
+
+    def test_failure(self):
+        results = Downloader().download([self._file('file2.nc', size=5)],
+                                        self.dest_dir)
+        assert results[0].status == 'failed'
+        assert results[0].error is not None
+
+    def test_checksum(self):
+        data = DATA['file3.nc']
+        checksum = hashlib.sha256(data).hexdigest()
+        with open(os.path.join(self.dest_dir, 'file3.nc.part'), 'wb') as fh:
+            fh.write(data[:3000])
+
+        downloader = Downloader()
+        result = downloader.download_file(self._file('file3.nc',
+                                                     checksum=checksum),
+                                          self.dest_dir)
+        assert result.status == 'done'
+        assert result.checksum_verified
+        assert os.path.exists(os.path.join(self.dest_dir,
+                                           'file3.nc' + CHECKSUM_SUFFIX))
+
+        result = downloader.download_file(self._file('file3.nc',
+                                                     checksum=checksum),
+                                          self.dest_dir)
+        assert result.status == 'skipped'
+        assert result.checksum_verified
+
+    def test_checksum_mismatch(self):
+        file = self._file('file4.nc', checksum='0' * 64)
+        with self.assertRaises(EsgfChecksumException):
+            Downloader().download_file(file, self.dest_dir)
+        assert os.listdir(self.dest_dir) == []
+
+    def test_failover(self):
+        dead_url = 'http://127.0.0.1:1/file5.nc'
+        file = self._file('file5.nc')
+        file.json['url'].insert(0, '%s|application/netcdf|HTTPServer' %
+                                dead_url)
+        planner = MirrorPlanner()
+
+        result = Downloader(mirrors=planner).download_file(file,
+                                                           self.dest_dir)
+        assert result.status == 'done'
+        assert self._read('file5.nc') == DATA['file5.nc']
+
+        stats = planner.stats
+        assert stats['127.0.0.1:1'].errors == 1
+        assert stats['127.0.0.1:%d' % self.server.server_port].successes == 1
+        assert planner.urls(file)[0].startswith(self.base_url)
+
+    def test_segments(self):
+        data = DATA['file5.nc']
+        part_path = os.path.join(self.dest_dir, 'file5.nc.part')
+        with open(part_path, 'wb') as fh:
+            fh.write(data[:4000])
+
+        downloader = Downloader(max_segments=3, segment_size=1000,
+                                chunk_size=300)
+        result = downloader.download_file(
+            self._file('file5.nc', checksum=hashlib.sha256(data).hexdigest()),
+            self.dest_dir)
+        assert result.status == 'done'
+        assert result.checksum_verified
+        assert result.bytes_transferred == len(data) - 4000
+        assert self._read('file5.nc') == data
+        assert sorted(os.listdir(self.dest_dir)) == [
+            'file5.nc', 'file5.nc' + CHECKSUM_SUFFIX]
+
+    def test_segments_resume(self):
+        data = DATA['file4.nc']
+        part_path = os.path.join(self.dest_dir, 'file4.nc.part')
+        with open(part_path, 'wb') as fh:
+            fh.write(data[:1000] + bytes(1000) + data[2000:3000])
+            fh.truncate(len(data))
+        with open(part_path + '.json', 'w') as fh:
+            json.dump({'size': len(data), 'segment_size': 1000,
+                       'done': [0, 2]}, fh)
+
+        downloader = Downloader(max_segments=2, segment_size=1000)
+        result = downloader.download_file(self._file('file4.nc'),
+                                          self.dest_dir)
+        assert result.bytes_transferred == len(data) - 2000
+        assert self._read('file4.nc') == data
+
+
+class TestMirrorPlanner(TestCase):
+    def test_rank(self):
+        planner = MirrorPlanner(max_errors=2)
+        fast, slow, new = ('http://fast/f.nc', 'http://slow/f.nc',
+                           'http://new/f.nc')
+        planner.record_success(fast, 1000, 1.0)
+        planner.record_success(slow, 100, 1.0)
+        assert planner.rank([slow, new, fast]) == [fast, new, slow]
+
+        planner.record_error(fast)
+        assert planner.rank([slow, fast])[0] == fast
+        planner.record_error(fast)
+        assert not planner.is_healthy(fast)
+        assert planner.rank([fast, slow]) == [slow, fast]
+
+
+@pytest.mark.usefixtures('search_service')
+class TestMirrorReplicas(TestCase):
+    docs = [{'id': 'f.nc|%s' % node, 'checksum': [checksum],
+             'tracking_id': ['t1'],
+             'url': ['http://%s/f.nc|application/netcdf|HTTPServer' % node]}
+            for node, checksum in (('a', 'ABC'), ('b', 'ABC'))]
+
+    def test_add_replicas(self):
+        planner = MirrorPlanner(SearchConnection(self.url, distrib=False))
+        file = FileResult(dict(self.docs[0]), None)
+        planner.add_replicas([file])
+
+        # The checksum is searched for as published
+        assert self.server.queries[0]['checksum'] == 'ABC'
+        assert sorted(planner.urls(file)) == ['http://a/f.nc',
+                                              'http://b/f.nc']
+
+        # and compared regardless of case
+        file.json['checksum'] = ['abc']
+        assert 'http://b/f.nc' in planner.urls(file)
+
+
+class TestSyncIndex(TestCase):
+    def test_index(self):
+        dest_dir = tempfile.mkdtemp()
+        try:
+            file = FileResult({
+                'id': 'ds.v1.f.nc|node', 'title': 'f.nc', 'size': 10,
+                'version': ['1'], 'checksum': ['ABC'],
+                'checksum_type': ['SHA256'],
+                '_timestamp': '2020-01-01T00:00:00Z', 'url': [],
+            }, None)
+            path = os.path.join(dest_dir, 'f.nc')
+            with SyncIndex(os.path.join(dest_dir, 'index.sqlite')) as index:
+                assert index.get(path) is None
+                index.update(path, file)
+                index.set_last_timestamp('query', '2020-01-01T00:00:00Z')
+
+            with SyncIndex(os.path.join(dest_dir, 'index.sqlite')) as index:
+                record = index.get(path)
+                assert record['checksum'] == 'abc'
+                assert record['version'] == '1'
+                assert record['size'] == 10
+                assert index.last_timestamp('query') == \
+                    '2020-01-01T00:00:00Z'
+                assert index.last_timestamp('other') is None
+        finally:
+            shutil.rmtree(dest_dir)
@@ -0,0 +1,82 @@
+"""
+Test columnar export of search results
+
+"""
+
+from unittest import TestCase
+
+import pytest
+
+from pyesgf.search.connection import SearchConnection
+from pyesgf.search.export import build_columns
+
+DOCS = [
+    {'id': 'f%d.nc|node' % i, 'title': 'f%d.nc' % i, 'size': i,
+     'checksum': ['abc%d' % i], 'variable': ['tas', 'pr'],
+     'url': ['http://node/fileServer/f%d.nc|application/netcdf|'
+             'HTTPServer' % i,
+             'http://node/dodsC/f%d.nc.html|application/'
+             'opendap-html|OPENDAP' % i]}
+    for i in range(3)]
+
+COLUMNS = ['id', 'size', 'checksum', 'url', 'download_url']
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        self.docs = DOCS
+
+    def test_build_columns(self):
+        cols = build_columns(self.docs, ['id', 'size', 'checksum', 'variable',
+                                         'download_url', 'opendap_url',
+                                         'las_url', 'missing'])
+        assert cols['size'] == [0, 1, 2]
+        assert cols['checksum'] == ['abc0', 'abc1', 'abc2']
+        assert cols['variable'][0] == ['tas', 'pr']
+        assert cols['download_url'][1] == 'http://node/fileServer/f1.nc'
+        assert cols['opendap_url'][2] == 'http://node/dodsC/f2.nc'
+        assert cols['las_url'] == [None, None, None]
+        assert cols['missing'] == [None, None, None]
+
+
+@pytest.mark.usefixtures('search_service')
+class TestResultSetExport(TestCase):
+    docs = DOCS
+
+    def setUp(self):
+        conn = SearchConnection(self.url, distrib=False)
+        self.results = conn.new_context(search_type='File').search(
+            batch_size=2, ignore_facet_check=True)
+
+    def test_to_numpy(self):
+        numpy = pytest.importorskip('numpy')
+
+        array = self.results.to_numpy(COLUMNS)
+        assert array.shape == (3,)
+        assert array['size'].dtype == numpy.int64
+        assert list(array['size']) == [0, 1, 2]
+        assert array['url'][0] == DOCS[0]['url']
+        assert array['download_url'][2] == 'http://node/fileServer/f2.nc'
+
+    def test_to_pandas(self):
+        pytest.importorskip('pandas')
+
+        df = self.results.to_pandas(COLUMNS + ['variable'])
+        assert list(df.columns) == COLUMNS + ['variable']
+        assert list(df['checksum']) == ['abc0', 'abc1', 'abc2']
+        assert df['variable'][1] == ['tas', 'pr']
+
+    def test_to_arrow(self):
+        pytest.importorskip('pyarrow')
+
+        table = self.results.to_arrow(COLUMNS)
+        assert table.num_rows == 3
+        assert table.column('id').to_pylist() == [d['id'] for d in DOCS]
+        assert table.column('url').to_pylist()[1] == DOCS[1]['url']
+
+    def test_iter_record_batches(self):
+        pytest.importorskip('pyarrow')
+
+        batches = list(self.results.iter_record_batches(['id', 'size']))
+        assert [batch.num_rows for batch in batches] == [2, 1]
+        assert batches[1].column(1).to_pylist() == [2]
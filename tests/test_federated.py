@@ -0,0 +1,54 @@
+"""
+Test client-side federated searches
+
+"""
+
+import pytest
+from unittest import TestCase
+
+from pyesgf.search.federated import FederatedSearch
+
+
+@pytest.mark.usefixtures('search_service')
+class TestFederatedSearchOffline(TestCase):
+    # Both nodes are served by the same local service
+    docs = [{'id': 'cmip6.ds%d.v1|node' % i, 'instance_id': 'cmip6.ds%d.v1' % i,
+             'checksum': ['c%d' % i], 'tracking_id': ['t%d' % i],
+             'project': ['CMIP6'], 'replica': False, 'url': []}
+            for i in range(3)]
+
+    def test_iter_unique(self):
+        fs = FederatedSearch([self.url, self.base_url + '/b/esg-search'])
+        results = fs.search(batch_size=2, project='CMIP6')
+        assert not results.errors
+        assert results.hit_count == 6
+
+        unique = list(results)
+        assert sorted(r.json['instance_id'] for r in unique) == \
+            ['cmip6.ds0.v1', 'cmip6.ds1.v1', 'cmip6.ds2.v1']
+        # Two batches from each node and no per-record queries
+        assert len(self.server.queries) == 4
+
+
+class TestFederatedSearch(TestCase):
+    def setUp(self):
+        self.test_services = ['https://esgf.ceda.ac.uk/esg-search',
+                              'https://esgf-node.llnl.gov/esg-search']
+
+    @pytest.mark.slow
+    def test_federated_search(self):
+        fs = FederatedSearch(self.test_services + ['http://127.0.0.1:1/x'],
+                             timeout=30)
+        results = fs.search(batch_size=20, project='CMIP5',
+                            model='HadGEM2-ES', experiment='historical',
+                            facets='project,model')
+
+        assert list(results.errors) == ['http://127.0.0.1:1/x']
+        assert results.hit_count == sum(results.node_hit_counts.values())
+        assert results.facet_counts['model']['HadGEM2-ES'] == \
+            results.hit_count
+
+        unique = list(results)
+        instance_ids = [r.json['instance_id'] for r in unique]
+        assert len(instance_ids) == len(set(instance_ids))
+        assert len(unique) <= results.hit_count
@@ -282,3 +282,53 @@ class TestResults(TestCase):
     def test_batch_size_has_no_impact_on_results_with_few_facets(self):
         self._test_batch_size_has_no_impact_on_results(
             facets=self._test_facets)
+
+    @pytest.mark.slow
+    def test_prefetch_has_no_impact_on_results(self):
+        conn = SearchConnection(self.test_service, distrib=False)
+
+        ctx = conn.new_context(project='CMIP5', facets=self._test_facets)
+        results = ctx.search(batch_size=10, ignore_facet_check=True)
+        expected = [r.dataset_id for r in results[:40]]
+
+        results = ctx.search(batch_size=10, ignore_facet_check=True,
+                             prefetch=3)
+        assert [r.dataset_id for r in results[:40]] == expected
+        results.close()
+
+    @pytest.mark.slow
+    def test_iter_cursor(self):
+        conn = SearchConnection(self.test_service, distrib=False)
+
+        ctx = conn.new_context(project='CMIP5', model='HadGEM2-ES',
+                               experiment='historical',
+                               facets=self._test_facets)
+        results = ctx.search(batch_size=10, ignore_facet_check=True)
+        ids = [r.dataset_id for r in results.iter_cursor()]
+
+        assert conn._cursor_supported is not None
+        assert sorted(ids) == sorted(r.dataset_id for r in results)
+
+    @pytest.mark.slow
+    def test_files_by_dataset(self):
+        conn = SearchConnection(self.test_service, distrib=False)
+
+        ctx = conn.new_context(project='CMIP5', model='HadGEM2-ES',
+                               experiment='historical', realm='atmos',
+                               facets=self._test_facets)
+        datasets = ctx.search(batch_size=10)[:10]
+        files = ctx.search(batch_size=10).files_by_dataset(max_workers=2)
+
+        for dataset in datasets:
+            f_ids = sorted(f.file_id for f in dataset.file_context().search())
+            assert sorted(f.file_id for f in files[dataset.dataset_id]) == f_ids
+
+    def test_projected_fields_fetched_on_demand(self):
+        conn = SearchConnection(self.test_service, distrib=False)
+
+        ctx = conn.new_context(project='CMIP5', facets=self._test_facets)
+        r1 = ctx.search()[0]
+        assert 'model' not in r1.json
+        assert r1.json.get('model') is None
+        assert r1.json['model']
+        assert 'model' in r1.json
@@ -0,0 +1,152 @@
+"""
+Test ResultSet and the result classes against a local search service
+
+"""
+
+from unittest import TestCase
+
+import pytest
+
+from pyesgf.search import export
+from pyesgf.search.connection import SearchConnection
+from pyesgf.search.results import FileResult
+
+
+def _file_doc(i):
+    # CMIP5 style records have no tracking_id
+    return {
+        'id': 'cmip5.ds.v1.tas_%02d.nc|node' % i,
+        'dataset_id': 'cmip5.ds.v1|node',
+        'title': 'tas_%02d.nc' % i,
+        'size': 1000 + i,
+        'checksum': ['%064x' % i],
+        'checksum_type': ['SHA256'],
+        'variable': ['tas'],
+        'url': ['http://node/fileServer/tas_%02d.nc|application/netcdf|'
+                'HTTPServer' % i],
+    }
+
+
+@pytest.mark.usefixtures('search_service')
+class TestResultSet(TestCase):
+    docs = [_file_doc(i) for i in range(25)]
+
+    def _search(self, prefetch=0, **kwargs):
+        conn = SearchConnection(self.url, distrib=False)
+        ctx = conn.new_context(search_type='File', **kwargs)
+        return ctx.search(batch_size=10, ignore_facet_check=True,
+                          prefetch=prefetch)
+
+    def test_projected_fields(self):
+        results = self._search()
+        queries = self.server.queries
+        assert 'variable' not in queries[0]['fields'].split(',')
+
+        # Requested fields absent from a record are not fetched again
+        files = list(results)
+        assert [f.tracking_id for f in files] == [None] * 25
+        assert files[0].json.get('version') is None
+        n_queries = len(queries)
+
+        # Other fields are only fetched by [], once per record
+        assert files[0].json.get('variable') is None
+        assert files[0].json.get('variable', []) == []
+        assert 'variable' not in files[1].json
+        assert len(queries) == n_queries
+        assert files[2].json['variable'] == ['tas']
+        assert len(queries) == n_queries + 1
+        assert 'variable' in files[2].json
+        assert files[2].json.get('variable') == ['tas']
+        assert files[2].json['variable'] == ['tas']
+        assert len(queries) == n_queries + 1
+
+    def test_prefetch(self):
+        results = self._search(prefetch=2)
+        assert [f.file_id for f in results] == \
+            [doc['id'] for doc in self.docs]
+        offsets = [query['offset'] for query in self.server.queries]
+        assert sorted(offsets) == ['0', '10', '20']
+        assert results._ResultSet__executor is None
+
+        # Stopping early cancels the prefetches and shuts the threads down
+        del self.server.queries[:]
+        results = self._search(prefetch=2)
+        for i, f in enumerate(results):
+            if i == 12:
+                break
+        assert results._ResultSet__executor is None
+        assert not results._ResultSet__pending
+        offsets = [query['offset'] for query in self.server.queries]
+        assert len(offsets) == len(set(offsets))
+
+    def test_iter_cursor_fallback(self):
+        results = self._search()
+        ids = [f.file_id for f in results.iter_cursor()]
+        assert ids == [doc['id'] for doc in self.docs]
+        assert results.context.connection._cursor_supported is False
+
+        # Only the first batch, retrieved by search(), is cached
+        assert list(results._ResultSet__batch_cache) == [0]
+
+    def test_default_columns_exported(self):
+        results = self._search()
+        list(results)
+        n_queries = len(self.server.queries)
+
+        batches = list(export.iter_column_batches(results))
+        assert [len(cols['id']) for cols in batches] == [10, 10, 5]
+        assert batches[0]['download_url'][0] == \
+            'http://node/fileServer/tas_00.nc'
+        assert batches[0]['opendap_url'] == [None] * 10
+        # The cached batches are reused without per-record queries
+        assert len(self.server.queries) == n_queries
+
+    def test_projected_fields_exported(self):
+        pytest.importorskip('pandas')
+
+        df = self._search().to_pandas(columns=['id', 'variable'])
+        assert list(df['variable']) == ['tas'] * 25
+        # One query per batch, including the first one again
+        assert len(self.server.queries) == 1 + 3
+
+
+@pytest.mark.usefixtures('search_service')
+class TestDatasetResultSet(TestCase):
+    # A master and a replica of each dataset
+    docs = [{'id': 'cmip6.ds%d.v1|%s' % (i, node),
+             'instance_id': 'cmip6.ds%d.v1' % i,
+             'replica': node != 'a', 'url': []}
+            for i in range(3) for node in 'ab']
+    cursor = True
+
+    def test_iter_unique(self):
+        conn = SearchConnection(self.url, distrib=False)
+        results = conn.new_context(search_type='Dataset').search(
+            batch_size=4, ignore_facet_check=True)
+        unique = list(results.iter_unique())
+        assert [r.json['id'] for r in unique] == [
+            'cmip6.ds0.v1|a', 'cmip6.ds1.v1|a', 'cmip6.ds2.v1|a']
+        # search() and three cursor pages, the last one empty, without
+        # per-record queries
+        assert len(self.server.queries) == 4
+        assert not any('id' in query for query in self.server.queries)
+
+
+class TestResults(TestCase):
+    def test_urls_parsed_once(self):
+        doc = {'id': 'f.nc', 'url': [
+            'http://host/fileServer/f.nc|application/netcdf|HTTPServer',
+            'http://host/dodsC/f.nc.html|application/opendap-html|OPENDAP']}
+        result = FileResult(doc, None)
+        assert result.urls is result.urls
+        assert result.download_url == 'http://host/fileServer/f.nc'
+        assert result.opendap_url == 'http://host/dodsC/f.nc'
+        assert not hasattr(result, '__dict__')
+
+    def test_add_default_fields(self):
+        default_fields = FileResult.default_fields
+        try:
+            FileResult.add_default_fields('variable', 'id')
+            assert FileResult.default_fields == default_fields + ('variable',)
+        finally:
+            FileResult.default_fields = default_fields
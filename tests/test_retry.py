@@ -0,0 +1,122 @@
+"""
+Test retrying failed queries and resuming iteration against a local HTTP
+server
+
+"""
+
+import json
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+import requests
+
+from pyesgf.search import SearchConnection
+from pyesgf.search.retry import RetryPolicy, parse_retry_after
+
+
+N_DOCS = 25
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Number of requests to fail before answering, and the offset to fail
+    # at.  If truncate is True failed responses are cut short instead of
+    # returning HTTP 503.
+    failures = 0
+    fail_offset = None
+    truncate = False
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', ['10'])[0])
+        cls = _Handler
+
+        if cls.failures and (cls.fail_offset is None or
+                             cls.fail_offset == offset):
+            cls.failures -= 1
+            if cls.truncate:
+                self.send_response(200)
+                self.send_header('Content-Length', '1000')
+                self.end_headers()
+                self.wfile.write(b'{"response": ')
+                return
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+
+        docs = [{'id': 'ds%02d|node' % i, 'url': []}
+                for i in range(offset, min(offset + limit, N_DOCS))]
+        body = json.dumps({'responseHeader': {},
+                           'response': {'numFound': N_DOCS, 'start': offset,
+                                        'docs': docs}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.mark.usefixtures('local_server')
+class TestRetry(TestCase):
+    handler = _Handler
+
+    def setUp(self):
+        _Handler.failures = 0
+        _Handler.fail_offset = None
+        _Handler.truncate = False
+        self.url = self.base_url + '/esg-search'
+
+    def test_retry(self):
+        _Handler.failures = 2
+        conn = SearchConnection(self.url, distrib=False,
+                                retry=RetryPolicy(max_retries=2, backoff=0))
+        response = conn.send_search({'type': 'Dataset'}, limit=5)
+        assert len(response['response']['docs']) == 5
+
+        _Handler.failures = 3
+        with pytest.raises(requests.HTTPError):
+            conn.send_search({'type': 'Dataset'}, limit=5)
+
+    def test_retry_truncated(self):
+        _Handler.failures = 1
+        _Handler.truncate = True
+        conn = SearchConnection(self.url, distrib=False,
+                                retry=RetryPolicy(max_retries=1, backoff=0))
+        response = conn.send_search({'type': 'Dataset'}, limit=5)
+        assert len(response['response']['docs']) == 5
+
+    def test_no_retry_by_default(self):
+        _Handler.failures = 1
+        conn = SearchConnection(self.url, distrib=False)
+        with pytest.raises(requests.HTTPError):
+            conn.send_search({'type': 'Dataset'}, limit=5)
+
+    def test_deadline(self):
+        policy = RetryPolicy(max_retries=10, backoff=5, deadline=1)
+        assert policy.next_delay(0, 0) is None
+        assert policy.timeout(120, float('inf')) > 0
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after('3') == 3
+        assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+        assert parse_retry_after('soon') is None
+
+    def test_iter_from(self):
+        conn = SearchConnection(self.url, distrib=False)
+        results = conn.new_context(facets='project').search(
+            batch_size=10, ignore_facet_check=True)
+
+        _Handler.failures = 1
+        _Handler.fail_offset = 20
+        seen = []
+        with pytest.raises(requests.HTTPError):
+            for result in results.iter_from():
+                seen.append(result.json['id'])
+        assert len(seen) == 20
+        assert results.resume_index == 20
+
+        for result in results.iter_from(results.resume_index):
+            seen.append(result.json['id'])
+        assert seen == ['ds%02d|node' % i for i in range(N_DOCS)]
@@ -0,0 +1,53 @@
+"""
+Test incremental decoding of search responses
+
+"""
+
+import json
+
+import pytest
+from unittest import TestCase
+
+from pyesgf.search.streaming import StreamingSearchResponse
+from pyesgf.search.exceptions import EsgfSearchException
+
+
+def _chunks(data, size):
+    data = data.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestStreamingSearchResponse(TestCase):
+    def setUp(self):
+        self.response = {
+            'responseHeader': {'status': 0, 'params': {'shards': 'a/solr'}},
+            'response': {'numFound': 12345, 'start': 0, 'maxScore': 1.0,
+                         'docs': [{'id': 'doc%d' % i, 'size': 10 ** i,
+                                   'title': u'café %d' % i,
+                                   'url': ['http://x/%d|a/b|HTTPServer' % i]}
+                                  for i in range(20)]},
+            'facet_counts': {'facet_fields': {'project': ['CMIP6', 3]}},
+        }
+        self.body = json.dumps(self.response, indent=1)
+
+    def test_docs(self):
+        for size in (1, 7, 1024, len(self.body)):
+            closed = []
+            resp = StreamingSearchResponse(_chunks(self.body, size),
+                                           on_close=lambda: closed.append(1))
+            assert resp.num_found == 12345
+            assert resp.response_header == self.response['responseHeader']
+            assert list(resp) == self.response['response']['docs']
+            assert resp.response['maxScore'] == 1.0
+            assert resp.facet_counts == self.response['facet_counts']
+            assert closed == [1]
+
+    def test_facet_counts_before_docs(self):
+        resp = StreamingSearchResponse(_chunks(self.body, 13))
+        assert resp.facet_counts == self.response['facet_counts']
+        with pytest.raises(EsgfSearchException):
+            list(resp)
+
+    def test_truncated(self):
+        with pytest.raises(ValueError):
+            list(StreamingSearchResponse(_chunks(self.body[:-40], 100)))
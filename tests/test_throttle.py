@@ -0,0 +1,88 @@
+"""
+Test the client-side rate and concurrency limits against a local HTTP server
+
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+
+import pytest
+
+from pyesgf.search import SearchConnection
+from pyesgf.search.throttle import RequestThrottle, TokenBucket
+
+
+class _Handler(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    delay = 0.05
+
+    def do_GET(self):
+        cls = _Handler
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.in_flight -= 1
+
+        body = json.dumps({'responseHeader': {},
+                           'response': {'numFound': 0, 'start': 0,
+                                        'docs': []}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.mark.usefixtures('local_server')
+class TestThrottle(TestCase):
+    handler = _Handler
+
+    def setUp(self):
+        _Handler.in_flight = _Handler.max_in_flight = 0
+        _Handler.delay = 0.05
+        self.url = self.base_url + '/esg-search'
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert 0.05 < bucket.reserve() <= 0.1
+
+        bucket.pause(1)
+        assert bucket.reserve() > 0.9
+
+    def test_max_in_flight(self):
+        conn = SearchConnection(self.url, distrib=False, max_in_flight=2)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda i: conn.send_search({'type': 'Dataset'}, limit=0),
+                range(8)))
+        assert _Handler.max_in_flight == 2
+
+    def test_rate_limit(self):
+        _Handler.delay = 0
+        conn = SearchConnection(self.url, distrib=False, rate_limit=20)
+        start = time.monotonic()
+        for i in range(25):
+            conn.send_search({'type': 'Dataset'}, limit=0)
+        # 20 requests are sent at once, the remaining 5 at 20 per second
+        assert time.monotonic() - start >= 0.24
+
+    def test_shared(self):
+        throttle = RequestThrottle(max_in_flight=1)
+        conn1 = SearchConnection(self.url, distrib=False, throttle=throttle)
+        conn2 = SearchConnection(self.url, distrib=False, throttle=throttle)
+        assert conn1.throttle.host(conn1.url) is throttle.host(conn2.url)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(
+                lambda conn: conn.send_search({'type': 'Dataset'}, limit=0),
+                [conn1, conn2] * 2))
+        assert _Handler.max_in_flight == 1
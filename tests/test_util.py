@@ -8,7 +8,7 @@ import pytest
 import re
 
 from pyesgf.search.connection import SearchConnection
-from pyesgf.util import get_manifest, ats_url
+from pyesgf.util import get_manifest, get_manifests, ats_url, _first
 from unittest import TestCase
 
 
@@ -20,6 +20,11 @@ class TestUtil(TestCase):
     def test_ats_url(self):
         assert ats_url('https://esgf-node.llnl.gov') == 'https://esgf-node.llnl.gov/esgf-idp/saml/soap/secure/attributeService.htm'  # noqa
 
+    def test_first(self):
+        assert _first(['a', 'b']) == 'a'
+        assert _first([]) is None
+        assert _first(3) == 3
+
     @pytest.mark.slow
     def test_get_manifest(self):
         conn = SearchConnection(self.test_service, distrib=False)
@@ -33,6 +38,16 @@ class TestUtil(TestCase):
                                                   '6227114df095d9162a2a3f044'
                                                   'bc01f881b532ce')
 
+    @pytest.mark.slow
+    def test_get_manifests(self):
+        conn = SearchConnection(self.test_service, distrib=False)
+
+        drs_id = 'GeoMIP.output.MOHC.HadGEM2-ES.G1.day.atmos.day.r1i1p1'
+        manifests = dict(get_manifests([(drs_id, 20120223)], conn))
+
+        assert manifests == {(drs_id, '20120223'):
+                             get_manifest(drs_id, 20120223, conn)}
+
     # !TODO: this test belongs somewhere else
     def test_opendap_url(self):
         conn = SearchConnection(self.test_service, distrib=False)
@@ -68,3 +83,30 @@ class TestUtil(TestCase):
         download_url = files[0].download_url
         print("Download URL is: ", download_url)
         assert re.match(r'https://.*\.nc', download_url)
+
+
+@pytest.mark.usefixtures('search_service')
+class TestGetManifests(TestCase):
+    docs = [{'id': 'ds%d.v1|node' % i, 'drs_id': ['ds%d' % i],
+             'version': '1'} for i in range(2)] + \
+        [{'id': 'f%d.nc|node' % i, 'dataset_id': 'ds%d.v1|node' % (i // 2),
+          'title': 'f%d.nc' % i, 'size': 10 * i, 'checksum': ['c%d' % i],
+          'checksum_type': ['SHA256']} for i in range(4)]
+
+    def test_get_manifests(self):
+        conn = SearchConnection(self.url, distrib=False)
+        manifests = dict(get_manifests([('ds0', 1), ('ds1', '1')], conn))
+        assert sorted(manifests) == [('ds0', '1'), ('ds1', '1')]
+        assert manifests[('ds1', '1')] == {
+            'f2.nc': {'checksum_type': 'SHA256', 'checksum': 'c2',
+                      'size': 20},
+            'f3.nc': {'checksum_type': 'SHA256', 'checksum': 'c3',
+                      'size': 30}}
+
+        # One search for the datasets and one for their files
+        assert [query['drs_id'] for query in self.server.queries
+                if 'drs_id' in query] == [['ds0', 'ds1']]
+        assert len(self.server.queries) == 2
+
+        with pytest.raises(ValueError):
+            dict(get_manifests([('ds2', 1)], conn))